@@ -0,0 +1,610 @@
+"""Traitement par lots (non interactif) d'un dossier d'images."""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import csv
+import glob
+import json
+import os
+import time
+
+from PIL import Image
+
+from image_processor import (
+    apply_grayscale,
+    cell_variances,
+    choose_draft_scale,
+    compute_integral_images,
+    compute_mse,
+    image_to_color_grid,
+    load_image_reduced,
+    load_image_to_array,
+)
+from instrumentation import Profiler, use_profiler
+from metrics import psnr_from_mse
+from optimizer import optimize_shapes, render_placements
+from quadtree import image_to_quadtree_grid
+from render import BLENDS, paint_image, render_image, save_image
+from result_cache import DEFAULT_MAX_BYTES, ResultCache, cache_key
+from scene import grid_to_scene, save_scene
+from shapes import create_shape
+from streaming import render_streaming
+from svg_export import grid_to_svg, placements_to_svg
+from tessellation import TILINGS, image_to_tiled_grid, tile_shape
+
+IMAGE_EXTENSIONS = ("png", "jpg", "jpeg")
+
+# Estimation de la mémoire de pointe d'une image, en octets par pixel et par canal.
+# La source uint8 (1) vit pendant tout le traitement. L'analyse construit la table de
+# sommes cumulées int64 sat (8), cumulée sur place ; le quadtree et l'ordre 'variance'
+# y ajoutent la table des carrés sat_sq (8) et quelques cartes communes à tous les
+# canaux (10).
+# Le rendu alloue le canvas float32 (4), l'image de sortie (1), la copie float32 et uint8
+# de np.clip (4 + 1) et la copie MSE (1), plus la weight_map float32 (4), son np.maximum
+# (4) et les tampons de compute_error (1), communs aux canaux. Les cellules de tailles
+# variées du quadtree ne partagent pas leurs masques float32 dans le cache : ils
+# couvrent plusieurs fois l'image (28). Toutes les analyses d'une image (et les variances
+# de l'ordre 'variance') sont faites avant ses rendus, les tables étant libérées entre
+# les deux : la pointe est le maximum des deux phases (mesurée à 67 o/px en RGB pour le
+# quadtree, estimée à 73 ; 42 et 45 pour la grille).
+_SOURCE_BYTES_PER_CHANNEL = 1
+_ANALYSIS_BYTES_PER_CHANNEL = 8
+_VARIANCE_BYTES_PER_CHANNEL = 8
+_ANALYSIS_BYTES_SHARED = 10
+_BYTES_PER_CHANNEL = 11
+_BYTES_SHARED = 9
+_QUADTREE_MASK_BYTES = 28
+# Peinture directe (blend 'paint') : image de sortie et copie MSE, en uint8
+_PAINT_BYTES_PER_CHANNEL = 2
+
+SUMMARY_FIELDS = [
+    "source",
+    "output",
+    "shape",
+    "requested",
+    "shapes",
+    "grayscale",
+    "width",
+    "height",
+    "mse",
+    "psnr",
+    "load_s",
+    "analysis_s",
+    "render_s",
+    "save_s",
+    "mse_s",
+    "total_s",
+    "cache",
+    "error",
+]
+
+
+def collect_images(source):
+    """Retourne la liste triée des images d'un dossier ou d'un motif glob."""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    return sorted(
+        p for p in paths
+        if os.path.isfile(p) and p.lower().split('.')[-1] in IMAGE_EXTENSIONS
+    )
+
+
+def parse_count(value):
+    """Convertit un nombre de formes ('auto' ou entier > 0) ; 'auto' donne None."""
+    if value.strip().lower() == "auto":
+        return None
+    nb = int(value)
+    if nb <= 0:
+        raise ValueError("Le nombre de formes doit être positif")
+    return nb
+
+
+def estimate_job_memory(path, grayscale=False, blend="average", engine="grid", paint_order="row-major"):
+    """Estime la mémoire de pointe (octets) du traitement d'une image, sans la décoder.
+
+    La pointe est atteinte pendant l'analyse (construction des tables de
+    sommes cumulées) ou pendant le rendu. En niveaux de gris, la chaîne travaille sur un seul
+    canal. La peinture directe (``blend='paint'``) n'alloue ni canvas
+    flottant ni carte de poids. La table des carrés n'est comptée que pour
+    le quadtree et l'ordre de peinture 'variance'.
+    """
+    with Image.open(path) as im:
+        width, height = im.size
+    channels = 1 if grayscale else 3
+    analysis = _ANALYSIS_BYTES_PER_CHANNEL * channels
+    if engine == "quadtree" or (blend == "paint" and paint_order == "variance"):
+        analysis += _VARIANCE_BYTES_PER_CHANNEL * channels + _ANALYSIS_BYTES_SHARED
+    if blend == "paint":
+        render = _PAINT_BYTES_PER_CHANNEL * channels
+    else:
+        render = _BYTES_PER_CHANNEL * channels + _BYTES_SHARED
+        if engine == "quadtree":
+            render += _QUADTREE_MASK_BYTES
+    return width * height * (_SOURCE_BYTES_PER_CHANNEL * channels + max(analysis, render))
+
+
+def _output_name(stem, shape, count, grayscale, engine="grid", blend="average"):
+    suffix = "auto" if count is None else str(count)
+    gray = "_gray" if grayscale else ""
+    variant = "" if engine == "grid" else f"_{engine}"
+    if blend != "average":
+        variant += f"_{blend}"
+    return f"{stem}_{shape}_{suffix}{variant}{gray}.png"
+
+
+def _process_image_streaming(path, stem, shapes, counts, grayscale, output_dir, budget_mb):
+    """Variante de ``process_image`` à mémoire bornée (rendu par bandes)."""
+    rows = []
+    for count in counts:
+        for shape in shapes:
+            row = {
+                "source": path,
+                "shape": shape,
+                "requested": "auto" if count is None else count,
+                "grayscale": grayscale,
+            }
+            try:
+                start = time.perf_counter()
+                output_path = os.path.join(output_dir, _output_name(stem, shape, count, grayscale))
+                result = render_streaming(
+                    path,
+                    output_path,
+                    shape=shape,
+                    max_rectangles=count,
+                    grayscale=grayscale,
+                    memory_budget_mb=budget_mb,
+                )
+                with Image.open(output_path) as im:
+                    row["width"], row["height"] = im.size
+                row.update(
+                    output=output_path,
+                    shapes=result["shapes"],
+                    mse=result["mse"],
+                    psnr=psnr_from_mse(result["mse"]),
+                    total_s=time.perf_counter() - start,
+                )
+            except Exception as exc:
+                row["error"] = f"{type(exc).__name__}: {exc}"
+            rows.append(row)
+    return rows
+
+
+def analyse_image(src, count, engine="grid", target_mse=None, analysis_tolerance=None, load_reduced=None,
+                  shape="rectangle", load_integral=None):
+    """Analyse une image avec le moteur choisi ('grid', 'quadtree' ou 'tessellate').
+
+    ``count`` vaut None pour le mode automatique (grille 16x16, ou 256
+    cellules au plus pour le quadtree et les pavages). 'tessellate' place
+    les formes ``shape`` sur leur pavage (``tessellation``) ; les rectangles
+    restent sur la grille uniforme, qui en est déjà un. Avec
+    ``analysis_tolerance``, la grille uniforme est analysée sur une version
+    réduite de l'image (``load_reduced(facteur)``) quand la taille des
+    cellules le permet. ``load_integral()`` fournit les tables de sommes
+    cumulées de ``src``, partagées entre les analyses d'une même image.
+    """
+    if engine == "quadtree":
+        return image_to_quadtree_grid(None, max_shapes=256 if count is None else count,
+                                      target_mse=target_mse, src_img=src,
+                                      integral=None if load_integral is None else load_integral())
+    if engine == "tessellate" and shape in TILINGS:
+        return image_to_tiled_grid(None, shape, max_shapes=256 if count is None else count, src_img=src)
+    if engine not in ("grid", "tessellate"):
+        raise ValueError(f"Moteur d'analyse inconnu: {engine}")
+    layout = {"max_rectangles": count} if count is not None else {"grid_cols": 16, "grid_rows": 16}
+    if analysis_tolerance is not None and load_reduced is not None:
+        h, w = src.shape[:2]
+        scale = choose_draft_scale(w, h, tolerance=analysis_tolerance, **layout)
+        if scale > 1:
+            return image_to_color_grid(None, src_img=load_reduced(scale), size=(w, h), **layout)
+    return image_to_color_grid(None, src_img=src, integral=None if load_integral is None else load_integral(),
+                               **layout)
+
+
+def process_image(path, stem, shapes, counts, grayscale, output_dir, render_workers=None,
+                  stream_budget_mb=None, engine="grid", target_mse=None, cache_dir=None,
+                  cache_max_mb=None, svg=False, analysis_tolerance=None, backend="pil", blend="average",
+                  paint_order="row-major", paint_alpha=None, scene=False):
+    """Traite une image pour toutes les combinaisons forme × nombre demandées.
+
+    Retourne une ligne de résumé par image produite. Les erreurs sont
+    reportées dans la colonne ``error`` au lieu d'interrompre le lot.
+    L'analyse d'un nombre de formes est faite une fois et partagée par toutes
+    les formes (``analysis_s`` est son temps de calcul), à partir des mêmes
+    tables de sommes cumulées ; les rendus suivent toutes les analyses.
+    Avec ``stream_budget_mb``, l'image est rendue par bandes dans ce budget
+    mémoire (voir ``streaming.render_streaming``, grille uniforme uniquement).
+    ``engine`` choisit l'analyse : grille uniforme ('grid'), subdivision
+    adaptative ('quadtree', arrêtée aussi à ``target_mse``), pavage sans
+    recouvrement propre à chaque forme ('tessellate', voir ``tessellation``)
+    ou placement optimisé des formes ('optimize', voir ``optimizer.optimize_shapes``).
+    En niveaux de gris, la source, l'analyse, le rendu et la MSE n'ont
+    qu'un seul canal et le PNG est enregistré en mode "L".
+    ``cache_dir`` active le cache disque des grilles et des rendus
+    (``result_cache.ResultCache``, borné à ``cache_max_mb``) : la colonne
+    ``cache`` indique alors la couche réutilisée ('render', 'grid' ou 'miss').
+    Avec ``svg``, chaque rendu est aussi exporté en SVG à côté du PNG
+    (hors rendu par bandes). ``analysis_tolerance`` active l'analyse de la
+    grille uniforme sur un décodage réduit (voir ``choose_draft_scale``) ;
+    le rendu et la MSE restent à pleine résolution. Ce décodage s'ajoute à
+    celui de la pleine résolution, toujours nécessaire à la MSE : il ne
+    coûte qu'une fraction du premier pour les JPEG (réduction DCT), mais
+    double le décodage des autres formats. ``backend`` choisit la
+    rastérisation des grilles (``render_image`` : 'pil' ou 'numpy', vectorisée).
+    ``blend='paint'`` remplace la moyenne des formes par la peinture directe
+    (``render.paint_image``, dans l'ordre ``paint_order``, avec ``paint_alpha``
+    optionnel) ; elle ne concerne pas l'engine 'optimize' et se passe du rendu
+    par bandes, sa mémoire étant déjà bornée par l'image de sortie.
+    Avec ``scene``, la grille est aussi enregistrée en scène indépendante de
+    la résolution (``scene.save_scene``, ``.npz`` à côté du PNG), sauf pour
+    l'engine 'optimize'.
+    """
+    if stream_budget_mb is not None and engine == "grid" and blend == "average":
+        return _process_image_streaming(path, stem, shapes, counts, grayscale, output_dir, stream_budget_mb)
+    cache = None
+    if cache_dir is not None:
+        max_bytes = DEFAULT_MAX_BYTES if cache_max_mb is None else int(cache_max_mb * 1024 * 1024)
+        cache = ResultCache(cache_dir, max_bytes)
+
+    rows = []
+    src = None
+    source = None
+    t0 = time.perf_counter()
+    try:
+        # Empreinte mémorisée : l'image n'est décodée que si un rendu manque
+        if cache is not None:
+            source = cache.lookup_source(path)
+        if source is None:
+            src = load_image_to_array(path)
+            if cache is not None:
+                source = cache.remember_source(path, src)
+            if grayscale:
+                src = apply_grayscale(src, single_channel=True)
+    except Exception as exc:
+        return [{"source": path, "error": f"{type(exc).__name__}: {exc}"}]
+    load_s = time.perf_counter() - t0
+    if src is not None:
+        h, w = src.shape[:2]
+    else:
+        h, w = source["height"], source["width"]
+
+    reduced = {}
+
+    def load_reduced(scale):
+        # Une version réduite par facteur, partagée par tous les nombres de formes
+        if scale not in reduced:
+            small = load_image_reduced(path, scale)
+            reduced[scale] = apply_grayscale(small, single_channel=True) if grayscale else small
+        return reduced[scale]
+
+    integral = []
+    # La table des carrés ne sert qu'au quadtree et à l'ordre 'variance'
+    with_variance = engine == "quadtree" or (blend == "paint" and paint_order == "variance")
+
+    def load_integral():
+        # Tables de sommes cumulées de la source, partagées par les analyses et l'ordre 'variance'
+        if not integral:
+            integral.append(compute_integral_images(src, with_variance=with_variance))
+        return integral[0]
+
+    # Analyses d'abord, une par nombre de formes (et par pavage), partagées par les formes ;
+    # les rendus ensuite, une fois les tables libérées (voir estimate_job_memory)
+    grids = {}
+    pending = []
+    for count in counts:
+        for shape in shapes:
+            row = {
+                "source": path,
+                "shape": shape,
+                "requested": "auto" if count is None else count,
+                "grayscale": grayscale,
+                "width": w,
+                "height": h,
+                "load_s": load_s,
+            }
+            try:
+                start = time.perf_counter()
+                output_path = os.path.join(output_dir, _output_name(stem, shape, count, grayscale, engine, blend))
+                analysis = {"engine": engine, "grayscale": grayscale, "count": count, "target_mse": target_mse,
+                            "analysis_tolerance": analysis_tolerance}
+                render_shape = shape
+                if engine == "tessellate" and shape in TILINGS:
+                    # Le pavage dépend de la forme, rendue sans multiplicateur de taille
+                    analysis["tiling"] = shape
+                    render_shape = tile_shape(shape)
+                job = {"row": row, "shape": shape, "render_shape": render_shape, "output": output_path}
+                if cache is not None:
+                    grid_key = cache_key(source["digest"], layer="grid", **analysis)
+                    # Le backend vectorisé ne donne pas exactement les mêmes pixels : clé distincte
+                    backend_key = {} if backend == "pil" else {"backend": backend}
+                    if blend != "average":
+                        backend_key.update(blend=blend, paint_order=paint_order, paint_alpha=paint_alpha)
+                    job["render_key"] = cache_key(source["digest"], layer="render",
+                                                  shape=create_shape(render_shape).to_dict(), **analysis,
+                                                  **backend_key)
+                    meta = cache.get_render(job["render_key"], output_path)
+                    if meta is not None and (svg or scene):
+                        # Le SVG et la scène sont régénérés depuis la grille en cache (rapide)
+                        grid = cache.get_grid(grid_key) if engine != "optimize" else None
+                        if grid is None:
+                            meta = None
+                        else:
+                            if svg:
+                                grid_to_svg(grid, w, h, render_shape,
+                                            path=os.path.splitext(output_path)[0] + ".svg")
+                            if scene:
+                                save_scene(grid_to_scene(grid, w, h, render_shape, "L" if grayscale else "RGB"),
+                                           os.path.splitext(output_path)[0] + ".npz")
+                    if meta is not None:
+                        row.update(output=output_path, shapes=meta["shapes"], mse=meta["mse"],
+                                   psnr=psnr_from_mse(meta["mse"]), cache="render",
+                                   total_s=time.perf_counter() - start)
+                        rows.append(row)
+                        continue
+                    if src is None:
+                        t = time.perf_counter()
+                        src = load_image_to_array(path)
+                        if grayscale:
+                            src = apply_grayscale(src, single_channel=True)
+                        row["load_s"] = load_s = time.perf_counter() - t
+                        start = time.perf_counter()
+                    row["cache"] = "miss"
+
+                if engine == "optimize":
+                    # L'optimiseur travaille en RGB ; son rendu est ramené à un canal en niveaux de gris
+                    target = apply_grayscale(src) if grayscale else src
+                    job["placed"] = optimize_shapes(target, 256 if count is None else count, shape=shape)
+                    n_shapes = len(job["placed"]["shapes"])
+                else:
+                    grid_id = (count, analysis.get("tiling"))
+                    grid = grids.get(grid_id)
+                    if grid is None:
+                        grid = cache.get_grid(grid_key) if cache is not None else None
+                        if grid is not None:
+                            row["cache"] = "grid"
+                        else:
+                            grid = analyse_image(src, count, engine, target_mse, analysis_tolerance, load_reduced,
+                                                 shape=shape, load_integral=load_integral)
+                            if cache is not None:
+                                cache.put_grid(grid_key, grid)
+                        if blend == "paint" and paint_order == "variance" and grid.variances is None:
+                            grid.variances = cell_variances(load_integral(), grid)
+                        grids[grid_id] = grid
+                    job["grid"] = grid
+                    n_shapes = len(grid)
+                row["shapes"] = n_shapes
+                row["analysis_s"] = time.perf_counter() - start
+                pending.append(job)
+            except Exception as exc:
+                row["error"] = f"{type(exc).__name__}: {exc}"
+                rows.append(row)
+
+    integral.clear()
+    for job in pending:
+        row = job["row"]
+        output_path = job["output"]
+        render_shape = job["render_shape"]
+        try:
+            t1 = time.perf_counter()
+            if engine == "optimize":
+                img_out = render_placements(job["placed"], w, h)
+                if grayscale:
+                    img_out = img_out.convert("L")
+            elif blend == "paint":
+                img_out = paint_image(job["grid"], w, h, shape=render_shape, order=paint_order,
+                                      alpha=paint_alpha, mode="L" if grayscale else "RGB")
+            else:
+                img_out = render_image(job["grid"], w, h, shape=render_shape, workers=render_workers,
+                                       mode="L" if grayscale else "RGB", backend=backend)
+            t2 = time.perf_counter()
+            save_image(img_out, output_path)
+            if svg:
+                svg_path = os.path.splitext(output_path)[0] + ".svg"
+                if engine == "optimize":
+                    placements_to_svg(job["placed"], w, h, path=svg_path)
+                else:
+                    grid_to_svg(job["grid"], w, h, render_shape, path=svg_path)
+            if scene and engine != "optimize":
+                save_scene(grid_to_scene(job["grid"], w, h, render_shape, "L" if grayscale else "RGB"),
+                           os.path.splitext(output_path)[0] + ".npz")
+            t3 = time.perf_counter()
+            mse = compute_mse(src, img_out)
+            t4 = time.perf_counter()
+            if cache is not None:
+                cache.put_render(job["render_key"], output_path, {"shapes": row["shapes"], "mse": mse})
+            row.update(
+                output=output_path,
+                mse=mse,
+                psnr=psnr_from_mse(mse),
+                render_s=t2 - t1,
+                save_s=t3 - t2,
+                mse_s=t4 - t3,
+                total_s=row["analysis_s"] + t4 - t1,
+            )
+        except Exception as exc:
+            row["error"] = f"{type(exc).__name__}: {exc}"
+        rows.append(row)
+    return rows
+
+
+def _process_chunk(jobs, options, profile_dir=None, profile_memory=False):
+    """Traite séquentiellement un paquet d'images dans un processus worker.
+
+    ``options`` contient les arguments nommés de ``process_image``. Avec
+    ``profile_dir``, chaque image est instrumentée et ses spans sont écrits
+    dans ``<image>.profile.json`` et ``<image>.trace.json``.
+    """
+    rows = []
+    for path, stem in jobs:
+        if profile_dir is None:
+            rows.extend(process_image(path, stem, **options))
+            continue
+        profiler = Profiler(track_memory=profile_memory)
+        with use_profiler(profiler):
+            with profiler.span("image", source=path):
+                rows.extend(process_image(path, stem, **options))
+        profiler.save_json(os.path.join(profile_dir, f"{stem}.profile.json"))
+        profiler.save_chrome_trace(os.path.join(profile_dir, f"{stem}.trace.json"))
+    return rows
+
+
+def _unique_stems(paths):
+    """Associe à chaque image un nom de base unique (suffixe si doublon)."""
+    seen = {}
+    stems = []
+    for p in paths:
+        stem = os.path.splitext(os.path.basename(p))[0]
+        n = seen.get(stem, 0) + 1
+        seen[stem] = n
+        stems.append(stem if n == 1 else f"{stem}_{n}")
+    return stems
+
+
+def run_batch(
+    paths,
+    shapes=("rectangle",),
+    counts=(None,),
+    grayscale=False,
+    output_dir="resultat",
+    workers=None,
+    chunksize=1,
+    max_memory_mb=None,
+    render_workers=None,
+    stream_budget_mb=None,
+    profile_dir=None,
+    profile_memory=False,
+    engine="grid",
+    target_mse=None,
+    cache_dir=None,
+    cache_max_mb=None,
+    svg=False,
+    analysis_tolerance=None,
+    backend="pil",
+    blend="average",
+    paint_order="row-major",
+    paint_alpha=None,
+    scene=False,
+    progress=None,
+):
+    """Répartit les images sur un ``ProcessPoolExecutor`` et retourne les résumés.
+
+    ``chunksize`` images sont envoyées ensemble à un worker. Si
+    ``max_memory_mb`` est donné, la somme des mémoires estimées des paquets
+    en cours ne dépasse pas ce budget (au moins un paquet tourne toujours).
+    ``render_workers`` active le rendu par bandes multi-threads dans chaque
+    worker. ``stream_budget_mb`` active le rendu par bandes à mémoire bornée ;
+    ce budget sert alors aussi d'estimation mémoire de chaque image.
+    ``profile_dir`` active l'instrumentation par étape (``profile_memory``
+    y ajoute la mémoire allouée, via ``tracemalloc``). ``engine``,
+    ``target_mse``, ``cache_dir``, ``cache_max_mb``, ``svg``,
+    ``analysis_tolerance``, ``backend``, ``blend``, ``paint_order``,
+    ``paint_alpha`` et ``scene`` sont transmis à ``process_image`` ; le cache disque est
+    partagé par tous les workers. L'estimation mémoire tient compte de ``blend``.
+    ``progress`` est appelé avec les lignes de chaque paquet terminé.
+    """
+    if blend not in BLENDS:
+        raise ValueError(f"Mode de composition inconnu: {blend}")
+    os.makedirs(output_dir, exist_ok=True)
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    options = {
+        "shapes": list(shapes),
+        "counts": list(counts),
+        "grayscale": grayscale,
+        "output_dir": output_dir,
+        "render_workers": render_workers,
+        "stream_budget_mb": stream_budget_mb,
+        "engine": engine,
+        "target_mse": target_mse,
+        "cache_dir": cache_dir,
+        "cache_max_mb": cache_max_mb,
+        "svg": svg,
+        "analysis_tolerance": analysis_tolerance,
+        "backend": backend,
+        "blend": blend,
+        "paint_order": paint_order,
+        "paint_alpha": paint_alpha,
+        "scene": scene,
+    }
+    chunksize = max(1, int(chunksize))
+    budget = None if max_memory_mb is None else max_memory_mb * 1024 * 1024
+
+    jobs = list(zip(paths, _unique_stems(paths)))
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    costs = []
+    for chunk in chunks:
+        cost = 0
+        if budget is not None:
+            for path, _ in chunk:
+                try:
+                    estimate = estimate_job_memory(path, grayscale, blend, engine, paint_order)
+                except Exception:
+                    estimate = 0
+                if stream_budget_mb is not None and blend == "average":
+                    estimate = min(estimate, stream_budget_mb * 1024 * 1024)
+                cost = max(cost, estimate)
+        costs.append(cost)
+
+    results = []
+    max_workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        in_flight = 0
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            # Soumission tant que le nombre de workers et le budget mémoire le permettent
+            while next_chunk < len(chunks) and len(pending) < max_workers:
+                cost = costs[next_chunk]
+                if budget is not None and pending and in_flight + cost > budget:
+                    break
+                future = executor.submit(
+                    _process_chunk, chunks[next_chunk], options, profile_dir, profile_memory
+                )
+                pending[future] = cost
+                in_flight += cost
+                next_chunk += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight -= pending.pop(future)
+                rows = future.result()
+                results.extend(rows)
+                if progress is not None:
+                    progress(rows)
+
+    if cache_dir is not None:
+        # Éviction finale : les workers n'évincent qu'au-delà d'un seuil d'écriture
+        ResultCache(cache_dir, DEFAULT_MAX_BYTES if cache_max_mb is None else cache_max_mb * 1024 * 1024).evict()
+
+    results.sort(key=lambda r: (r.get("source", ""), str(r.get("requested", "")), r.get("shape", "")))
+    return results
+
+
+def write_summary(rows, output_dir, formats=("csv", "json")):
+    """Écrit le résumé du lot en CSV et/ou JSON ; retourne les chemins écrits."""
+    written = []
+    if "csv" in formats:
+        path = os.path.join(output_dir, "summary.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+        written.append(path)
+    if "json" in formats:
+        path = os.path.join(output_dir, "summary.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+        written.append(path)
+    return written
+
+
+__all__ = [
+    "collect_images",
+    "parse_count",
+    "estimate_job_memory",
+    "analyse_image",
+    "process_image",
+    "run_batch",
+    "write_summary",
+]
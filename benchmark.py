@@ -0,0 +1,213 @@
+"""Benchmarks reproductibles de l'analyse, du rendu et de la MSE.
+
+Les images sont générées (aucun fichier de ``images/`` n'est utilisé) ; les
+résultats sont enregistrés en JSON et peuvent être comparés à une référence.
+
+    python3 benchmark.py --output bench.json
+    python3 benchmark.py --baseline bench.json --threshold 0.15
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import PIL
+
+from image_processor import image_to_color_grid, compute_mse
+from mask_cache import default_mask_cache
+from render import render_image
+
+SHAPE_TYPES = ["rectangle", "triangle", "circle", "diamond", "star"]
+
+SIZE_PRESETS = {
+    "256": (256, 256),
+    "1k": (1024, 1024),
+    "2k": (2048, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+}
+
+QUICK_SIZES = ["256", "1k"]
+QUICK_COUNTS = [16, 256, 4096]
+FULL_SIZES = ["256", "1k", "4k", "8k"]
+FULL_COUNTS = [16, 256, 4096, 100000]
+
+
+def synthetic_image(width, height, seed=0):
+    """Génère une image RGB déterministe (dégradés, disques et bruit)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    img[:, :, 0] = 255.0 * x / max(1, width - 1)
+    img[:, :, 1] = 255.0 * y / max(1, height - 1)
+    img[:, :, 2] = 127.5 * (1.0 + np.sin(x / 37.0) * np.cos(y / 23.0))
+    for _ in range(12):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        radius = rng.uniform(0.05, 0.25) * min(width, height)
+        inside = (x - cx) ** 2 + (y - cy) ** 2 < radius * radius
+        img[inside] = rng.uniform(0, 255, size=3)
+    img += rng.normal(0.0, 8.0, size=(height, width, 1)).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def _measure(fn, repeat):
+    """Retourne (meilleur temps en s, pic mémoire Python/NumPy en octets, résultat)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        default_mask_cache.clear()
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Passe séparée pour la mémoire : tracemalloc ralentit l'exécution
+    default_mask_cache.clear()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def _entry(stage, size, shape, count, shapes, pixels, seconds, peak):
+    return {
+        "key": f"{stage}/{size}/{shape}/{count}",
+        "stage": stage,
+        "size": size,
+        "shape": shape,
+        "count": count,
+        "shapes": shapes,
+        "pixels": pixels,
+        "seconds": seconds,
+        "peak_bytes": peak,
+        "pixels_per_s": pixels / seconds if seconds > 0 else None,
+        "shapes_per_s": shapes / seconds if seconds > 0 and shapes else None,
+    }
+
+
+def run_benchmarks(sizes=QUICK_SIZES, counts=QUICK_COUNTS, shapes=SHAPE_TYPES, repeat=3,
+                   seed=0, progress=None):
+    """Exécute la matrice taille × nombre de formes × forme et retourne les mesures."""
+    results = []
+
+    def record(entry):
+        results.append(entry)
+        if progress is not None:
+            progress(entry)
+
+    for size in sizes:
+        width, height = SIZE_PRESETS[size]
+        src = synthetic_image(width, height, seed)
+        pixels = width * height
+        for count in counts:
+            seconds, peak, grid = _measure(
+                lambda: image_to_color_grid(None, max_rectangles=count, src_img=src), repeat
+            )
+            record(_entry("analysis", size, "-", count, len(grid), pixels, seconds, peak))
+            for shape in shapes:
+                seconds, peak, img_out = _measure(
+                    lambda: render_image(grid, width, height, shape=shape), repeat
+                )
+                record(_entry("render", size, shape, count, len(grid), pixels, seconds, peak))
+                out = np.asarray(img_out)
+                seconds, peak, _ = _measure(lambda: compute_mse(src, out), repeat)
+                record(_entry("mse", size, shape, count, len(grid), pixels, seconds, peak))
+    return results
+
+
+def environment():
+    """Décrit l'environnement d'exécution (versions, machine)."""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(results, baseline, threshold=0.10):
+    """Compare des mesures à une référence.
+
+    Retourne la liste des régressions : mesures dont le temps ou le pic
+    mémoire dépasse celui de la référence de plus de ``threshold`` (0.10 = +10 %).
+    """
+    reference = {e["key"]: e for e in baseline.get("results", [])}
+    regressions = []
+    for entry in results:
+        ref = reference.get(entry["key"])
+        if ref is None:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if not ref.get(metric):
+                continue
+            ratio = entry[metric] / ref[metric]
+            if ratio > 1.0 + threshold:
+                regressions.append({
+                    "key": entry["key"],
+                    "metric": metric,
+                    "baseline": ref[metric],
+                    "current": entry[metric],
+                    "ratio": ratio,
+                })
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks d'AlgoPaint (images synthétiques).")
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZE_PRESETS), default=None,
+                        help="Tailles d'image (défaut : 256 1k, ou toutes avec --full)")
+    parser.add_argument("--counts", nargs="+", type=int, default=None,
+                        help="Nombres de formes (défaut : 16 256 4096)")
+    parser.add_argument("--shapes", nargs="+", choices=SHAPE_TYPES, default=SHAPE_TYPES)
+    parser.add_argument("--full", action="store_true",
+                        help="Matrice complète : 256² à 8K, 16 à 100k formes")
+    parser.add_argument("--repeat", type=int, default=3, help="Répétitions par mesure (meilleur temps)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", default=None, help="Fichier JSON de résultats")
+    parser.add_argument("--baseline", "-b", default=None, help="Fichier JSON de référence")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Tolérance de régression (0.10 = +10 %%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = args.sizes or (FULL_SIZES if args.full else QUICK_SIZES)
+    counts = args.counts or (FULL_COUNTS if args.full else QUICK_COUNTS)
+
+    def progress(e):
+        print(f"{e['key']:<32} {e['seconds'] * 1000:9.1f} ms  {e['peak_bytes'] / 1e6:8.1f} Mo")
+
+    results = run_benchmarks(sizes, counts, args.shapes, args.repeat, args.seed, progress)
+    report = {"environment": environment(), "seed": args.seed, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print("Résultats enregistrés :", args.output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print(f"[RÉGRESSION] {r['key']} {r['metric']} : {r['baseline']:.6g} -> "
+                  f"{r['current']:.6g} (x{r['ratio']:.2f})")
+        if regressions:
+            return 1
+        print("Aucune régression par rapport à", args.baseline)
+    return 0
+
+
+__all__ = ["synthetic_image", "run_benchmarks", "compare", "environment", "SIZE_PRESETS"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Représentation compacte (tableaux parallèles) d'une grille de cellules colorées."""
+
+import numpy as np
+
+
+class ColorGrid:
+    """Grille de cellules stockée sous forme de tableaux NumPy parallèles.
+
+    Chaque cellule ``i`` a une ligne ``rows[i]``, une colonne ``cols[i]``,
+    une position ``lefts[i]``/``tops[i]``, une taille ``widths[i]``/``heights[i]``
+    et une couleur ``colors[i]`` (uint8 RGB). ``variances`` est optionnel.
+    Remplace la liste de dictionnaires de ``image_to_color_rects`` pour les
+    grandes mosaïques ; ``to_rects``/``from_rects`` assurent la compatibilité.
+    Une grille non régulière (``regular=False``, ex. quadtree) a des cellules
+    de tailles variables : ses dictionnaires portent aussi ``left`` et ``top``.
+    ``variants`` (optionnel) marque une grille de pavage (``tessellation``) :
+    les cellules y sont les boîtes englobantes, non découpées, de tuiles qui
+    peuvent déborder de l'image, et ``variants[i]`` est la variante de la
+    tuile (orientation des triangles) transmise aux formes à la place de la ligne.
+    """
+
+    def __init__(self, rows, cols, lefts, tops, widths, heights, colors, variances=None, regular=True,
+                 variants=None):
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.cols = np.asarray(cols, dtype=np.int32)
+        self.lefts = np.asarray(lefts, dtype=np.int64)
+        self.tops = np.asarray(tops, dtype=np.int64)
+        self.widths = np.asarray(widths, dtype=np.int64)
+        self.heights = np.asarray(heights, dtype=np.int64)
+        self.colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        self.variances = None if variances is None else np.asarray(variances, dtype=np.float64)
+        self.regular = regular
+        self.variants = None if variants is None else np.asarray(variants, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def grid_rows(self):
+        return int(self.rows.max()) + 1 if len(self) else 0
+
+    @property
+    def grid_cols(self):
+        return int(self.cols.max()) + 1 if len(self) else 0
+
+    @classmethod
+    def from_edges(cls, x_edges, y_edges, colors, variances=None):
+        """Construit une grille uniforme à partir des bornes de colonnes et de lignes.
+
+        ``colors`` (et ``variances``) sont indexés ``[ligne, colonne]``.
+        """
+        x_edges = np.asarray(x_edges, dtype=np.int64)
+        y_edges = np.asarray(y_edges, dtype=np.int64)
+        grid_cols = len(x_edges) - 1
+        grid_rows = len(y_edges) - 1
+        rows, cols = np.divmod(np.arange(grid_rows * grid_cols), grid_cols)
+        widths = np.diff(x_edges)
+        heights = np.diff(y_edges)
+        colors = np.asarray(colors).reshape(grid_rows * grid_cols, -1)[:, :3]
+        if variances is not None:
+            variances = np.asarray(variances, dtype=np.float64).reshape(-1)
+        return cls(
+            rows,
+            cols,
+            x_edges[cols],
+            y_edges[rows],
+            widths[cols],
+            heights[rows],
+            colors,
+            variances,
+        )
+
+    @classmethod
+    def from_rects(cls, rects):
+        """Adaptateur depuis la liste de dictionnaires (``row``, ``col``, ``color``, ...)."""
+        n = len(rects)
+        rows = np.fromiter((r["row"] for r in rects), dtype=np.int32, count=n)
+        cols = np.fromiter((r["col"] for r in rects), dtype=np.int32, count=n)
+        widths = np.fromiter((r["cell_width"] for r in rects), dtype=np.int64, count=n)
+        heights = np.fromiter((r["cell_height"] for r in rects), dtype=np.int64, count=n)
+        colors = np.array([tuple(r["color"])[:3] for r in rects], dtype=np.uint8).reshape(n, 3)
+        variances = None
+        if n and all("variance" in r for r in rects):
+            variances = np.array([r["variance"] for r in rects], dtype=np.float64)
+        variants = None
+        if n and all("variant" in r for r in rects):
+            variants = np.fromiter((r["variant"] for r in rects), dtype=np.int8, count=n)
+
+        if n and all("left" in r and "top" in r for r in rects):
+            lefts = np.fromiter((r["left"] for r in rects), dtype=np.int64, count=n)
+            tops = np.fromiter((r["top"] for r in rects), dtype=np.int64, count=n)
+            return cls(rows, cols, lefts, tops, widths, heights, colors, variances, regular=False,
+                       variants=variants)
+
+        # Position des cellules : largeur max par colonne, hauteur max par ligne
+        col_widths = np.zeros(int(cols.max()) + 1 if n else 0, dtype=np.int64)
+        row_heights = np.zeros(int(rows.max()) + 1 if n else 0, dtype=np.int64)
+        np.maximum.at(col_widths, cols, widths)
+        np.maximum.at(row_heights, rows, heights)
+        x_offsets = np.concatenate([[0], np.cumsum(col_widths)])
+        y_offsets = np.concatenate([[0], np.cumsum(row_heights)])
+        return cls(rows, cols, x_offsets[cols], y_offsets[rows], widths, heights, colors, variances)
+
+    def take(self, indices):
+        """Sous-grille (ou grille réordonnée) des cellules ``indices``."""
+        return ColorGrid(
+            self.rows[indices],
+            self.cols[indices],
+            self.lefts[indices],
+            self.tops[indices],
+            self.widths[indices],
+            self.heights[indices],
+            self.colors[indices],
+            None if self.variances is None else self.variances[indices],
+            regular=self.regular,
+            variants=None if self.variants is None else self.variants[indices],
+        )
+
+    def to_rects(self):
+        """Adaptateur vers la liste de dictionnaires historique."""
+        rows = self.rows.tolist()
+        cols = self.cols.tolist()
+        widths = self.widths.tolist()
+        heights = self.heights.tolist()
+        colors = self.colors.tolist()
+        variances = None if self.variances is None else self.variances.tolist()
+        variants = None if self.variants is None else self.variants.tolist()
+        lefts = None if self.regular else self.lefts.tolist()
+        tops = None if self.regular else self.tops.tolist()
+        rects = []
+        for i in range(len(rows)):
+            rect = {
+                "row": rows[i],
+                "col": cols[i],
+                "color": tuple(colors[i]),
+                "cell_width": widths[i],
+                "cell_height": heights[i],
+            }
+            if variances is not None:
+                rect["variance"] = variances[i]
+            if variants is not None:
+                rect["variant"] = variants[i]
+            if lefts is not None:
+                rect["left"] = lefts[i]
+                rect["top"] = tops[i]
+            rects.append(rect)
+        return rects
+
+
+def as_color_grid(rects):
+    """Retourne ``rects`` sous forme de ``ColorGrid`` (sans copie si c'en est déjà une)."""
+    if isinstance(rects, ColorGrid):
+        return rects
+    return ColorGrid.from_rects(rects)
+
+
+__all__ = ["ColorGrid", "as_color_grid"]
@@ -8,30 +8,94 @@ except Exception as exc:
 import numpy as np
 import math
 
-
-def _average_color(region):
-    """Calcule la couleur moyenne d'une région d'image."""
-    small = region.copy()
-    small.thumbnail((1, 1))
-    px = small.getpixel((0, 0))
-    if isinstance(px, int):
-        return (px, px, px)
-    if isinstance(px, tuple) and len(px) >= 3:
-        return (int(px[0]), int(px[1]), int(px[2]))
-    return (0, 0, 0)
+from grid import ColorGrid
+from instrumentation import span, count
+from metrics import mse as _chunked_mse
 
 
 def load_image_to_array(path):
     """Charge une image et la convertit en tableau numpy RGB."""
+    with span("decode"):
+        with Image.open(path) as im:
+            img = im.convert("RGB")
+        return np.array(img, dtype=np.uint8)
+
+# Erreur de couleur maximale (niveaux 0-255) tolérée par défaut pour l'analyse à résolution réduite
+DEFAULT_ANALYSIS_TOLERANCE = 8.0
+
+# Facteurs de réduction disponibles au décodage JPEG (mise à l'échelle DCT)
+_DRAFT_SCALES = (8, 4, 2)
+
+
+def choose_draft_scale(width, height, grid_cols=16, grid_rows=16, max_rectangles=None,
+                       tolerance=DEFAULT_ANALYSIS_TOLERANCE):
+    """Choisit le plus grand facteur de réduction (1, 2, 4 ou 8) compatible avec la grille.
+
+    À l'échelle 1/k, les bords des cellules sont décalés d'au plus k pixels
+    au total par axe : la fraction de pixels mal attribués est bornée par
+    ``k * (1 / largeur + 1 / hauteur)`` de la plus petite cellule, et
+    l'erreur de couleur moyenne par ``255`` fois cette fraction. Retourne
+    1 si aucune réduction ne respecte ``tolerance`` (ou si elle vaut None).
+    """
+    if tolerance is None or tolerance <= 0:
+        return 1
+    x_edges, y_edges = grid_layout(width, height, grid_cols, grid_rows, max_rectangles)
+    cell_w = int(np.diff(np.minimum(x_edges, width)).min())
+    cell_h = int(np.diff(np.minimum(y_edges, height)).min())
+    if cell_w <= 0 or cell_h <= 0:
+        return 1
+    for scale in _DRAFT_SCALES:
+        if 255.0 * scale * (1.0 / cell_w + 1.0 / cell_h) <= tolerance:
+            return scale
+    return 1
+
+
+def load_image_reduced(path, scale):
+    """Charge une image réduite d'un facteur ``scale`` (décodage DCT réduit pour les JPEG).
+
+    Les autres formats sont décodés entièrement puis réduits par moyenne de
+    blocs (``Image.reduce``).
+    """
+    with span("decode", scale=scale):
+        with Image.open(path) as im:
+            width, height = im.size
+            if scale > 1:
+                im.draft("RGB", (width // scale, height // scale))
+            img = im.convert("RGB")
+            # Format sans décodage réduit (ou réduction partielle) : moyenne de blocs
+            remaining = max(1, round(img.width * scale / width)) if scale > 1 else 1
+            if remaining > 1:
+                img = img.reduce(remaining)
+        return np.array(img, dtype=np.uint8)
+
+
+def load_image_for_analysis(path, grid_cols=16, grid_rows=16, max_rectangles=None,
+                            tolerance=DEFAULT_ANALYSIS_TOLERANCE):
+    """Charge une image à la plus petite résolution suffisante pour analyser la grille demandée.
+
+    Retourne ``(tableau, (largeur, hauteur))`` où la taille est celle de
+    l'image d'origine, à passer à ``image_to_color_grid(..., size=...)``.
+    """
     with Image.open(path) as im:
-        img = im.convert("RGB")
-    return np.array(img, dtype=np.uint8)
+        size = im.size
+    scale = choose_draft_scale(size[0], size[1], grid_cols, grid_rows, max_rectangles, tolerance)
+    return load_image_reduced(path, scale), size
+
 
-def apply_grayscale(np_array):
-    """Applique le filtre Noir et Blanc."""
-    img = Image.fromarray(np_array, mode="RGB")
-    grayscale_img = img.convert("L").convert("RGB")
-    return np.array(grayscale_img, dtype=np.uint8)
+def apply_grayscale(np_array, single_channel=False):
+    """Applique le filtre Noir et Blanc.
+
+    Avec ``single_channel``, retourne un tableau ``(H, W)`` à un seul canal
+    au lieu de trois canaux identiques : l'analyse, ``render_image(...,
+    mode="L")`` et la MSE travaillent alors sur un tiers des données.
+    """
+    with span("grayscale"):
+        if np_array.ndim == 2:
+            return np_array if single_channel else np.repeat(np_array[:, :, None], 3, axis=2)
+        img = Image.fromarray(np_array, mode="RGB").convert("L")
+        if not single_channel:
+            img = img.convert("RGB")
+        return np.array(img, dtype=np.uint8)
 
 
 def _compute_grid_from_limit(max_rectangles, width, height):
@@ -84,60 +148,217 @@ def _compute_grid_from_limit(max_rectangles, width, height):
     return best_cols, best_rows
 
 
-def image_to_color_rects(path, grid_cols=16, grid_rows=16, max_rectangles=None, src_img=None):
-    """Découpe une image en grille et retourne la couleur moyenne de chaque cellule."""
-    if grid_cols <= 0 or grid_rows <= 0:
-        raise ValueError("grid_cols et grid_rows doivent être > 0")
-    
-    if src_img is not None:
-        img = Image.fromarray(src_img,mode="RGB")
-    else:
-        with Image.open(path) as im:
-            img = im.convert("RGB")
+def compute_integral_images(np_array, with_variance=False):
+    """Construit les tables de sommes cumulées (summed-area tables) d'une image.
 
-    width, height = img.size
-    # Calcul automatique de la grille si max_rectangles est spécifié
-    if max_rectangles is not None:
-        grid_cols, grid_rows = _compute_grid_from_limit(int(max_rectangles), width, height)
-    
+    Retourne ``(sat, sat_sq)`` de forme ``(H + 1, W + 1, C)`` en int64 :
+    ``sat[y, x]`` vaut la somme des pixels ``[:y, :x]`` et ``sat_sq`` la
+    somme de leurs carrés. ``sat_sq`` n'est construite qu'avec
+    ``with_variance`` et vaut ``None`` sinon. Les tables peuvent être
+    réutilisées pour plusieurs tailles de grille sur la même image.
+    """
+    arr = np_array if np_array.ndim == 3 else np_array[:, :, None]
+    h, w, ch = arr.shape
+    sat = np.zeros((h + 1, w + 1, ch), dtype=np.int64)
+    # Les valeurs (puis leurs carrés) sont écrites directement dans la table et
+    # cumulées sur place : aucune copie int64 intermédiaire de la source
+    sat[1:, 1:] = arr
+    np.cumsum(sat[1:, 1:], axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    if not with_variance:
+        return sat, None
+    sat_sq = np.zeros((h + 1, w + 1, ch), dtype=np.int64)
+    np.multiply(arr, arr, out=sat_sq[1:, 1:], dtype=np.int64)
+    np.cumsum(sat_sq[1:, 1:], axis=0, out=sat_sq[1:, 1:])
+    np.cumsum(sat_sq[1:, 1:], axis=1, out=sat_sq[1:, 1:])
+    return sat, sat_sq
+
+
+def _grid_edges(width, height, grid_cols, grid_rows):
+    """Retourne les bornes des colonnes et des lignes d'une grille uniforme."""
     cell_w = max(1, width // grid_cols)
     cell_h = max(1, height // grid_rows)
+    x_edges = np.arange(grid_cols + 1, dtype=np.int64) * cell_w
+    y_edges = np.arange(grid_rows + 1, dtype=np.int64) * cell_h
+    # La dernière colonne/ligne absorbe le reste de la division
+    x_edges[-1] = max(width, x_edges[-2] + 1)
+    y_edges[-1] = max(height, y_edges[-2] + 1)
+    return x_edges, y_edges
+
 
-    rects = []
-    for r in range(grid_rows):
-        for c in range(grid_cols):
-            # Calcul des coordonnées de la cellule
-            left = c * cell_w
-            top = r * cell_h
-            right = width if c == grid_cols - 1 else (c + 1) * cell_w
-            bottom = height if r == grid_rows - 1 else (r + 1) * cell_h
-            # Extraction de la région et calcul de la couleur moyenne
-            region = img.crop((left, top, right, bottom))
-            color = _average_color(region)
-            rects.append(
-                {
-                    "row": r,
-                    "col": c,
-                    "color": color,
-                    "cell_width": right - left,
-                    "cell_height": bottom - top,
-                }
+def grid_layout(width, height, grid_cols=16, grid_rows=16, max_rectangles=None):
+    """Retourne les bornes ``(x_edges, y_edges)`` du découpage de ``image_to_color_rects``.
+
+    Utile pour ``metrics.compute_error(..., cell_edges=...)`` : la carte
+    d'erreur par cellule est alors alignée sur les rectangles analysés.
+    """
+    if max_rectangles is not None:
+        grid_cols, grid_rows = _compute_grid_from_limit(int(max_rectangles), width, height)
+    if grid_cols <= 0 or grid_rows <= 0:
+        raise ValueError("grid_cols et grid_rows doivent être > 0")
+    return _grid_edges(width, height, grid_cols, grid_rows)
+
+
+def _scale_edges(edges, full, reduced):
+    """Ramène des bornes de cellules d'une longueur ``full`` à une longueur ``reduced``.
+
+    Les bornes restent strictement croissantes tant que la longueur réduite
+    le permet, pour qu'aucune cellule ne soit vide.
+    """
+    scaled = np.rint(np.asarray(edges, dtype=np.float64) * reduced / float(full)).astype(np.int64)
+    scaled = np.minimum(scaled, reduced)
+    for i in range(1, len(scaled)):
+        if scaled[i] <= scaled[i - 1] and scaled[i - 1] < reduced:
+            scaled[i] = scaled[i - 1] + 1
+    return scaled
+
+
+def _box_sums(table, x_edges, y_edges):
+    """Sommes de ``table`` sur chaque cellule définie par les bornes (clippées à l'image)."""
+    h = table.shape[0] - 1
+    w = table.shape[1] - 1
+    xs = np.minimum(x_edges, w)
+    ys = np.minimum(y_edges, h)
+    return (
+        table[ys[1:, None], xs[None, 1:]]
+        - table[ys[:-1, None], xs[None, 1:]]
+        - table[ys[1:, None], xs[None, :-1]]
+        + table[ys[:-1, None], xs[None, :-1]]
+    )
+
+
+def cell_color_stats(integral, x_edges, y_edges):
+    """Calcule la couleur moyenne exacte et la variance de chaque cellule.
+
+    ``integral`` est le résultat de ``compute_integral_images``. Retourne
+    ``(means, variances)`` de forme ``(rows, cols, C)`` : moyennes arrondies
+    en int64 et variances en float64. Les cellules hors de l'image valent 0.
+    ``variances`` vaut ``None`` si ``integral`` n'a pas de table des carrés.
+    """
+    sat, sat_sq = integral
+    h = sat.shape[0] - 1
+    w = sat.shape[1] - 1
+    xs = np.minimum(x_edges, w)
+    ys = np.minimum(y_edges, h)
+    counts = (ys[1:, None] - ys[:-1, None]) * (xs[None, 1:] - xs[None, :-1])
+    counts = counts[:, :, None]
+    safe = np.maximum(counts, 1)
+
+    sums = _box_sums(sat, x_edges, y_edges)
+    # Arrondi entier exact de la moyenne (sans passer par les flottants)
+    means = (2 * sums + safe) // (2 * safe)
+    means = np.where(counts > 0, means, 0)
+    if sat_sq is None:
+        return means, None
+    sums_sq = _box_sums(sat_sq, x_edges, y_edges)
+    mean_f = sums / safe
+    variances = np.maximum(sums_sq / safe - mean_f * mean_f, 0.0)
+    variances = np.where(counts > 0, variances, 0.0)
+    return means, variances
+
+
+def cell_variances(integral, grid):
+    """Variance (moyenne sur les canaux) des pixels de chaque cellule d'un ``ColorGrid``.
+
+    Fonctionne pour des cellules quelconques (quadtree, pavage) : les boîtes
+    sont clippées à l'image, les cellules vides valent 0. ``integral`` doit
+    avoir été construit avec ``with_variance=True``.
+    """
+    sat, sat_sq = integral
+    if sat_sq is None:
+        raise ValueError("cell_variances nécessite des tables construites avec with_variance=True")
+    h = sat.shape[0] - 1
+    w = sat.shape[1] - 1
+    x0 = np.clip(grid.lefts, 0, w)
+    y0 = np.clip(grid.tops, 0, h)
+    x1 = np.clip(grid.lefts + grid.widths, 0, w)
+    y1 = np.clip(grid.tops + grid.heights, 0, h)
+    counts = ((x1 - x0) * (y1 - y0))[:, None]
+    safe = np.maximum(counts, 1)
+    sums = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+    sums_sq = sat_sq[y1, x1] - sat_sq[y0, x1] - sat_sq[y1, x0] + sat_sq[y0, x0]
+    mean_f = sums / safe
+    variances = np.maximum(sums_sq / safe - mean_f * mean_f, 0.0)
+    return np.where(counts > 0, variances, 0.0).mean(axis=1)
+
+
+def image_to_color_grid(path, grid_cols=16, grid_rows=16, max_rectangles=None, src_img=None,
+                        integral=None, with_variance=False, size=None):
+    """Découpe une image en grille et retourne un ``ColorGrid`` des couleurs moyennes.
+
+    Les moyennes sont calculées en une passe vectorisée à partir des tables
+    de sommes cumulées ; ``integral`` permet de réutiliser celles déjà
+    calculées par ``compute_integral_images``. Avec ``with_variance``,
+    chaque cellule porte aussi sa variance (moyenne sur les canaux).
+
+    ``size`` (largeur, hauteur) indique la taille de rendu quand ``src_img``
+    est une version réduite de l'image (voir ``load_image_for_analysis``) :
+    la grille est définie à cette taille et les moyennes sont lues sur les
+    cellules correspondantes de l'image réduite.
+    """
+    if grid_cols <= 0 or grid_rows <= 0:
+        raise ValueError("grid_cols et grid_rows doivent être > 0")
+
+    if src_img is None:
+        src_img = load_image_to_array(path)
+
+    with span("analysis"):
+        if integral is None or (with_variance and integral[1] is None):
+            integral = compute_integral_images(src_img, with_variance=with_variance)
+
+        height, width = src_img.shape[:2]
+        full_width, full_height = size if size is not None else (width, height)
+        # Calcul automatique de la grille si max_rectangles est spécifié
+        x_edges, y_edges = grid_layout(full_width, full_height, grid_cols, grid_rows, max_rectangles)
+        grid_cols, grid_rows = len(x_edges) - 1, len(y_edges) - 1
+        if (full_width, full_height) != (width, height):
+            means, variances = cell_color_stats(
+                integral, _scale_edges(x_edges, full_width, width), _scale_edges(y_edges, full_height, height)
             )
+        else:
+            means, variances = cell_color_stats(integral, x_edges, y_edges)
+        if means.shape[2] == 1:
+            means = np.repeat(means, 3, axis=2)
+        count("cells", grid_cols * grid_rows)
+        count("pixels_analysed", width * height)
+        return ColorGrid.from_edges(
+            x_edges, y_edges, means, variances.mean(axis=2) if with_variance else None
+        )
 
-    return rects
+
+def image_to_color_rects(path, grid_cols=16, grid_rows=16, max_rectangles=None, src_img=None,
+                         integral=None, with_variance=False):
+    """Découpe une image en grille et retourne la couleur moyenne de chaque cellule.
+
+    Version liste de dictionnaires (``row``, ``col``, ``color``, ``cell_width``,
+    ``cell_height``) de ``image_to_color_grid``.
+    """
+    return image_to_color_grid(
+        path, grid_cols, grid_rows, max_rectangles, src_img, integral, with_variance
+    ).to_rects()
 
 
 def compute_mse(a, b):
-    """Calcule l'erreur quadratique moyenne entre deux images."""
-    if a.shape != b.shape:
-        raise ValueError("Les deux images doivent avoir la même forme")
-    diff = a.astype(np.float32) - b.astype(np.float32)
-    return float(np.mean(diff * diff))
+    """Calcule l'erreur quadratique moyenne entre deux images.
+
+    ``a`` et ``b`` peuvent être des tableaux ou des images PIL ; le calcul
+    est fait par blocs de lignes en arithmétique entière (voir ``metrics``).
+    """
+    return _chunked_mse(a, b)
 
 
 __all__ = [
     "load_image_to_array",
-    "apply_grayscale"
+    "load_image_reduced",
+    "load_image_for_analysis",
+    "choose_draft_scale",
+    "DEFAULT_ANALYSIS_TOLERANCE",
+    "apply_grayscale",
+    "compute_integral_images",
+    "cell_color_stats",
+    "cell_variances",
+    "grid_layout",
+    "image_to_color_grid",
     "image_to_color_rects",
     "compute_mse",
 ]
\ No newline at end of file
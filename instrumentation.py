@@ -0,0 +1,220 @@
+"""Instrumentation légère du pipeline : durées, allocations et compteurs par étape.
+
+Les fonctions du pipeline ouvrent des spans via ``span("etape")`` et
+incrémentent des compteurs via ``count("nom", n)``. Par défaut le profileur
+actif est désactivé et ces appels ne coûtent qu'un test d'attribut.
+
+    profiler = Profiler(track_memory=True)
+    with use_profiler(profiler):
+        ...
+    profiler.save_json("profil.json")
+    profiler.save_chrome_trace("trace.json")   # à ouvrir dans chrome://tracing ou Perfetto
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class _NullSpan:
+    """Span sans effet utilisé quand l'instrumentation est désactivée."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "start_ns", "start_mem", "counters", "parent")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.counters = {}
+        self.parent = None
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.start_mem = tracemalloc.get_traced_memory()[0] if self.profiler.track_memory else 0
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        allocated = None
+        if self.profiler.track_memory:
+            allocated = tracemalloc.get_traced_memory()[0] - self.start_mem
+        self.profiler._stack().pop()
+        self.profiler._record(self, end_ns, allocated)
+        return False
+
+
+class Profiler:
+    """Collecte les spans (durée, octets alloués, compteurs) d'une exécution.
+
+    ``track_memory`` active ``tracemalloc`` pour mesurer la mémoire allouée
+    nette de chaque span (allocations Python et NumPy), au prix d'un
+    ralentissement sensible. ``enabled=False`` rend toutes les opérations
+    sans effet.
+    """
+
+    def __init__(self, enabled=True, track_memory=False):
+        self.enabled = enabled
+        self.track_memory = enabled and track_memory
+        self.events = []
+        self.counters = {}
+        self._origin_ns = time.perf_counter_ns()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, **args):
+        """Ouvre un span nommé (context manager)."""
+        if not self.enabled:
+            return _NULL_SPAN
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return _Span(self, name, args)
+
+    def count(self, name, value=1):
+        """Incrémente un compteur global et celui du span courant."""
+        if not self.enabled:
+            return
+        stack = self._stack()
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if stack:
+                counters = stack[-1].counters
+                counters[name] = counters.get(name, 0) + value
+
+    def _record(self, span, end_ns, allocated):
+        event = {
+            "name": span.name,
+            "start_us": (span.start_ns - self._origin_ns) / 1000.0,
+            "duration_us": (end_ns - span.start_ns) / 1000.0,
+            "thread": threading.get_ident(),
+            "parent": span.parent.name if span.parent is not None else None,
+        }
+        if allocated is not None:
+            event["allocated_bytes"] = allocated
+        if span.counters:
+            event["counters"] = dict(span.counters)
+        if span.args:
+            event["args"] = span.args
+        with self._lock:
+            self.events.append(event)
+
+    def close(self):
+        """Arrête ``tracemalloc`` s'il a été démarré par ce profileur."""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def summary(self):
+        """Agrège les spans par nom : nombre d'appels, durée totale, octets alloués."""
+        stages = {}
+        for e in self.events:
+            s = stages.setdefault(e["name"], {"calls": 0, "total_s": 0.0})
+            s["calls"] += 1
+            s["total_s"] += e["duration_us"] / 1e6
+            if "allocated_bytes" in e:
+                s["allocated_bytes"] = s.get("allocated_bytes", 0) + e["allocated_bytes"]
+            for k, v in e.get("counters", {}).items():
+                counters = s.setdefault("counters", {})
+                counters[k] = counters.get(k, 0) + v
+        return stages
+
+    def to_dict(self):
+        return {"stages": self.summary(), "counters": dict(self.counters), "events": list(self.events)}
+
+    def save_json(self, path):
+        """Enregistre le résumé par étape, les compteurs et les spans en JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_chrome_trace(self):
+        """Retourne les spans au format Trace Event (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        trace = []
+        for e in self.events:
+            args = dict(e.get("args", {}))
+            args.update(e.get("counters", {}))
+            if "allocated_bytes" in e:
+                args["allocated_bytes"] = e["allocated_bytes"]
+            trace.append({
+                "name": e["name"],
+                "ph": "X",
+                "ts": e["start_us"],
+                "dur": e["duration_us"],
+                "pid": pid,
+                "tid": e["thread"],
+                "args": args,
+            })
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+_DISABLED = Profiler(enabled=False)
+_active = _DISABLED
+
+
+def get_profiler():
+    """Retourne le profileur actif (désactivé par défaut)."""
+    return _active
+
+
+def set_profiler(profiler):
+    """Installe ``profiler`` comme profileur actif (``None`` pour désactiver)."""
+    global _active
+    _active = profiler if profiler is not None else _DISABLED
+
+
+@contextmanager
+def use_profiler(profiler):
+    """Active ``profiler`` le temps d'un bloc ``with``."""
+    previous = _active
+    set_profiler(profiler)
+    try:
+        yield profiler
+    finally:
+        set_profiler(previous)
+        profiler.close()
+
+
+def span(name, **args):
+    """Ouvre un span sur le profileur actif."""
+    if not _active.enabled:
+        return _NULL_SPAN
+    return _active.span(name, **args)
+
+
+def count(name, value=1):
+    """Incrémente un compteur sur le profileur actif."""
+    if _active.enabled:
+        _active.count(name, value)
+
+
+__all__ = ["Profiler", "get_profiler", "set_profiler", "use_profiler", "span", "count"]
@@ -1,7 +1,178 @@
-from image_processor import image_to_color_rects, load_image_to_array, compute_mse, apply_grayscale
-from render import render_image, save_image
-import numpy as np
+from image_processor import (
+    apply_grayscale,
+    compute_mse,
+    image_to_color_grid,
+    load_image_for_analysis,
+    load_image_to_array,
+)
+from render import save_image
+from preview import render_with_preview
+from batch import collect_images, parse_count, run_batch, write_summary
+from pipeline import DEFAULT_QUEUE_SIZE, format_stage_stats, parse_stage_workers, run_pipeline
+from metrics import psnr_from_mse
+import argparse
 import os
+import sys
+import time
+
+SHAPE_TYPES = ["rectangle", "triangle", "circle", "diamond", "star"]
+
+
+def parse_args(argv=None):
+    """Analyse les arguments du mode lot (non interactif)."""
+    parser = argparse.ArgumentParser(
+        description="Reconstruction d'images par formes géométriques (mode lot)."
+    )
+    parser.add_argument("--input", "-i", required=True,
+                        help="Dossier d'images ou motif glob (ex: 'images/*.jpg')")
+    parser.add_argument("--shape", "-s", nargs="+", default=["rectangle"], choices=SHAPE_TYPES,
+                        help="Forme(s) de reconstruction")
+    parser.add_argument("--count", "-n", nargs="+", default=["auto"],
+                        help="Nombre(s) de formes, ou 'auto' (grille 16x16)")
+    parser.add_argument("--engine", choices=["grid", "quadtree", "tessellate", "optimize"], default="grid",
+                        help="Analyse : grille uniforme, subdivision adaptative (quadtree), "
+                             "pavage sans recouvrement (tessellate) ou placement optimisé des formes (optimize)")
+    parser.add_argument("--target-mse", type=float, default=None,
+                        help="Quadtree : arrêter la subdivision à cette MSE, estimée sur les rectangles de "
+                             "couleur moyenne (la MSE des formes rendues est en général plus élevée)")
+    parser.add_argument("--grayscale", "-g", action="store_true",
+                        help="Appliquer le filtre Noir et Blanc")
+    parser.add_argument("--output-dir", "-o", default="resultat",
+                        help="Dossier de sortie")
+    parser.add_argument("--workers", "-w", type=int, default=None,
+                        help="Nombre de processus (défaut : nombre de coeurs)")
+    parser.add_argument("--chunksize", type=int, default=1,
+                        help="Nombre d'images envoyées ensemble à un worker")
+    parser.add_argument("--max-memory-mb", type=int, default=None,
+                        help="Budget mémoire (Mo) des rendus exécutés en parallèle")
+    parser.add_argument("--render-threads", type=int, default=None,
+                        help="Threads de rendu par image (rendu par bandes parallèles)")
+    parser.add_argument("--stream-budget-mb", type=int, default=None,
+                        help="Rendu par bandes à mémoire bornée (Mo par image), pour les très grandes images")
+    parser.add_argument("--profile-dir", default=None,
+                        help="Dossier des profils par image (JSON et trace Chrome)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Mesurer aussi la mémoire allouée par étape (plus lent)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Cache disque des grilles et des rendus (réutilisé d'une exécution à l'autre)")
+    parser.add_argument("--cache-max-mb", type=int, default=None,
+                        help="Taille maximale du cache disque (Mo, défaut 1024)")
+    parser.add_argument("--analysis-tolerance", type=float, default=None,
+                        help="Analyser la grille sur un décodage réduit (JPEG) si l'erreur de couleur "
+                             "estimée reste sous ce seuil (niveaux 0-255)")
+    parser.add_argument("--backend", choices=["pil", "numpy"], default="pil",
+                        help="Rastérisation : une forme à la fois avec PIL, ou toutes les formes "
+                             "d'un gabarit en une passe NumPy (bords à un pixel près)")
+    parser.add_argument("--blend", choices=["average", "paint"], default="average",
+                        help="Composition : moyenne des formes qui se recouvrent, ou peinture directe "
+                             "(la dernière forme peinte l'emporte, beaucoup moins de mémoire)")
+    parser.add_argument("--paint-order", choices=["row-major", "reverse", "variance"], default="row-major",
+                        help="Peinture directe : ordre ligne par ligne, inverse, ou des cellules "
+                             "uniformes aux plus détaillées")
+    parser.add_argument("--paint-alpha", type=float, default=None,
+                        help="Peinture directe : opacité des formes (0-1, défaut opaque)")
+    parser.add_argument("--svg", action="store_true",
+                        help="Exporter aussi chaque rendu en SVG (une primitive par forme)")
+    parser.add_argument("--scene", action="store_true",
+                        help="Enregistrer aussi chaque grille en scène .npz, re-rendable à toute taille (scene.py)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Pipeline asynchrone par étapes (décodage, analyse, rendu, encodage) dans un seul "
+                             "processus, avec mesures d'utilisation et de files par étape")
+    parser.add_argument("--stage-workers", nargs="+", default=[], metavar="ETAPE=N",
+                        help="Pipeline : workers par étape (ex: decode=2 render=2 encode=2)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Pipeline : taille des files bornées entre étapes")
+    parser.add_argument("--summary", choices=["csv", "json", "both"], default="both",
+                        help="Format du résumé écrit dans le dossier de sortie")
+    return parser.parse_args(argv)
+
+
+def main_batch(args):
+    """Traite un lot d'images sans interaction et écrit un résumé."""
+    paths = collect_images(args.input)
+    if not paths:
+        print("Aucune image trouvée :", args.input)
+        return 1
+    try:
+        counts = [parse_count(c) for c in args.count]
+    except ValueError:
+        print("Nombre de formes invalide :", " ".join(args.count))
+        return 1
+
+    def progress(rows):
+        for row in rows:
+            if row.get("error"):
+                print(f"[ERREUR] {row['source']} : {row['error']}")
+            else:
+                print(f"{row['output']} ({row['shapes']} formes, MSE {row['mse']:.2f}, {row['total_s']:.2f}s)")
+
+    print(f"{len(paths)} image(s) à traiter")
+    if args.pipeline:
+        try:
+            concurrency = parse_stage_workers(args.stage_workers)
+        except ValueError as exc:
+            print(exc)
+            return 1
+        rows, stats = run_pipeline(
+            paths,
+            shapes=args.shape,
+            counts=counts,
+            grayscale=args.grayscale,
+            output_dir=args.output_dir,
+            engine=args.engine,
+            target_mse=args.target_mse,
+            analysis_tolerance=args.analysis_tolerance,
+            backend=args.backend,
+            blend=args.blend,
+            paint_order=args.paint_order,
+            paint_alpha=args.paint_alpha,
+            render_workers=args.render_threads,
+            svg=args.svg,
+            scene=args.scene,
+            concurrency=concurrency,
+            queue_size=args.queue_size,
+            progress=progress,
+        )
+        print(format_stage_stats(stats))
+        formats = ("csv", "json") if args.summary == "both" else (args.summary,)
+        for path in write_summary(rows, args.output_dir, formats):
+            print("Résumé enregistré :", path)
+        return 1 if any(r.get("error") for r in rows) else 0
+    rows = run_batch(
+        paths,
+        shapes=args.shape,
+        counts=counts,
+        grayscale=args.grayscale,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        max_memory_mb=args.max_memory_mb,
+        render_workers=args.render_threads,
+        stream_budget_mb=args.stream_budget_mb,
+        profile_dir=args.profile_dir,
+        profile_memory=args.profile_memory,
+        engine=args.engine,
+        target_mse=args.target_mse,
+        cache_dir=args.cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        svg=args.svg,
+        analysis_tolerance=args.analysis_tolerance,
+        backend=args.backend,
+        blend=args.blend,
+        paint_order=args.paint_order,
+        paint_alpha=args.paint_alpha,
+        scene=args.scene,
+        progress=progress,
+    )
+    if args.cache_dir is not None:
+        cached = sum(1 for r in rows if r.get("cache") == "render")
+        reused = sum(1 for r in rows if r.get("cache") == "grid")
+        print(f"Cache : {cached} rendu(s) réutilisé(s), {reused} analyse(s) réutilisée(s), "
+              f"{sum(1 for r in rows if r.get('cache') == 'miss')} calcul(s) complet(s)")
+    formats = ("csv", "json") if args.summary == "both" else (args.summary,)
+    for path in write_summary(rows, args.output_dir, formats):
+        print("Résumé enregistré :", path)
+    return 1 if any(r.get("error") for r in rows) else 0
 
 
 def main():
@@ -46,14 +217,12 @@ def main():
     src_path = os.path.join(image_dir, chosen_image)
     print(f"\nImage choisie : {chosen_image}")
 
-    src = load_image_to_array(src_path)
-
     # Choix du filtre
     print("\n Options de Filtre")
     filter_choice = input("Appliquer le filtre Noir et Blanc ? (y/n) : ").strip().lower()
-    if filter_choice == 'y': 
-        src = apply_grayscale(src)
-        print("Filtre Noir et Blanc appliqué.")
+    grayscale = filter_choice == 'y'
+    if grayscale:
+        print("Filtre Noir et Blanc sélectionné.")
 
     # Proposer des shapes disponibles
     shapes = {
@@ -121,25 +290,53 @@ def main():
             print("\nOpération annulée.")
             return
 
+    # Grille grossière : analyse sur un décodage réduit, la taille de rendu étant lue dans l'en-tête
+    layout = {"max_rectangles": max_rectangles} if max_rectangles is not None else {"grid_cols": 16, "grid_rows": 16}
+    analysis_src, (w, h) = load_image_for_analysis(src_path, **layout)
+    if grayscale:
+        analysis_src = apply_grayscale(analysis_src, single_channel=True)
+
     # Génération de la grille selon le nombre de formes ou automatique 
+    grid = image_to_color_grid(src_path, src_img=analysis_src, size=(w, h), **layout)
     if max_rectangles is not None:
-        rects = image_to_color_rects(src_path, max_rectangles=max_rectangles, src_img=src)
-        print(f"Grille générée : {len(rects)} formes")
+        print(f"Grille générée : {len(grid)} formes")
     else:
-        rects = image_to_color_rects(src_path, grid_cols=16, grid_rows=16, src_img=src)
-        print(f"Grille générée : {len(rects)} formes (16x16)")
-    
-    h, w, _ = src.shape
+        print(f"Grille générée : {len(grid)} formes (16x16)")
 
-    img_out = render_image(rects, w, h, shape=chosen_shape)
     output_dir = "resultat"
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, "sortie.png")
+    preview_path = os.path.join(output_dir, "apercu.png")
+
+    # Aperçus progressifs (1/8, 1/4, 1/2) enregistrés avant le rendu complet ; Ctrl+C annule
+    start = time.perf_counter()
+
+    def show_progress(frame):
+        if frame["scale"] > 1:
+            save_image(frame["image"], preview_path)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"Aperçu 1/{frame['scale']} enregistré : {preview_path} ({elapsed:.0f} ms)")
+
+    try:
+        img_out = render_with_preview(grid, w, h, show_progress, shape=chosen_shape,
+                                      mode="L" if grayscale else "RGB")
+    except KeyboardInterrupt:
+        print("\nRendu annulé.")
+        return
     save_image(img_out, output_path)
 
-    mse = compute_mse(src, np.array(img_out))
+    # La pleine résolution n'est décodée que pour la MSE (sauf si l'analyse l'a déjà chargée)
+    src = analysis_src
+    if src.shape[:2] != (h, w):
+        src = load_image_to_array(src_path)
+        if grayscale:
+            src = apply_grayscale(src, single_channel=True)
+    mse = compute_mse(src, img_out)
     print("Image enregistrée :", output_path)
     print("MSE :", mse)
+    print(f"PSNR : {psnr_from_mse(mse):.2f} dB")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main_batch(parse_args()))
     main()
@@ -0,0 +1,142 @@
+"""Cache LRU de gabarits de masques pré-rastérisés."""
+
+from collections import OrderedDict
+import math
+import threading
+
+import numpy as np
+from shapes import _BBOX_MARGIN, _PROBE_CENTER, _primitive_bbox
+
+
+def _freeze(params):
+    """Convertit un dictionnaire de paramètres en tuple hachable."""
+    return tuple(sorted((k, _freeze(v) if isinstance(v, dict) else v) for k, v in params.items()))
+
+
+class MaskTemplateCache:
+    """Cache borné (LRU) de masques de formes rastérisés une seule fois.
+
+    Dans une grille uniforme, presque toutes les cellules ont la même taille :
+    le masque d'une forme ne dépend alors que de ses paramètres, de la taille
+    de la cellule, de la ligne (cas particulier des triangles de la ligne 0) et
+    de la phase sous-pixel du centre. Le gabarit est rastérisé une fois puis
+    recopié (tamponné) à chaque position, avec le même résultat que
+    ``Shape.create_local_mask``.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, shape, cell_w, cell_h, row, phase_x, phase_y):
+        return (
+            _freeze(shape.to_dict()),
+            cell_w,
+            cell_h,
+            shape.template_row(row),
+            phase_x,
+            phase_y,
+        )
+
+    def _rasterize(self, shape, cell_w, cell_h, row, phase_x, phase_y):
+        """Rastérise un gabarit ; retourne (masque, dx, dy, kx, ky) relatif au centre entier.
+
+        Le gabarit est dessiné dans le repère local de la forme
+        (``Shape.mask_frame``), celui qu'utilise aussi ``create_local_mask`` :
+        les coordonnées passées à PIL sont identiques, donc les pixels aussi.
+        """
+        kx, ky = shape.mask_frame(cell_w, cell_h, row, phase_x, phase_y)
+        kind, coords = shape.geometry(
+            math.inf, math.inf, _PROBE_CENTER + phase_x, _PROBE_CENTER + phase_y, cell_w, cell_h, row
+        )
+        _, _, bx1, by1 = _primitive_bbox(kind, coords)
+        tw = kx + int(math.ceil(bx1 - _PROBE_CENTER)) + 2 * _BBOX_MARGIN + 2
+        th = ky + int(math.ceil(by1 - _PROBE_CENTER)) + 2 * _BBOX_MARGIN + 2
+        mask, left, top = shape.frame_mask(tw, th, kx, ky, phase_x, phase_y, cell_w, cell_h, row)
+        mask.setflags(write=False)
+        return mask, left - kx, top - ky, kx, ky
+
+    def get_mask(self, shape, width, height, center_x, center_y, cell_w, cell_h, row=0):
+        """Retourne ``(mask, left, top)`` comme ``Shape.create_local_mask``.
+
+        Le masque retourné est une vue en lecture seule sur le gabarit en cache.
+        """
+        ix = math.floor(center_x)
+        iy = math.floor(center_y)
+        phase_x = center_x - ix
+        phase_y = center_y - iy
+        key = self._key(shape, cell_w, cell_h, row, phase_x, phase_y)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = self._rasterize(shape, cell_w, cell_h, row, phase_x, phase_y)
+            self._store(key, entry)
+
+        template, dx, dy, kx, ky = entry
+        th, tw = template.shape
+        left = ix + dx
+        top = iy + dy
+        if ix < kx or iy < ky or left < 0 or top < 0:
+            # Près des bords gauche et haut, create_local_mask ne travaille pas dans
+            # le repère local : on dessine directement pour garder un résultat identique.
+            return shape.frame_mask(width, height, ix, iy, phase_x, phase_y, cell_w, cell_h, row)
+        # Découpage du gabarit aux bords droit et bas du canvas
+        x1 = min(tw, width - left)
+        y1 = min(th, height - top)
+        if x1 <= 0 or y1 <= 0:
+            return np.zeros((0, 0), dtype=np.float32), min(width, left), min(height, top)
+        return template[:y1, :x1], left, top
+
+    def _store(self, key, entry):
+        size = entry[0].nbytes
+        with self._lock:
+            self.misses += 1
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old[0].nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Vide le cache et remet les compteurs à zéro."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """Retourne les compteurs du cache (hits, misses, évictions, taille)."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+# Cache partagé par défaut entre tous les rendus du processus
+default_mask_cache = MaskTemplateCache()
+
+
+__all__ = ["MaskTemplateCache", "default_mask_cache"]
@@ -0,0 +1,170 @@
+"""Mesures d'erreur (MSE, PSNR, SSIM) calculées par blocs de lignes.
+
+Les images (tableaux uint8 ``(H, W)`` ou ``(H, W, C)``, ou images PIL) sont
+parcourues par blocs de ``chunk_rows`` lignes avec des buffers entiers
+réutilisés : la mémoire temporaire ne dépend que de la taille d'un bloc.
+"""
+
+import math
+
+import numpy as np
+
+from instrumentation import span
+
+DEFAULT_CHUNK_ROWS = 256
+
+# Fenêtre gaussienne de la SSIM (Wang et al. 2004)
+_SSIM_RADIUS = 5
+_SSIM_SIGMA = 1.5
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+
+def _as_array(img):
+    """Vue NumPy (sans copie si possible) d'une image PIL ou d'un tableau."""
+    arr = np.asarray(img)
+    return arr if arr.ndim == 3 else arr[:, :, None]
+
+
+def _check_pair(a, b):
+    a = _as_array(a)
+    b = _as_array(b)
+    if a.shape != b.shape:
+        raise ValueError("Les deux images doivent avoir la même forme")
+    return a, b
+
+
+def psnr_from_mse(mse_value, peak=255.0):
+    """PSNR (dB) correspondant à une MSE ; infini si les images sont identiques."""
+    if mse_value <= 0:
+        return math.inf
+    return 10.0 * math.log10(peak * peak / mse_value)
+
+
+def compute_error(a, b, cell_edges=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Calcule la MSE et le PSNR entre deux images, et optionnellement une carte d'erreur.
+
+    ``cell_edges`` est un couple ``(x_edges, y_edges)`` de bornes de cellules
+    (voir ``image_processor.grid_layout``, même découpage que
+    ``image_to_color_rects``) ; la carte ``cell_mse`` de forme
+    ``(lignes, colonnes)`` est alors calculée dans la même passe.
+    """
+    a, b = _check_pair(a, b)
+    height, width, channels = a.shape
+    chunk_rows = max(1, int(chunk_rows))
+
+    with span("mse"):
+        buffer = np.empty((min(chunk_rows, height), width, channels), dtype=np.int32)
+        total = 0
+        cell_sse = None
+        if cell_edges is not None:
+            xs = np.minimum(np.asarray(cell_edges[0], dtype=np.int64), width)
+            ys = np.minimum(np.asarray(cell_edges[1], dtype=np.int64), height)
+            cell_sse = np.zeros((len(ys) - 1, len(xs) - 1), dtype=np.int64)
+            row_of_y = np.searchsorted(ys[1:], np.arange(height), side="right")
+            row_err = np.empty((min(chunk_rows, height), width + 1), dtype=np.int64)
+            row_err[:, 0] = 0
+
+        for top in range(0, height, chunk_rows):
+            bottom = min(height, top + chunk_rows)
+            n = bottom - top
+            diff = buffer[:n]
+            np.subtract(a[top:bottom], b[top:bottom], out=diff, dtype=np.int32)
+            np.multiply(diff, diff, out=diff)
+            if cell_sse is None:
+                total += int(diff.sum(dtype=np.int64))
+                continue
+            # Erreur par pixel (somme des canaux), cumulée le long des lignes
+            cumulative = row_err[:n]
+            np.sum(diff, axis=2, dtype=np.int64, out=cumulative[:, 1:])
+            np.cumsum(cumulative[:, 1:], axis=1, out=cumulative[:, 1:])
+            total += int(cumulative[:, -1].sum())
+            valid = row_of_y[top:bottom] < len(cell_sse)
+            np.add.at(
+                cell_sse,
+                row_of_y[top:bottom][valid],
+                (cumulative[:, xs[1:]] - cumulative[:, xs[:-1]])[valid],
+            )
+
+    mse_value = total / float(height * width * channels) if height * width else 0.0
+    result = {"mse": mse_value, "psnr": psnr_from_mse(mse_value), "sse": total}
+    if cell_sse is not None:
+        counts = (ys[1:, None] - ys[:-1, None]) * (xs[None, 1:] - xs[None, :-1]) * channels
+        result["cell_mse"] = np.where(counts > 0, cell_sse / np.maximum(counts, 1), 0.0)
+    return result
+
+
+def mse(a, b, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Erreur quadratique moyenne, calculée en arithmétique entière par blocs."""
+    return compute_error(a, b, chunk_rows=chunk_rows)["mse"]
+
+
+def psnr(a, b, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Rapport signal/bruit de crête (dB)."""
+    return compute_error(a, b, chunk_rows=chunk_rows)["psnr"]
+
+
+def _gaussian_kernel():
+    x = np.arange(-_SSIM_RADIUS, _SSIM_RADIUS + 1, dtype=np.float64)
+    k = np.exp(-(x * x) / (2 * _SSIM_SIGMA * _SSIM_SIGMA))
+    return (k / k.sum()).astype(np.float32)
+
+
+def _filter_valid(data, kernel):
+    """Filtre gaussien séparable 'valid' sur les deux premiers axes."""
+    taps = len(kernel)
+    rows = data.shape[0] - taps + 1
+    cols = data.shape[1] - taps + 1
+    vertical = kernel[0] * data[0:rows]
+    for i in range(1, taps):
+        vertical += kernel[i] * data[i:i + rows]
+    out = kernel[0] * vertical[:, 0:cols]
+    for i in range(1, taps):
+        out += kernel[i] * vertical[:, i:i + cols]
+    return out
+
+
+def ssim(a, b, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Indice de similarité structurelle moyen (fenêtre gaussienne 11x11, σ = 1.5).
+
+    Calculé par canal sur les positions où la fenêtre est entièrement dans
+    l'image, puis moyenné ; les blocs de lignes se recouvrent du rayon de la
+    fenêtre pour donner le même résultat qu'un calcul global.
+    """
+    a, b = _check_pair(a, b)
+    height, width, channels = a.shape
+    taps = 2 * _SSIM_RADIUS + 1
+    if height < taps or width < taps:
+        raise ValueError("Image trop petite pour la SSIM (11x11 minimum)")
+    kernel = _gaussian_kernel()
+    chunk_rows = max(1, int(chunk_rows))
+    out_rows = height - taps + 1
+
+    total = 0.0
+    with span("ssim"):
+        for top in range(0, out_rows, chunk_rows):
+            bottom = min(out_rows, top + chunk_rows)
+            block_a = a[top:bottom + taps - 1].astype(np.float32)
+            block_b = b[top:bottom + taps - 1].astype(np.float32)
+            mu_a = _filter_valid(block_a, kernel)
+            mu_b = _filter_valid(block_b, kernel)
+            sigma_ab = _filter_valid(block_a * block_b, kernel)
+            np.multiply(block_a, block_a, out=block_a)
+            np.multiply(block_b, block_b, out=block_b)
+            sigma_a = _filter_valid(block_a, kernel)
+            sigma_b = _filter_valid(block_b, kernel)
+
+            mu_ab = mu_a * mu_b
+            np.multiply(mu_a, mu_a, out=mu_a)
+            np.multiply(mu_b, mu_b, out=mu_b)
+            sigma_a -= mu_a
+            sigma_b -= mu_b
+            sigma_ab -= mu_ab
+            numerator = (2 * mu_ab + _SSIM_C1) * (2 * sigma_ab + _SSIM_C2)
+            denominator = (mu_a + mu_b + _SSIM_C1) * (sigma_a + sigma_b + _SSIM_C2)
+            total += float((numerator / denominator).sum(dtype=np.float64))
+
+    return total / float(out_rows * (width - taps + 1) * channels)
+
+
+__all__ = ["compute_error", "mse", "psnr", "ssim", "psnr_from_mse"]
@@ -0,0 +1,308 @@
+"""Placement optimisé de formes (approximation "primitive") par recherche locale.
+
+Contrairement à la grille (une forme par cellule), chaque forme est placée
+librement : position, taille et couleur sont choisies par redémarrages
+aléatoires puis escalade (hill climbing). Chaque candidat n'est évalué que
+dans sa boîte englobante : la meilleure couleur et la variation d'erreur
+sont calculées en forme close à partir du canvas courant et d'un buffer
+d'erreur quadratique par pixel, sans jamais recalculer la MSE complète.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+try:
+    from PIL import Image
+except Exception as exc:
+    raise RuntimeError(
+        "Pillow (PIL) n'est pas installé. Installez-le avec 'pip install Pillow'."
+    ) from exc
+
+import numpy as np
+
+from instrumentation import Profiler, span, count, use_profiler
+from shapes import create_shape
+
+# Ligne passée aux formes : évite le cas particulier de la première ligne des triangles
+_FREE_ROW = 1
+
+
+class _State:
+    """Buffers de travail : image cible, canvas courant et erreur quadratique par pixel."""
+
+    def __init__(self, target, canvas, error):
+        self.target = target
+        self.canvas = canvas
+        self.error = error
+        self.height, self.width = target.shape[:2]
+
+
+def _evaluate(state, shape, alpha, params):
+    """Évalue un candidat dans sa boîte englobante.
+
+    Retourne ``(delta, couleur, (masque, gauche, haut, nouveau_canvas, nouvelle_erreur))``
+    ou None si la forme ne couvre aucun pixel. ``delta`` est la variation de
+    l'erreur quadratique totale si la forme était ajoutée.
+    """
+    cx, cy, cw, ch = params
+    mask, mx, my = shape.create_local_mask(state.width, state.height, cx, cy, cw, ch, _FREE_ROW)
+    if mask.size == 0:
+        return None
+    weight = mask * alpha
+    ww = float(np.einsum("ij,ij->", weight, weight))
+    if ww == 0.0:
+        return None
+    mh, mw = mask.shape
+    target = state.target[my:my + mh, mx:mx + mw]
+    current = state.canvas[my:my + mh, mx:mx + mw]
+    w3 = weight[:, :, None]
+
+    # Couleur optimale (moindres carrés) : nouveau = courant + w * (c - courant),
+    # arrondie avant l'évaluation pour que le score soit celui de la couleur placée
+    residual = w3 * current + (target - current)
+    color = np.einsum("ij,ijk->k", weight, residual) / ww
+    np.clip(color, 0.0, 255.0, out=color)
+    np.rint(color, out=color)
+
+    new = current + w3 * (color.astype(np.float32) - current)
+    diff = new - target
+    new_error = np.einsum("ijk,ijk->ij", diff, diff)
+    delta = float(new_error.sum(dtype=np.float64) - state.error[my:my + mh, mx:mx + mw].sum(dtype=np.float64))
+    return delta, color, (mask, mx, my, new, new_error)
+
+
+def _random_params(rng, width, height, max_size):
+    return (
+        float(rng.uniform(0, width)),
+        float(rng.uniform(0, height)),
+        float(rng.uniform(1, max_size)),
+        float(rng.uniform(1, max_size)),
+    )
+
+
+def _mutate(rng, params, width, height, max_size):
+    cx, cy, cw, ch = params
+    which = rng.integers(0, 3)
+    scale = 0.05 * max(width, height)
+    if which == 0:
+        cx = float(np.clip(cx + rng.normal(0, scale), 0, width))
+        cy = float(np.clip(cy + rng.normal(0, scale), 0, height))
+    elif which == 1:
+        cw = float(np.clip(cw + rng.normal(0, scale / 2), 1, max_size))
+    else:
+        ch = float(np.clip(ch + rng.normal(0, scale / 2), 1, max_size))
+    return cx, cy, cw, ch
+
+
+def _search(state, shape, alpha, rng, n_random, n_mutations, max_size):
+    """Redémarrages aléatoires puis escalade sur le meilleur ; retourne (delta, params, couleur)."""
+    best = None
+    for _ in range(n_random):
+        params = _random_params(rng, state.width, state.height, max_size)
+        result = _evaluate(state, shape, alpha, params)
+        if result is not None and (best is None or result[0] < best[0]):
+            best = (result[0], params, result[1])
+    if best is None:
+        return None
+
+    for _ in range(n_mutations):
+        params = _mutate(rng, best[1], state.width, state.height, max_size)
+        result = _evaluate(state, shape, alpha, params)
+        if result is not None and result[0] < best[0]:
+            best = (result[0], params, result[1])
+    count("candidates_evaluated", n_random + n_mutations)
+    return best
+
+
+# --- Évaluation parallèle : buffers partagés entre processus -----------------
+
+_worker = {}
+
+
+def _attach(name, shape):
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+
+
+def _init_worker(names, shape_hw, shape_type, alpha, max_size):
+    h, w = shape_hw
+    blocks = []
+    arrays = []
+    for name, dims in zip(names, [(h, w, 3), (h, w, 3), (h, w)]):
+        block, array = _attach(name, dims)
+        blocks.append(block)
+        arrays.append(array)
+    _worker["blocks"] = blocks
+    _worker["state"] = _State(*arrays)
+    _worker["shape"] = create_shape(shape_type)
+    _worker["alpha"] = alpha
+    _worker["max_size"] = max_size
+
+
+def _worker_search(seed, n_random, n_mutations):
+    """Recherche dans un worker ; retourne ``(meilleur, compteurs)``.
+
+    Les compteurs d'instrumentation du processus worker sont perdus pour le
+    parent : ils sont collectés localement et renvoyés avec le résultat.
+    """
+    rng = np.random.default_rng(seed)
+    profiler = Profiler()
+    with use_profiler(profiler):
+        best = _search(_worker["state"], _worker["shape"], _worker["alpha"], rng,
+                       n_random, n_mutations, _worker["max_size"])
+    return best, profiler.counters
+
+
+def _resize_target(src_img, work_size):
+    height, width = src_img.shape[:2]
+    scale = min(1.0, work_size / float(max(width, height))) if work_size else 1.0
+    if scale >= 1.0:
+        return src_img.astype(np.float32), 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small = Image.fromarray(src_img, mode="RGB").resize(size, Image.BILINEAR)
+    return np.asarray(small, dtype=np.float32), width / float(size[0])
+
+
+def optimize_shapes(src_img, n_shapes, shape="triangle", alpha=0.5, n_random=64, n_mutations=128,
+                    work_size=256, workers=None, seed=0, progress=None):
+    """Place ``n_shapes`` formes une à une pour minimiser l'erreur quadratique.
+
+    L'optimisation se fait sur une version réduite de l'image (``work_size``
+    pixels sur le plus grand côté). À chaque étape, ``n_random`` candidats
+    aléatoires sont tirés puis le meilleur est amélioré par ``n_mutations``
+    mutations ; la forme n'est ajoutée que si elle diminue l'erreur. Avec
+    ``workers`` > 1, la recherche est répartie sur des processus qui lisent
+    le canvas en mémoire partagée (chacun reçoit une part des candidats
+    aléatoires et des mutations, et renvoie ses compteurs d'instrumentation).
+
+    Retourne un dictionnaire : ``shapes`` (placements à l'échelle de l'image
+    source), ``background``, ``alpha``, ``shape``, ``mse`` (historique sur
+    l'image de travail) et ``scale``.
+    """
+    if n_shapes <= 0:
+        raise ValueError("n_shapes doit être > 0")
+    if not 0.0 < alpha <= 1.0:
+        raise ValueError("alpha doit être dans ]0, 1]")
+
+    target, scale = _resize_target(src_img, work_size)
+    h, w = target.shape[:2]
+    max_size = max(2.0, max(w, h) / 2.0)
+    background = target.reshape(-1, 3).mean(axis=0)
+    shape_obj = create_shape(shape)
+
+    blocks = []
+    executor = None
+    state = None
+    try:
+        if workers and workers > 1:
+            # Buffers en mémoire partagée, lus par les workers pendant la recherche
+            arrays = []
+            for dims in [(h, w, 3), (h, w, 3), (h, w)]:
+                block = shared_memory.SharedMemory(create=True, size=int(np.prod(dims)) * 4)
+                blocks.append(block)
+                arrays.append(np.ndarray(dims, dtype=np.float32, buffer=block.buf))
+            state = _State(*arrays)
+            state.target[:] = target
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=([b.name for b in blocks], (h, w), shape, alpha, max_size),
+            )
+        else:
+            state = _State(target, np.empty((h, w, 3), dtype=np.float32), np.empty((h, w), dtype=np.float32))
+
+        state.canvas[:] = background.astype(np.float32)
+        diff = state.canvas - state.target
+        state.error[:] = np.einsum("ijk,ijk->ij", diff, diff)
+        total_error = float(state.error.sum(dtype=np.float64))
+        history = [total_error / (h * w * 3)]
+        placements = []
+
+        with span("optimize", shape=shape, n_shapes=n_shapes):
+            for step in range(n_shapes):
+                if executor is not None:
+                    # Le budget de candidats (aléatoires et mutations) est réparti entre les workers
+                    per_worker = max(1, n_random // workers)
+                    mutations_per_worker = -(-n_mutations // workers)
+                    futures = [
+                        executor.submit(_worker_search, [seed, step, k], per_worker, mutations_per_worker)
+                        for k in range(workers)
+                    ]
+                    results = []
+                    for future in futures:
+                        result, counters = future.result()
+                        for name, value in counters.items():
+                            count(name, value)
+                        if result is not None:
+                            results.append(result)
+                    best = min(results, key=lambda r: r[0]) if results else None
+                else:
+                    rng = np.random.default_rng([seed, step])
+                    best = _search(state, shape_obj, alpha, rng, n_random, n_mutations, max_size)
+
+                if best is None or best[0] >= 0:
+                    continue
+                # Application de la forme retenue (recalculée dans sa boîte englobante)
+                delta, color, (mask, mx, my, new, new_error) = _evaluate(state, shape_obj, alpha, best[1])
+                mh, mw = mask.shape
+                state.canvas[my:my + mh, mx:mx + mw] = new
+                state.error[my:my + mh, mx:mx + mw] = new_error
+                total_error += delta
+                history.append(total_error / (h * w * 3))
+                cx, cy, cw, ch = best[1]
+                placements.append({
+                    "x": cx * scale,
+                    "y": cy * scale,
+                    "cell_width": cw * scale,
+                    "cell_height": ch * scale,
+                    "color": tuple(int(v) for v in color),
+                })
+                count("shapes_placed")
+                if progress is not None:
+                    progress(len(placements), history[-1])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        # Les vues NumPy doivent être libérées avant de fermer la mémoire partagée
+        state = arrays = None
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return {
+        "shape": shape_obj.to_dict(),
+        "alpha": alpha,
+        "background": tuple(int(round(v)) for v in background),
+        "shapes": placements,
+        "mse": history,
+        "scale": scale,
+    }
+
+
+def render_placements(result, width, height):
+    """Rejoue les placements de ``optimize_shapes`` à la taille ``width`` × ``height``.
+
+    Les formes sont composées dans l'ordre avec l'opacité ``alpha``.
+    """
+    shape_cfg = dict(result["shape"])
+    shape_obj = create_shape(shape_cfg["type"]).from_dict(shape_cfg)
+    alpha = result["alpha"]
+    canvas = np.empty((height, width, 3), dtype=np.float32)
+    canvas[:] = np.array(result["background"], dtype=np.float32)
+
+    with span("composite", shapes=len(result["shapes"])):
+        for p in result["shapes"]:
+            mask, mx, my = shape_obj.create_local_mask(
+                width, height, p["x"], p["y"], p["cell_width"], p["cell_height"], _FREE_ROW
+            )
+            if mask.size == 0:
+                continue
+            mh, mw = mask.shape
+            window = canvas[my:my + mh, mx:mx + mw]
+            color = np.array(p["color"], dtype=np.float32)
+            window += (mask * alpha)[:, :, None] * (color - window)
+
+    return Image.fromarray(np.clip(canvas, 0, 255).astype(np.uint8), mode="RGB")
+
+
+__all__ = ["optimize_shapes", "render_placements"]
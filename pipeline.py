@@ -0,0 +1,384 @@
+"""Pipeline asynchrone par étapes pour les lots : décodage, analyse, rendu, encodage.
+
+Chaque étape a ses propres workers (tâches asyncio déléguant le travail à
+un pool de threads dédié : le décodage PIL, NumPy et la compression PNG
+relâchent le GIL) et lit une file bornée alimentée par l'étape précédente.
+Le décodage de l'image N+1 et l'encodage de l'image N-1 avancent donc
+pendant le rendu de l'image N ; une file pleine bloque l'étape en amont
+(contre-pression), ce qui borne le nombre d'images en mémoire.
+
+Étapes :
+
+- ``decode``  : ``load_image_to_array`` (+ filtre Noir et Blanc) et tables de
+  sommes cumulées (une fois par image), puis une tâche par analyse : par
+  nombre de formes, et par pavage pour l'engine 'tessellate' ;
+- ``analyze`` : ``batch.analyse_image``, puis une tâche de rendu par forme
+  partageant la grille (comme ``sweep.sweep_image``) ;
+- ``render``  : ``render_image`` ou ``paint_image`` ;
+- ``encode``  : enregistrement PNG (et SVG / scène), puis MSE.
+
+Pour chaque étape, ``run_pipeline`` mesure le temps de travail
+(``utilization`` = travail / (durée × workers)), le temps passé à attendre
+une entrée (``starved_s``) ou de la place en aval (``blocked_s``) et la
+profondeur de sa file d'entrée : l'étape la plus utilisée est le goulot.
+
+    python3 main.py --input images --count 5000 --pipeline --stage-workers decode=2 render=2 encode=2
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+from batch import _output_name, _unique_stems, analyse_image
+from image_processor import (
+    apply_grayscale,
+    cell_variances,
+    choose_draft_scale,
+    compute_integral_images,
+    compute_mse,
+    load_image_reduced,
+    load_image_to_array,
+)
+from metrics import psnr_from_mse
+from render import BLENDS, paint_image, render_image, save_image
+from scene import grid_to_scene, save_scene
+from svg_export import grid_to_svg
+from tessellation import TILINGS, tile_shape
+
+STAGES = ("decode", "analyze", "render", "encode")
+DEFAULT_CONCURRENCY = {"decode": 2, "analyze": 1, "render": 1, "encode": 2}
+DEFAULT_QUEUE_SIZE = 2
+
+# Période d'échantillonnage des profondeurs de file (secondes)
+_SAMPLE_INTERVAL = 0.05
+
+# Marqueur de fin de flux, un par worker de l'étape suivante
+_DONE = object()
+
+
+class _Stage:
+    """Étape du pipeline : ``concurrency`` workers lisant la file ``inbox``."""
+
+    def __init__(self, name, work, concurrency, inbox):
+        self.name = name
+        self.work = work
+        self.concurrency = max(1, int(concurrency))
+        self.inbox = inbox
+        self.items = 0
+        self.busy_s = 0.0
+        self.starved_s = 0.0
+        self.blocked_s = 0.0
+        self.depth_sum = 0
+        self.depth_samples = 0
+        self.depth_max = 0
+
+    def _call(self, item):
+        # Les éléments en erreur traversent les étapes suivantes sans travail
+        if item["row"].get("error"):
+            return [item]
+        try:
+            return self.work(item)
+        except Exception as exc:
+            item["row"]["error"] = f"{type(exc).__name__}: {exc}"
+            return [item]
+
+    async def _worker(self, executor, outbox):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = time.perf_counter()
+            item = await self.inbox.get()
+            self.starved_s += time.perf_counter() - t
+            if item is _DONE:
+                return
+            t = time.perf_counter()
+            results = await loop.run_in_executor(executor, self._call, item)
+            self.busy_s += time.perf_counter() - t
+            self.items += 1
+            t = time.perf_counter()
+            for result in results:
+                await outbox.put(result)
+            self.blocked_s += time.perf_counter() - t
+
+    async def run(self, outbox, downstream_workers):
+        """Exécute l'étape jusqu'à la fin du flux, puis la signale à l'étape suivante."""
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=self.name) as executor:
+            await asyncio.gather(*(self._worker(executor, outbox) for _ in range(self.concurrency)))
+        for _ in range(downstream_workers):
+            await outbox.put(_DONE)
+
+    def sample(self):
+        depth = self.inbox.qsize()
+        self.depth_sum += depth
+        self.depth_samples += 1
+        self.depth_max = max(self.depth_max, depth)
+
+    def stats(self, wall_s):
+        return {
+            "workers": self.concurrency,
+            "items": self.items,
+            "busy_s": self.busy_s,
+            "utilization": self.busy_s / max(wall_s * self.concurrency, 1e-9),
+            "starved_s": self.starved_s / self.concurrency,
+            "blocked_s": self.blocked_s / self.concurrency,
+            "queue_depth_mean": self.depth_sum / max(self.depth_samples, 1),
+            "queue_depth_max": self.depth_max,
+            "queue_size": self.inbox.maxsize,
+        }
+
+
+def _stage_functions(shapes, counts, grayscale, output_dir, engine, target_mse, analysis_tolerance, backend,
+                     blend, paint_order, paint_alpha, render_workers, svg, scene):
+    """Fonctions de travail (synchrones, exécutées dans les pools) des quatre étapes."""
+    mode = "L" if grayscale else "RGB"
+    # La table des carrés ne sert qu'au quadtree et à l'ordre 'variance'
+    with_variance = engine == "quadtree" or (blend == "paint" and paint_order == "variance")
+
+    def needs_integral(count, tiling, w, h):
+        # Les pavages et l'analyse sur décodage réduit n'utilisent pas les tables de la source
+        if blend == "paint" and paint_order == "variance":
+            return True
+        if tiling is not None:
+            return False
+        if engine == "quadtree" or analysis_tolerance is None:
+            return True
+        layout = {"max_rectangles": count} if count is not None else {"grid_cols": 16, "grid_rows": 16}
+        return choose_draft_scale(w, h, tolerance=analysis_tolerance, **layout) == 1
+
+    def decode(item):
+        path = item["path"]
+        t0 = time.perf_counter()
+        src = load_image_to_array(path)
+        if grayscale:
+            src = apply_grayscale(src, single_channel=True)
+        load_s = time.perf_counter() - t0
+        h, w = src.shape[:2]
+        reduced = {}
+
+        def load_reduced(scale):
+            # Partagée par toutes les tâches de l'image (au pire calculée deux fois en parallèle)
+            if scale not in reduced:
+                small = load_image_reduced(path, scale)
+                reduced[scale] = apply_grayscale(small, single_channel=True) if grayscale else small
+            return reduced[scale]
+
+        # Une analyse par nombre de formes (et par pavage) : les formes la partagent
+        groups = {}
+        for count in counts:
+            for shape in shapes:
+                tiling = shape if engine == "tessellate" and shape in TILINGS else None
+                groups.setdefault((count, tiling), []).append(shape)
+
+        integral = None
+        if any(needs_integral(count, tiling, w, h) for count, tiling in groups):
+            t0 = time.perf_counter()
+            integral = compute_integral_images(src, with_variance=with_variance)
+            load_s += time.perf_counter() - t0
+
+        tasks = []
+        for (count, tiling), group in groups.items():
+            renders = []
+            for shape in group:
+                row = {
+                    "source": path,
+                    "shape": shape,
+                    "requested": "auto" if count is None else count,
+                    "grayscale": grayscale,
+                    "width": w,
+                    "height": h,
+                    "load_s": load_s,
+                }
+                output_path = os.path.join(output_dir,
+                                           _output_name(item["stem"], shape, count, grayscale, engine, blend))
+                renders.append({"row": row, "render_shape": tile_shape(shape) if tiling else shape,
+                                "output": output_path})
+            tasks.append({"row": {"source": path}, "src": src, "count": count, "shape": tiling or "rectangle",
+                          "integral": integral, "renders": renders, "load_reduced": load_reduced})
+        return tasks
+
+    def analyze(item):
+        t0 = time.perf_counter()
+        src = item["src"]
+        integral = item["integral"]
+        try:
+            grid = analyse_image(src, item["count"], engine, target_mse, analysis_tolerance, item["load_reduced"],
+                                 shape=item["shape"], load_integral=None if integral is None else lambda: integral)
+            if blend == "paint" and paint_order == "variance" and grid.variances is None:
+                grid.variances = cell_variances(integral, grid)
+        except Exception as exc:
+            # Une ligne d'erreur par forme, comme si chacune avait été analysée
+            for render in item["renders"]:
+                render["row"]["error"] = f"{type(exc).__name__}: {exc}"
+            return item["renders"]
+        analysis_s = time.perf_counter() - t0
+        # Une tâche de rendu par forme ; les tables ne sont plus référencées
+        tasks = []
+        for render in item["renders"]:
+            render["row"].update(shapes=len(grid), analysis_s=analysis_s)
+            tasks.append({**render, "src": src, "grid": grid})
+        return tasks
+
+    def render(item):
+        t0 = time.perf_counter()
+        h, w = item["src"].shape[:2]
+        if blend == "paint":
+            item["image"] = paint_image(item["grid"], w, h, shape=item["render_shape"], order=paint_order,
+                                        alpha=paint_alpha, mode=mode)
+        else:
+            item["image"] = render_image(item["grid"], w, h, shape=item["render_shape"], workers=render_workers,
+                                         mode=mode, backend=backend)
+        item["row"]["render_s"] = time.perf_counter() - t0
+        return [item]
+
+    def encode(item):
+        row = item["row"]
+        t0 = time.perf_counter()
+        save_image(item["image"], item["output"])
+        base = os.path.splitext(item["output"])[0]
+        h, w = item["src"].shape[:2]
+        if svg:
+            grid_to_svg(item["grid"], w, h, item["render_shape"], path=base + ".svg")
+        if scene:
+            save_scene(grid_to_scene(item["grid"], w, h, item["render_shape"], mode), base + ".npz")
+        t1 = time.perf_counter()
+        mse = compute_mse(item["src"], item["image"])
+        t2 = time.perf_counter()
+        row.update(output=item["output"], mse=mse, psnr=psnr_from_mse(mse), save_s=t1 - t0, mse_s=t2 - t1)
+        row["total_s"] = row["load_s"] + row["analysis_s"] + row["render_s"] + row["save_s"] + row["mse_s"]
+        # Seul le résumé quitte le pipeline : source, grille et image sont libérées
+        return [{"row": row}]
+
+    return {"decode": decode, "analyze": analyze, "render": render, "encode": encode}
+
+
+async def _run(jobs, functions, concurrency, queue_size, progress):
+    concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in STAGES]
+    stages = [_Stage(name, functions[name], concurrency[name], queues[i]) for i, name in enumerate(STAGES)]
+    results = asyncio.Queue()
+    rows = []
+
+    async def feed():
+        for path, stem in jobs:
+            await queues[0].put({"path": path, "stem": stem, "row": {"source": path}})
+        for _ in range(stages[0].concurrency):
+            await queues[0].put(_DONE)
+
+    async def collect():
+        remaining = stages[-1].concurrency
+        while remaining:
+            item = await results.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            rows.append(item["row"])
+            if progress is not None:
+                progress([item["row"]])
+
+    async def sample():
+        while True:
+            for stage in stages:
+                stage.sample()
+            await asyncio.sleep(_SAMPLE_INTERVAL)
+
+    start = time.perf_counter()
+    sampler = asyncio.create_task(sample())
+    outboxes = queues[1:] + [results]
+    downstream = [stage.concurrency for stage in stages[1:]] + [stages[-1].concurrency]
+    await asyncio.gather(
+        feed(),
+        collect(),
+        *(stage.run(outbox, n) for stage, outbox, n in zip(stages, outboxes, downstream)),
+    )
+    wall_s = time.perf_counter() - start
+    sampler.cancel()
+
+    stage_stats = {stage.name: stage.stats(wall_s) for stage in stages}
+    bottleneck = max(stage_stats, key=lambda name: stage_stats[name]["utilization"])
+    return rows, {"wall_s": wall_s, "stages": stage_stats, "bottleneck": bottleneck}
+
+
+def run_pipeline(
+    paths,
+    shapes=("rectangle",),
+    counts=(None,),
+    grayscale=False,
+    output_dir="resultat",
+    engine="grid",
+    target_mse=None,
+    analysis_tolerance=None,
+    backend="pil",
+    blend="average",
+    paint_order="row-major",
+    paint_alpha=None,
+    render_workers=None,
+    svg=False,
+    scene=False,
+    concurrency=None,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    progress=None,
+):
+    """Traite un lot d'images dans le pipeline par étapes ; retourne ``(lignes, statistiques)``.
+
+    Les lignes ont le même format que celles de ``batch.run_batch``.
+    ``concurrency`` donne le nombre de workers par étape (dictionnaire
+    partiel, complété par ``DEFAULT_CONCURRENCY``) et ``queue_size`` la
+    taille des files entre étapes. Les statistiques contiennent la durée
+    totale (``wall_s``), les mesures de chaque étape (``stages``) et
+    l'étape la plus utilisée (``bottleneck``). L'engine 'optimize' n'est
+    pas supporté (pas de grille à rendre).
+    """
+    if engine == "optimize":
+        raise ValueError("L'engine 'optimize' n'est pas supporté par le pipeline")
+    if blend not in BLENDS:
+        raise ValueError(f"Mode de composition inconnu: {blend}")
+    unknown = set(concurrency or {}) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Étape(s) inconnue(s): {', '.join(sorted(unknown))}")
+    if queue_size < 1:
+        raise ValueError("La taille des files doit être positive")
+    os.makedirs(output_dir, exist_ok=True)
+    functions = _stage_functions(list(shapes), list(counts), grayscale, output_dir, engine, target_mse,
+                                 analysis_tolerance, backend, blend, paint_order, paint_alpha, render_workers,
+                                 svg, scene)
+    jobs = list(zip(paths, _unique_stems(paths)))
+    rows, stats = asyncio.run(_run(jobs, functions, concurrency, queue_size, progress))
+    rows.sort(key=lambda r: (r.get("source", ""), str(r.get("requested", "")), r.get("shape", "")))
+    return rows, stats
+
+
+def parse_stage_workers(values):
+    """Convertit des arguments ``étape=N`` (ex: ``render=2``) en dictionnaire de concurrence."""
+    concurrency = {}
+    for value in values or ():
+        name, sep, number = value.partition("=")
+        if not sep or name not in STAGES:
+            raise ValueError(f"Étape invalide (attendu {'|'.join(STAGES)}=N): {value}")
+        workers = int(number)
+        if workers <= 0:
+            raise ValueError(f"Le nombre de workers doit être positif: {value}")
+        concurrency[name] = workers
+    return concurrency
+
+
+def format_stage_stats(stats):
+    """Tableau texte des mesures par étape, goulot signalé."""
+    lines = [f"{'étape':<8} {'workers':>7} {'tâches':>6} {'utilisation':>11} {'attente':>8} "
+             f"{'bloquée':>8} {'file moy.':>9} {'file max':>8}"]
+    for name, s in stats["stages"].items():
+        mark = "  <- goulot" if name == stats["bottleneck"] else ""
+        lines.append(f"{name:<8} {s['workers']:>7} {s['items']:>6} {s['utilization'] * 100:>10.0f}% "
+                     f"{s['starved_s']:>7.2f}s {s['blocked_s']:>7.2f}s {s['queue_depth_mean']:>9.2f} "
+                     f"{s['queue_depth_max']:>5}/{s['queue_size']}{mark}")
+    lines.append(f"durée totale : {stats['wall_s']:.2f}s")
+    return "\n".join(lines)
+
+
+__all__ = [
+    "run_pipeline",
+    "parse_stage_workers",
+    "format_stage_stats",
+    "STAGES",
+    "DEFAULT_CONCURRENCY",
+    "DEFAULT_QUEUE_SIZE",
+]
@@ -0,0 +1,132 @@
+"""Rendu progressif : aperçus à basse résolution puis passe finale par bandes.
+
+    for frame in render_progressive(grid, width, height, shape="circle"):
+        afficher(frame["image"])        # 1/8, 1/4, 1/2 puis pleine résolution
+        if mauvais_choix:
+            break                       # la passe pleine résolution n'est pas payée
+"""
+
+try:
+    from PIL import Image
+except Exception as exc:
+    raise RuntimeError(
+        "Pillow (PIL) n'est pas installé. Installez-le avec 'pip install Pillow'."
+    ) from exc
+
+import numpy as np
+
+from grid import ColorGrid, as_color_grid
+from instrumentation import span
+from mask_cache import default_mask_cache
+from render import _cell_placements, _composite_band, _count_stamps, _stamp_factory, _to_image, render_image
+from shapes import create_shape
+
+DEFAULT_LEVELS = (8, 4, 2)
+
+
+def scale_grid(grid, width, height, scaled_width, scaled_height):
+    """Ramène les cellules d'une grille à la taille ``scaled_width`` × ``scaled_height``.
+
+    Les bords des cellules sont arrondis au pixel le plus proche : des
+    cellules adjacentes restent adjacentes et une cellule réduite à zéro
+    pixel est simplement ignorée au rendu. Les couleurs sont partagées.
+    """
+    grid = as_color_grid(grid)
+    fx = scaled_width / float(width)
+    fy = scaled_height / float(height)
+    lefts = np.rint(grid.lefts * fx).astype(np.int64)
+    tops = np.rint(grid.tops * fy).astype(np.int64)
+    rights = np.rint((grid.lefts + grid.widths) * fx).astype(np.int64)
+    bottoms = np.rint((grid.tops + grid.heights) * fy).astype(np.int64)
+    return ColorGrid(
+        grid.rows,
+        grid.cols,
+        lefts,
+        tops,
+        rights - lefts,
+        bottoms - tops,
+        grid.colors,
+        grid.variances,
+        regular=grid.regular,
+        variants=grid.variants,
+    )
+
+
+def render_progressive(rects, width, height, shape="rectangle", levels=DEFAULT_LEVELS,
+                       mask_cache=default_mask_cache, final_steps=4, mode="RGB"):
+    """Générateur d'aperçus successifs d'un rendu.
+
+    Produit d'abord un aperçu par facteur de réduction de ``levels`` (1/8,
+    1/4, 1/2 par défaut), rendu avec les mêmes couleurs de cellules, puis
+    la passe pleine résolution en ``final_steps`` groupes de bandes : les
+    lignes pas encore rendues montrent l'aperçu précédent agrandi.
+
+    Chaque élément est un dictionnaire ``{"scale", "image", "progress"}``
+    (``scale`` = 1 pour la passe finale, ``progress`` entre 0 et 1) ; la
+    dernière image est identique à celle de ``render_image`` (même ``mode``,
+    "RGB" ou "L"). Interrompre l'itération annule le reste du rendu.
+    """
+    if mode not in ("RGB", "L"):
+        raise ValueError(f"Mode de rendu inconnu: {mode}")
+    channels = 1 if mode == "L" else 3
+    grid = as_color_grid(rects)
+    preview = None
+    for factor in levels:
+        scaled_width = max(1, width // factor)
+        scaled_height = max(1, height // factor)
+        if factor <= 1 or (scaled_width, scaled_height) == (width, height):
+            continue
+        with span("preview", scale=factor):
+            small = scale_grid(grid, width, height, scaled_width, scaled_height)
+            preview = render_image(small, scaled_width, scaled_height, shape=shape, mask_cache=mask_cache,
+                                   mode=mode)
+        yield {"scale": factor, "image": preview, "progress": 0.0}
+
+    if not len(grid):
+        yield {"scale": 1, "image": Image.new(mode, (width, height), 0), "progress": 1.0}
+        return
+
+    # Passe finale : les bandes remplacent progressivement l'aperçu agrandi
+    if preview is not None:
+        out = np.array(preview.resize((width, height), Image.NEAREST), dtype=np.uint8)
+        out = out.reshape(height, width, channels)
+    else:
+        out = np.zeros((height, width, channels), dtype=np.uint8)
+    canvas = np.zeros((height, width, channels), dtype=np.float32)
+    weight_map = np.zeros((height, width), dtype=np.float32)
+
+    with span("rasterize"):
+        make_stamp = _stamp_factory(create_shape(shape), width, height, mask_cache)
+        stamps = [s for s in map(make_stamp, _cell_placements(grid, width, height, channels)) if s[0].size]
+        _count_stamps(stamps)
+    tops = np.array([s[2] for s in stamps], dtype=np.int64)
+    bottoms = tops + np.array([s[0].shape[0] for s in stamps], dtype=np.int64)
+
+    step = -(-height // max(1, final_steps))
+    for top in range(0, height, step):
+        bottom = min(height, top + step)
+        idx = np.nonzero((tops < bottom) & (bottoms > top))[0]
+        with span("composite", top=top):
+            _composite_band(canvas, weight_map, out, [stamps[i] for i in idx], top, bottom)
+        yield {"scale": 1, "image": _to_image(out, mode), "progress": bottom / float(height)}
+
+
+def render_with_preview(rects, width, height, callback, shape="rectangle", levels=DEFAULT_LEVELS,
+                        mask_cache=default_mask_cache, final_steps=4, mode="RGB"):
+    """Variante à callback de ``render_progressive``.
+
+    ``callback(frame)`` est appelé pour chaque aperçu ; s'il retourne
+    ``False`` le rendu est annulé et la fonction retourne None. Sinon
+    retourne l'image finale.
+    """
+    image = None
+    frames = render_progressive(rects, width, height, shape, levels, mask_cache, final_steps, mode)
+    for frame in frames:
+        if callback(frame) is False:
+            frames.close()
+            return None
+        image = frame["image"]
+    return image
+
+
+__all__ = ["render_progressive", "render_with_preview", "scale_grid", "DEFAULT_LEVELS"]
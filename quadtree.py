@@ -0,0 +1,150 @@
+"""Analyse adaptative : subdivision en quadtree guidée par la variance des couleurs."""
+
+import heapq
+
+import numpy as np
+
+from grid import ColorGrid
+from image_processor import compute_integral_images, load_image_to_array
+from instrumentation import span, count
+
+
+def _cell_sse(sat, sat_sq, x0, y0, x1, y1):
+    """Somme des carrés des écarts à la moyenne d'une cellule (tous canaux), en O(1)."""
+    n = (x1 - x0) * (y1 - y0)
+    if n <= 0:
+        return 0.0
+    s = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+    sq = sat_sq[y1, x1] - sat_sq[y0, x1] - sat_sq[y1, x0] + sat_sq[y0, x0]
+    return float(np.sum(sq - s * s / n))
+
+
+def _split(x0, y0, x1, y1, min_cell_size):
+    """Découpe une cellule en 4 (ou 2 si une dimension est trop petite) ; [] si impossible."""
+    can_x = x1 - x0 >= 2 * min_cell_size
+    can_y = y1 - y0 >= 2 * min_cell_size
+    mx = (x0 + x1) // 2
+    my = (y0 + y1) // 2
+    if can_x and can_y:
+        return [(x0, y0, mx, my), (mx, y0, x1, my), (x0, my, mx, y1), (mx, my, x1, y1)]
+    if can_x:
+        return [(x0, y0, mx, y1), (mx, y0, x1, y1)]
+    if can_y:
+        return [(x0, y0, x1, my), (x0, my, x1, y1)]
+    return []
+
+
+def _root_cells(width, height, max_shapes):
+    """Grille initiale de cellules à peu près carrées (au plus ``max_shapes`` cellules)."""
+    if width >= height:
+        cols, rows = max(1, round(width / float(height or 1))), 1
+    else:
+        cols, rows = 1, max(1, round(height / float(width or 1)))
+    if max_shapes is not None and cols * rows > max_shapes:
+        cols, rows = (max_shapes, 1) if width >= height else (1, max_shapes)
+    xs = [c * width // cols for c in range(cols + 1)]
+    ys = [r * height // rows for r in range(rows + 1)]
+    return [(xs[c], ys[r], xs[c + 1], ys[r + 1]) for r in range(rows) for c in range(cols)]
+
+
+def image_to_quadtree_grid(path, max_shapes=256, target_mse=None, src_img=None, integral=None,
+                           min_cell_size=2):
+    """Découpe une image en cellules de tailles variables selon la variance des couleurs.
+
+    Les cellules sont subdivisées par ordre de gain (réduction de l'erreur
+    quadratique) décroissant, via une file de priorité, jusqu'à atteindre
+    ``max_shapes`` cellules ou une MSE (reconstruction par couleurs moyennes)
+    inférieure ou égale à ``target_mse``. La variance de chaque cellule est
+    obtenue en O(1) à partir des tables de sommes cumulées.
+
+    ``target_mse`` porte sur les rectangles pleins de couleur moyenne, pas
+    sur les formes rendues : c'est une approximation. Une forme qui ne
+    couvre pas toute sa cellule (cercle, losange, étoile...) ou qui déborde
+    sur ses voisines (``overlap``) donne en général une MSE de rendu plus
+    élevée que la cible.
+
+    Retourne un ``ColorGrid`` non régulier, directement utilisable par
+    ``render_image``.
+    """
+    if max_shapes is None and target_mse is None:
+        raise ValueError("max_shapes ou target_mse doit être spécifié")
+    if max_shapes is not None and max_shapes <= 0:
+        raise ValueError("max_shapes doit être > 0")
+    if min_cell_size < 1:
+        raise ValueError("min_cell_size doit être >= 1")
+
+    if src_img is None:
+        src_img = load_image_to_array(path)
+
+    with span("analysis", engine="quadtree"):
+        if integral is None or integral[1] is None:
+            integral = compute_integral_images(src_img, with_variance=True)
+        sat, sat_sq = integral
+        height, width = src_img.shape[:2]
+        channels = sat.shape[2]
+        total_values = float(width * height * channels)
+
+        cells = _root_cells(width, height, max_shapes)
+        sse = {cell: _cell_sse(sat, sat_sq, *cell) for cell in cells}
+        total_sse = sum(sse.values())
+        heap = []
+        order = 0
+
+        def push(cell):
+            # Priorité : gain d'erreur obtenu en subdivisant la cellule
+            nonlocal order
+            children = _split(*cell, min_cell_size)
+            if not children:
+                return
+            child_sse = [_cell_sse(sat, sat_sq, *child) for child in children]
+            gain = sse[cell] - sum(child_sse)
+            heapq.heappush(heap, (-gain, order, cell, children, child_sse))
+            order += 1
+
+        for cell in cells:
+            push(cell)
+
+        n_cells = len(cells)
+        leaves = set(cells)
+        while heap:
+            if target_mse is not None and total_sse / total_values <= target_mse:
+                break
+            neg_gain, _, cell, children, child_sse = heapq.heappop(heap)
+            if max_shapes is not None and n_cells + len(children) - 1 > max_shapes:
+                continue
+            leaves.remove(cell)
+            total_sse += neg_gain
+            n_cells += len(children) - 1
+            for child, child_err in zip(children, child_sse):
+                sse[child] = child_err
+                leaves.add(child)
+                push(child)
+
+        count("cells", n_cells)
+        count("pixels_analysed", width * height)
+        return _leaves_to_grid(sorted(leaves, key=lambda c: (c[1], c[0])), sat, sat_sq)
+
+
+def _leaves_to_grid(leaves, sat, sat_sq):
+    """Construit le ``ColorGrid`` (couleurs moyennes, variances) des feuilles du quadtree."""
+    boxes = np.array(leaves, dtype=np.int64).reshape(-1, 4)
+    x0, y0, x1, y1 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    sums = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+    sums_sq = sat_sq[y1, x1] - sat_sq[y0, x1] - sat_sq[y1, x0] + sat_sq[y0, x0]
+    counts = ((x1 - x0) * (y1 - y0))[:, None]
+    safe = np.maximum(counts, 1)
+    means = (2 * sums + safe) // (2 * safe)
+    mean_f = sums / safe
+    variances = np.maximum(sums_sq / safe - mean_f * mean_f, 0.0).mean(axis=1)
+    if means.shape[1] == 1:
+        means = np.repeat(means, 3, axis=1)
+
+    widths = x1 - x0
+    heights = y1 - y0
+    # Indices de ligne/colonne au niveau de chaque cellule (la ligne 0 touche le bord haut)
+    rows = y0 // np.maximum(heights, 1)
+    cols = x0 // np.maximum(widths, 1)
+    return ColorGrid(rows, cols, x0, y0, widths, heights, means, variances, regular=False)
+
+
+__all__ = ["image_to_quadtree_grid"]
@@ -1,85 +1,257 @@
 """Module pour le rendu et l'affichage des images générées."""
 
 try:
-    from PIL import Image
+    from PIL import Image, ImageDraw
 except Exception as exc:
     raise RuntimeError(
         "Pillow (PIL) n'est pas installé. Installez-le avec 'pip install Pillow'."
     ) from exc
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from shapes import create_shape
-
-
-def render_image(rects, width, height, shape="rectangle"):
-    """Rend une image à partir d'une liste de rectangles de grille avec différentes formes."""
-    if not rects:
-        return Image.new("RGB", (width, height), (0, 0, 0))
-
-    # Calcul des dimensions de la grille
-    grid_rows = max(r["row"] for r in rects) + 1
-    grid_cols = max(r["col"] for r in rects) + 1
-
-    # Calcul des largeurs de colonnes et hauteurs de lignes
-    col_widths = [0] * grid_cols
-    row_heights = [0] * grid_rows
-    for r in rects:
-        c = r["col"]
-        rw = r["cell_width"]
-        if rw > col_widths[c]:
-            col_widths[c] = rw
-        rr = r["row"]
-        rh = r["cell_height"]
-        if rh > row_heights[rr]:
-            row_heights[rr] = rh
-
-    # Calcul des offsets pour positionner les cellules
-    x_offsets = [0] * (grid_cols + 1)
-    y_offsets = [0] * (grid_rows + 1)
-    for i in range(grid_cols):
-        x_offsets[i + 1] = x_offsets[i] + col_widths[i]
-    for j in range(grid_rows):
-        y_offsets[j + 1] = y_offsets[j] + row_heights[j]
+from shapes import create_shape, _draw_primitive
+from mask_cache import default_mask_cache
+from grid import as_color_grid
+from instrumentation import span, count
+from rasterizer import composite_vectorized
+
+BACKENDS = ("pil", "numpy")
+BLENDS = ("average", "paint")
+PAINT_ORDERS = ("row-major", "reverse", "variance")
+
+
+def _cell_arrays(grid, width, height, channels=3):
+    """Centres, dimensions, lignes et couleurs des cellules dessinables (tableaux parallèles).
+
+    Avec ``channels=1``, la couleur est réduite au premier canal (grille en niveaux de gris).
+    Les tuiles d'un pavage (``grid.variants``) gardent leur boîte entière, même
+    si elle déborde de l'image, et reçoivent leur variante à la place de la ligne.
+    """
+    left = grid.lefts
+    top = grid.tops
+    if grid.variants is None:
+        right = np.minimum(width, left + grid.widths)
+        bottom = np.minimum(height, top + grid.heights)
+        visible = np.nonzero((right > left) & (bottom > top))[0]
+        rows = grid.rows[visible]
+    else:
+        right = left + grid.widths
+        bottom = top + grid.heights
+        visible = np.nonzero((right > np.maximum(left, 0)) & (bottom > np.maximum(top, 0))
+                             & (left < width) & (top < height))[0]
+        rows = grid.variants[visible]
+
+    # Calcul du centre et des dimensions de chaque cellule
+    center_x = ((left + right) / 2.0)[visible]
+    center_y = ((top + bottom) / 2.0)[visible]
+    cell_w = (right - left)[visible]
+    cell_h = (bottom - top)[visible]
+    colors = grid.colors[visible, :channels].astype(np.float32)
+    return center_x, center_y, cell_w, cell_h, rows, colors
+
+
+def _cell_placements(grid, width, height, channels=3):
+    """Calcule, pour chaque cellule dessinable, (centre_x, centre_y, largeur, hauteur, ligne, couleur)."""
+    center_x, center_y, cell_w, cell_h, rows, colors = _cell_arrays(grid, width, height, channels)
+    return list(zip(center_x.tolist(), center_y.tolist(), cell_w.tolist(), cell_h.tolist(), rows.tolist(), colors))
 
-    # Initialisation du canvas et de la carte de poids
-    canvas = np.zeros((height, width, 3), dtype=np.float32)
-    weight_map = np.zeros((height, width), dtype=np.float32)
-    
-    shape_obj = create_shape(shape)
 
-    # Application de chaque formes sur le canvas
-    for r in rects:
-        row = r["row"]
-        col = r["col"]
-        color = np.array(r["color"], dtype=np.float32)
-        left = x_offsets[col]
-        top = y_offsets[row]
-        right = min(width, left + r["cell_width"])
-        bottom = min(height, top + r["cell_height"])
-        
-        if right <= left or bottom <= top:
+def _stamp_factory(shape_obj, width, height, mask_cache):
+    """Retourne une fonction placement -> (masque, gauche, haut, couleur)."""
+    def make_stamp(placement):
+        center_x, center_y, cell_w, cell_h, row, color = placement
+        if mask_cache is not None:
+            mask, mx, my = mask_cache.get_mask(shape_obj, width, height, center_x, center_y, cell_w, cell_h, row)
+        else:
+            mask, mx, my = shape_obj.create_local_mask(width, height, center_x, center_y, cell_w, cell_h, row)
+        return mask, mx, my, color
+    return make_stamp
+
+
+def _count_stamps(stamps):
+    """Compteurs d'instrumentation : formes tamponnées et pixels de masque traités."""
+    count("masks_stamped", len(stamps))
+    count("pixels_touched", sum(s[0].size for s in stamps))
+
+
+def _composite_band(canvas, weight_map, out, stamps, top, bottom, origin=0):
+    """Accumule les formes sur les lignes [top, bottom) puis normalise la bande.
+
+    Les formes sont appliquées dans l'ordre de ``stamps`` : chaque pixel reçoit
+    exactement la même suite d'additions que dans le rendu séquentiel. La ligne
+    ``y`` de l'image correspond à la ligne ``y - origin`` des tableaux, ce qui
+    permet de travailler sur des buffers limités à une bande. Le nombre de
+    canaux est celui de ``canvas`` (3 en couleur, 1 en niveaux de gris).
+    """
+    channels = canvas.shape[2]
+    for mask, mx, my, color in stamps:
+        mh, mw = mask.shape
+        y0 = max(top, my)
+        y1 = min(bottom, my + mh)
+        if y1 <= y0:
             continue
-        
-        # Calcul du centre et des dimensions de la cellule
-        center_x = (left + right) / 2.0
-        center_y = (top + bottom) / 2.0
-        cell_w = right - left
-        cell_h = bottom - top
-        
-        # Création du masque et application de la couleur
-        mask = shape_obj.create_mask(width, height, center_x, center_y, cell_w, cell_h, row)
-        
-        for c in range(3):
-            canvas[:, :, c] += mask * color[c]
-        weight_map += mask
+        band_mask = mask[y0 - my:y1 - my]
+        window = canvas[y0 - origin:y1 - origin, mx:mx + mw]
+        for c in range(channels):
+            window[:, :, c] += band_mask * color[c]
+        weight_map[y0 - origin:y1 - origin, mx:mx + mw] += band_mask
 
     # Normalisation pour gérer les chevauchements
-    weight_map = np.maximum(weight_map, 1e-6)
-    for c in range(3):
-        canvas[:, :, c] /= weight_map
-    
-    canvas = np.clip(canvas, 0, 255).astype(np.uint8)
-    return Image.fromarray(canvas, mode="RGB")
+    band_canvas = canvas[top - origin:bottom - origin]
+    band_weight = np.maximum(weight_map[top - origin:bottom - origin], 1e-6)
+    for c in range(channels):
+        band_canvas[:, :, c] /= band_weight
+
+    out[top - origin:bottom - origin] = np.clip(band_canvas, 0, 255).astype(np.uint8)
+
+
+def _to_image(out, mode):
+    """Image PIL d'un tableau ``(H, W, C)`` uint8 (canal unique en mode "L")."""
+    return Image.fromarray(out[:, :, 0] if mode == "L" else out, mode=mode)
+
+
+def render_image(rects, width, height, shape="rectangle", mask_cache=default_mask_cache,
+                 workers=None, band_height=None, mode="RGB", backend="pil"):
+    """Rend une image à partir d'une grille de cellules avec différentes formes.
+
+    ``rects`` est un ``ColorGrid`` ou la liste de dictionnaires de
+    ``image_to_color_rects``. Les masques sont tamponnés depuis ``mask_cache`` (gabarits pré-rastérisés) ;
+    ``mask_cache=None`` rastérise chaque forme individuellement.
+
+    Avec ``workers`` > 1, le canvas est découpé en bandes horizontales de
+    ``band_height`` lignes, composées en parallèle sur un pool de threads
+    (NumPy relâche le GIL) ; chaque bande ne reçoit que les formes qui la
+    recouvrent. Le résultat est identique au rendu séquentiel.
+
+    ``mode="L"`` rend une grille en niveaux de gris sur un canvas à un seul
+    canal (premier canal des couleurs) et retourne une image "L", égale à
+    chaque canal du rendu RGB de la même grille pour un tiers du travail.
+
+    ``backend="numpy"`` rastérise toutes les formes d'un même gabarit en une
+    passe vectorisée (voir ``rasterizer``) au lieu de tamponner un masque PIL
+    par forme ; les bords des formes peuvent différer d'un pixel. ``workers``
+    et ``mask_cache`` sont alors ignorés.
+    """
+    if mode not in ("RGB", "L"):
+        raise ValueError(f"Mode de rendu inconnu: {mode}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de rendu inconnu: {backend}")
+    if band_height is not None and band_height < 1:
+        raise ValueError(f"Hauteur de bande invalide (1 ligne au moins attendue): {band_height}")
+    channels = 1 if mode == "L" else 3
+    grid = as_color_grid(rects)
+    if not len(grid):
+        return Image.new(mode, (width, height), 0)
+
+    if backend == "numpy":
+        arrays = _cell_arrays(grid, width, height, channels)
+        out = composite_vectorized(create_shape(shape), width, height, *arrays)
+        return _to_image(out, mode)
+
+    placements = _cell_placements(grid, width, height, channels)
+    make_stamp = _stamp_factory(create_shape(shape), width, height, mask_cache)
+
+    # Initialisation du canvas et de la carte de poids
+    canvas = np.zeros((height, width, channels), dtype=np.float32)
+    weight_map = np.zeros((height, width), dtype=np.float32)
+    out = np.empty((height, width, channels), dtype=np.uint8)
+
+    if not workers or workers <= 1:
+        with span("rasterize"):
+            stamps = [s for s in map(make_stamp, placements) if s[0].size]
+            _count_stamps(stamps)
+        with span("composite"):
+            _composite_band(canvas, weight_map, out, stamps, 0, height)
+        return _to_image(out, mode)
+
+    if band_height is None:
+        # Plusieurs bandes par worker pour équilibrer la charge
+        band_height = max(16, -(-height // (workers * 4)))
+    bands = [(y, min(height, y + band_height)) for y in range(0, height, band_height)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        with span("rasterize"):
+            stamps = [s for s in executor.map(make_stamp, placements) if s[0].size]
+            _count_stamps(stamps)
+        # Sélection, pour chaque bande, des formes qui la recouvrent (ordre conservé)
+        tops = np.array([s[2] for s in stamps], dtype=np.int64)
+        bottoms = tops + np.array([s[0].shape[0] for s in stamps], dtype=np.int64)
+        futures = []
+        for top, bottom in bands:
+            idx = np.nonzero((tops < bottom) & (bottoms > top))[0]
+            band_stamps = [stamps[i] for i in idx]
+            futures.append(
+                executor.submit(_composite_band, canvas, weight_map, out, band_stamps, top, bottom)
+            )
+        with span("composite", bands=len(bands)):
+            for future in futures:
+                future.result()
+
+    return _to_image(out, mode)
+
+
+def paint_order(grid, order="row-major"):
+    """Indices des cellules de ``grid`` dans l'ordre du peintre demandé.
+
+    "row-major" parcourt les cellules ligne par ligne (haut en bas, gauche à
+    droite), "reverse" dans l'ordre inverse, "variance" des cellules les plus
+    uniformes aux plus détaillées (ces dernières sont peintes en dernier, donc
+    par-dessus ; à variance égale l'ordre ligne par ligne est conservé).
+    """
+    if order not in PAINT_ORDERS:
+        raise ValueError(f"Ordre de peinture inconnu: {order}")
+    indices = np.lexsort((grid.lefts, grid.tops))
+    if order == "reverse":
+        return indices[::-1]
+    if order == "variance":
+        if grid.variances is None:
+            raise ValueError("L'ordre 'variance' nécessite une grille avec variances")
+        return indices[np.argsort(grid.variances[indices], kind="stable")]
+    return indices
+
+
+def paint_image(rects, width, height, shape="rectangle", order="row-major", alpha=None, mode="RGB"):
+    """Peint les formes directement sur une image uint8, sans masques flottants.
+
+    Contrairement à ``render_image`` (moyenne pondérée des formes qui se
+    recouvrent), chaque forme est remplie par ``ImageDraw`` dans l'ordre du
+    peintre ``order`` (voir ``paint_order``) : la dernière forme peinte
+    l'emporte. Seule l'image de sortie est allouée (3 octets par pixel en RGB).
+
+    ``alpha`` (entre 0 et 1) mélange chaque forme avec ce qui est déjà peint
+    au lieu de le remplacer ; en mode "L", la peinture se fait alors sur une
+    image RGB à canaux égaux, convertie en "L" à la fin.
+    """
+    if mode not in ("RGB", "L"):
+        raise ValueError(f"Mode de rendu inconnu: {mode}")
+    if alpha is not None and not 0.0 <= alpha <= 1.0:
+        raise ValueError(f"Alpha de peinture invalide (0-1 attendu): {alpha}")
+    grid = as_color_grid(rects)
+    blended = alpha is not None and alpha < 1.0
+    canvas_mode = "RGB" if blended else mode
+    img = Image.new(canvas_mode, (width, height), 0)
+    if not len(grid):
+        return img.convert(mode) if canvas_mode != mode else img
+
+    grid = grid.take(paint_order(grid, order))
+    center_x, center_y, cell_w, cell_h, rows, colors = _cell_arrays(grid, width, height)
+    colors = colors.astype(np.uint8)
+    if mode == "L":
+        colors = colors[:, [0, 0, 0]] if blended else colors[:, [0]]
+    if blended:
+        colors = np.column_stack([colors, np.full(len(colors), round(alpha * 255), dtype=np.uint8)])
+    fills = colors[:, 0].tolist() if colors.shape[1] == 1 else list(map(tuple, colors.tolist()))
+
+    shape_obj = create_shape(shape)
+    draw = ImageDraw.Draw(img, "RGBA" if blended else None)
+    with span("paint", order=order):
+        for x, y, cw, ch, row, fill in zip(center_x.tolist(), center_y.tolist(), cell_w.tolist(),
+                                           cell_h.tolist(), rows.tolist(), fills):
+            kind, coords = shape_obj.geometry(width, height, x, y, cw, ch, row)
+            _draw_primitive(draw, kind, coords, 0, 0, fill=fill)
+        count("shapes_painted", len(fills))
+    return img.convert(mode) if canvas_mode != mode else img
 
 
 def show_image(img: Image.Image) -> None:
@@ -89,7 +261,17 @@ def show_image(img: Image.Image) -> None:
 
 def save_image(img: Image.Image, path: str) -> None:
     """Enregistre l'image au chemin donné."""
-    img.save(path)
+    with span("encode"):
+        img.save(path)
 
 
-__all__ = ["render_image", "show_image", "save_image"]
\ No newline at end of file
+__all__ = [
+    "render_image",
+    "paint_image",
+    "paint_order",
+    "show_image",
+    "save_image",
+    "BACKENDS",
+    "BLENDS",
+    "PAINT_ORDERS",
+]
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""Cache disque adressé par contenu des analyses et des rendus.
+
+Les entrées sont indexées par une empreinte des pixels de l'image source
+et par les paramètres du calcul (filtre, nombre de formes, moteur,
+``to_dict()`` de la forme...). Deux couches sont stockées séparément :
+
+- ``grid``   : la grille analysée (``ColorGrid``, fichier ``.npz``, quelques Ko) ;
+- ``render`` : l'image rendue (``.png``) et ses métadonnées (``.json`` : MSE, nombre de formes).
+
+Une troisième couche, ``sources``, mémorise l'empreinte des pixels de
+chaque fichier (chemin, taille, date de modification) pour éviter de
+décoder une image inchangée quand son rendu est déjà en cache.
+
+Le cache est utilisable par plusieurs processus en même temps : chaque
+écriture passe par un fichier temporaire renommé atomiquement, et une
+entrée supprimée par un autre processus est simplement vue comme absente.
+La taille totale est bornée par ``max_bytes`` (éviction LRU selon la date
+de dernier accès, mise à jour à chaque lecture).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from grid import ColorGrid
+from instrumentation import count
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_LAYERS = ("grid", "render", "sources")
+
+
+def pixel_digest(src):
+    """Empreinte (hexadécimale) des pixels et de la forme d'un tableau image."""
+    arr = np.ascontiguousarray(src)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr((arr.shape, arr.dtype.str)).encode("ascii"))
+    h.update(memoryview(arr).cast("B"))
+    return h.hexdigest()
+
+
+def cache_key(digest, **params):
+    """Clé d'une entrée : empreinte des pixels + paramètres (JSON trié)."""
+    payload = json.dumps({"source": digest, "params": params}, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """Cache disque borné des grilles analysées et des images rendues.
+
+    ``stats()`` retourne les compteurs de succès et d'échecs par couche
+    ainsi que les évictions effectuées par ce processus.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes doit être > 0")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = {layer: 0 for layer in _LAYERS}
+        self.misses = {layer: 0 for layer in _LAYERS}
+        self.evictions = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        for layer in _LAYERS:
+            os.makedirs(os.path.join(directory, layer), exist_ok=True)
+
+    # --- Fichiers ------------------------------------------------------------
+
+    def _path(self, layer, key, ext):
+        return os.path.join(self.directory, layer, key[:2], key + ext)
+
+    def _record(self, layer, hit):
+        with self._lock:
+            if hit:
+                self.hits[layer] += 1
+            else:
+                self.misses[layer] += 1
+        count(f"cache_{layer}_{'hits' if hit else 'misses'}")
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write_atomic(self, path, write):
+        """Écrit via ``write(f)`` dans un fichier temporaire puis le renomme."""
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        size = os.path.getsize(path)
+        with self._lock:
+            self._written += size
+            due = self._written >= self.max_bytes // 16
+            if due:
+                self._written = 0
+        if due:
+            self.evict()
+
+    # --- Couche sources -----------------------------------------------------
+
+    @staticmethod
+    def _file_id(path):
+        st = os.stat(path)
+        return cache_key(os.path.abspath(path), size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+    def lookup_source(self, path):
+        """Retourne ``{"digest", "width", "height"}`` mémorisé pour un fichier inchangé, sinon None."""
+        entry = self._path("sources", self._file_id(path), ".json")
+        try:
+            with open(entry, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            self._record("sources", False)
+            return None
+        self._touch(entry)
+        self._record("sources", True)
+        return info
+
+    def remember_source(self, path, src):
+        """Calcule et mémorise l'empreinte des pixels décodés ``src`` du fichier ``path``."""
+        info = {"digest": pixel_digest(src), "width": int(src.shape[1]), "height": int(src.shape[0])}
+        data = json.dumps(info).encode("utf-8")
+        self._write_atomic(self._path("sources", self._file_id(path), ".json"), lambda f: f.write(data))
+        return info
+
+    # --- Couche grid --------------------------------------------------------
+
+    def get_grid(self, key):
+        """Retourne le ``ColorGrid`` en cache pour ``key``, ou None."""
+        path = self._path("grid", key, ".npz")
+        try:
+            with np.load(path) as data:
+                variances = data["variances"] if "variances" in data.files else None
+                variants = data["variants"] if "variants" in data.files else None
+                grid = ColorGrid(
+                    data["rows"], data["cols"], data["lefts"], data["tops"], data["widths"],
+                    data["heights"], data["colors"], variances, regular=bool(data["regular"]),
+                    variants=variants,
+                )
+        except (OSError, ValueError, KeyError):
+            self._record("grid", False)
+            return None
+        self._touch(path)
+        self._record("grid", True)
+        return grid
+
+    def put_grid(self, key, grid):
+        arrays = {
+            "rows": grid.rows,
+            "cols": grid.cols,
+            "lefts": grid.lefts,
+            "tops": grid.tops,
+            "widths": grid.widths,
+            "heights": grid.heights,
+            "colors": grid.colors,
+            "regular": np.array(grid.regular),
+        }
+        if grid.variances is not None:
+            arrays["variances"] = grid.variances
+        if grid.variants is not None:
+            arrays["variants"] = grid.variants
+        self._write_atomic(self._path("grid", key, ".npz"), lambda f: np.savez(f, **arrays))
+
+    # --- Couche render ------------------------------------------------------
+
+    def get_render(self, key, output_path=None):
+        """Retourne les métadonnées du rendu en cache (et le copie vers ``output_path``), ou None."""
+        png = self._path("render", key, ".png")
+        meta_path = self._path("render", key, ".json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if output_path is not None:
+                shutil.copyfile(png, output_path)
+            elif not os.path.exists(png):
+                raise FileNotFoundError(png)
+        except (OSError, ValueError):
+            self._record("render", False)
+            return None
+        self._touch(png)
+        self._touch(meta_path)
+        self._record("render", True)
+        return meta
+
+    def put_render(self, key, png_path, meta):
+        """Copie le PNG ``png_path`` dans le cache avec ses métadonnées (dictionnaire JSON)."""
+        def copy(f):
+            with open(png_path, "rb") as src:
+                shutil.copyfileobj(src, f)
+        self._write_atomic(self._path("render", key, ".png"), copy)
+        # Les métadonnées sont écrites en dernier : elles valident l'entrée
+        data = json.dumps(meta).encode("utf-8")
+        self._write_atomic(self._path("render", key, ".json"), lambda f: f.write(data))
+
+    # --- Maintenance --------------------------------------------------------
+
+    def _entries(self):
+        for layer in _LAYERS:
+            root = os.path.join(self.directory, layer)
+            for folder, _, files in os.walk(root):
+                for name in files:
+                    if name.startswith(".tmp-"):
+                        continue
+                    path = os.path.join(folder, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def size(self):
+        """Taille totale (octets) des entrées présentes sur le disque."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Supprime les entrées les moins récemment utilisées jusqu'à repasser sous ``max_bytes``."""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self):
+        """Vide le cache."""
+        for path, _, _ in list(self._entries()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": dict(self.misses), "evictions": self.evictions}
+
+
+__all__ = ["ResultCache", "pixel_digest", "cache_key", "DEFAULT_MAX_BYTES"]
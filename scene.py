@@ -0,0 +1,230 @@
+"""Fichiers de scène indépendants de la résolution (``.npz``).
+
+Une scène contient la configuration de la forme (``Shape.to_dict``) et,
+pour chaque cellule, sa boîte normalisée entre 0 et 1 (fraction de la
+largeur et de la hauteur de l'image analysée), sa ligne, sa colonne, sa
+variante de pavage et sa couleur, dans un seul tableau structuré compact
+(28 octets par cellule). L'analyse est faite une fois, sur une image de
+n'importe quelle taille ; ``render_scene`` rend ensuite la mosaïque à
+n'importe quelle taille de sortie (vignette, web, impression) sans relire
+l'image d'origine.
+
+Le fichier est un ``.npz`` non compressé : ``load_scene(path, mmap=True)``
+projette le tableau des cellules en mémoire (``numpy.memmap``) au lieu de
+le lire, pour les très grandes mosaïques.
+
+    python3 scene.py resultat/photo_circle_5000.npz impression.png --width 7200
+"""
+
+import argparse
+import json
+import struct
+import sys
+import zipfile
+
+import numpy as np
+
+from grid import ColorGrid, as_color_grid
+from instrumentation import span
+from render import BACKENDS, BLENDS, PAINT_ORDERS, paint_image, render_image, save_image
+from shapes import create_shape
+
+SCENE_VERSION = 1
+
+CELL_DTYPE = np.dtype([
+    ("x0", "<f4"),
+    ("y0", "<f4"),
+    ("x1", "<f4"),
+    ("y1", "<f4"),
+    ("row", "<i4"),
+    ("col", "<i4"),
+    ("variant", "i1"),
+    ("color", "u1", (3,)),
+])
+
+# En-tête local d'un membre zip (taille fixe avant le nom et le champ extra)
+_ZIP_LOCAL_HEADER = 30
+
+
+def grid_to_scene(rects, width, height, shape="rectangle", mode="RGB"):
+    """Construit une scène à partir d'une grille analysée sur une image ``width`` × ``height``.
+
+    ``shape`` est un type de forme ou une instance de ``Shape`` (les formes
+    paramétrées des pavages sont conservées). Retourne un dictionnaire
+    ``{"shape", "width", "height", "mode", "regular", "tiled", "cells"}``.
+    """
+    if mode not in ("RGB", "L"):
+        raise ValueError(f"Mode de rendu inconnu: {mode}")
+    grid = as_color_grid(rects)
+    cells = np.empty(len(grid), dtype=CELL_DTYPE)
+    cells["x0"] = grid.lefts / float(width)
+    cells["y0"] = grid.tops / float(height)
+    cells["x1"] = (grid.lefts + grid.widths) / float(width)
+    cells["y1"] = (grid.tops + grid.heights) / float(height)
+    cells["row"] = grid.rows
+    cells["col"] = grid.cols
+    cells["variant"] = 0 if grid.variants is None else grid.variants
+    cells["color"] = grid.colors
+    return {
+        "shape": create_shape(shape).to_dict(),
+        "width": int(width),
+        "height": int(height),
+        "mode": mode,
+        "regular": bool(grid.regular),
+        "tiled": grid.variants is not None,
+        "cells": cells,
+    }
+
+
+def save_scene(scene, path):
+    """Enregistre une scène dans un ``.npz`` non compressé (projetable en mémoire)."""
+    meta = {key: scene[key] for key in ("shape", "width", "height", "mode", "regular", "tiled")}
+    meta["version"] = SCENE_VERSION
+    with span("encode_scene", cells=len(scene["cells"])):
+        np.savez(path, meta=np.array(json.dumps(meta)), cells=scene["cells"])
+
+
+def _mmap_member(path, name):
+    """Projette en mémoire le tableau ``name`` d'un ``.npz`` non compressé."""
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"Scène compressée, projection en mémoire impossible: {path}")
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        header = f.read(_ZIP_LOCAL_HEADER)
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        f.seek(info.header_offset + _ZIP_LOCAL_HEADER + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran else "C")
+
+
+def load_scene(path, mmap=False):
+    """Charge une scène enregistrée par ``save_scene``.
+
+    Avec ``mmap``, les cellules sont projetées en mémoire plutôt que lues :
+    seules les pages touchées par le rendu sont chargées.
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        if meta.get("version") != SCENE_VERSION:
+            raise ValueError(f"Version de scène non supportée: {meta.get('version')}")
+        cells = _mmap_member(path, "cells") if mmap else data["cells"]
+    if cells.dtype != CELL_DTYPE:
+        raise ValueError(f"Format de cellules inattendu: {cells.dtype}")
+    scene = {key: meta[key] for key in ("shape", "width", "height", "mode", "regular", "tiled")}
+    scene["cells"] = cells
+    return scene
+
+
+def scene_size(scene, width=None, height=None):
+    """Taille de rendu : celle de l'analyse par défaut, proportions conservées si une seule dimension est donnée."""
+    if width is None and height is None:
+        return scene["width"], scene["height"]
+    if height is None:
+        height = max(1, int(round(width * scene["height"] / float(scene["width"]))))
+    elif width is None:
+        width = max(1, int(round(height * scene["width"] / float(scene["height"]))))
+    return int(width), int(height)
+
+
+def scene_shape(scene):
+    """Instance de ``Shape`` décrite par la scène."""
+    cfg = dict(scene["shape"])
+    return create_shape(cfg["type"]).from_dict(cfg)
+
+
+def scene_grid(scene, width, height):
+    """``ColorGrid`` de la scène à la taille ``width`` × ``height``.
+
+    Les bords normalisés sont arrondis au pixel le plus proche (comme
+    ``preview.scale_grid``) : des cellules adjacentes restent adjacentes, et
+    à la taille d'analyse la grille d'origine est retrouvée exactement.
+    """
+    cells = scene["cells"]
+    lefts = np.rint(cells["x0"].astype(np.float64) * width).astype(np.int64)
+    tops = np.rint(cells["y0"].astype(np.float64) * height).astype(np.int64)
+    rights = np.rint(cells["x1"].astype(np.float64) * width).astype(np.int64)
+    bottoms = np.rint(cells["y1"].astype(np.float64) * height).astype(np.int64)
+    return ColorGrid(
+        np.asarray(cells["row"], dtype=np.int64),
+        np.asarray(cells["col"], dtype=np.int64),
+        lefts,
+        tops,
+        rights - lefts,
+        bottoms - tops,
+        np.asarray(cells["color"]),
+        regular=scene["regular"],
+        variants=np.asarray(cells["variant"]) if scene["tiled"] else None,
+    )
+
+
+def render_scene(scene, width=None, height=None, backend="pil", blend="average", paint_order="row-major",
+                 paint_alpha=None, workers=None):
+    """Rend une scène (dictionnaire ou chemin ``.npz``) à la taille demandée.
+
+    ``width`` / ``height`` suivent ``scene_size`` ; les formes sont
+    redimensionnées avec leurs cellules. ``blend='paint'`` utilise
+    ``render.paint_image`` (l'ordre 'variance' n'est pas disponible, les
+    scènes ne stockant pas les variances), sinon ``render.render_image``.
+    """
+    if isinstance(scene, str):
+        scene = load_scene(scene, mmap=True)
+    if blend not in BLENDS:
+        raise ValueError(f"Mode de composition inconnu: {blend}")
+    width, height = scene_size(scene, width, height)
+    grid = scene_grid(scene, width, height)
+    shape = scene_shape(scene)
+    if blend == "paint":
+        return paint_image(grid, width, height, shape=shape, order=paint_order, alpha=paint_alpha,
+                           mode=scene["mode"])
+    return render_image(grid, width, height, shape=shape, workers=workers, mode=scene["mode"], backend=backend)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rendu d'une scène AlgoPaint (.npz) à n'importe quelle taille.")
+    parser.add_argument("scene", help="Fichier de scène (.npz)")
+    parser.add_argument("output", help="Image de sortie (.png)")
+    parser.add_argument("--width", type=int, default=None, help="Largeur de sortie (défaut : taille d'analyse)")
+    parser.add_argument("--height", type=int, default=None,
+                        help="Hauteur de sortie (défaut : proportions de la scène)")
+    parser.add_argument("--backend", choices=BACKENDS, default="pil", help="Rastérisation (voir render_image)")
+    parser.add_argument("--blend", choices=BLENDS, default="average", help="Composition (voir paint_image)")
+    parser.add_argument("--paint-order", choices=[o for o in PAINT_ORDERS if o != "variance"], default="row-major",
+                        help="Peinture directe : ordre des formes")
+    parser.add_argument("--paint-alpha", type=float, default=None, help="Peinture directe : opacité (0-1)")
+    parser.add_argument("--render-threads", type=int, default=None, help="Threads de rendu par bandes")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scene = load_scene(args.scene, mmap=True)
+    img = render_scene(scene, args.width, args.height, backend=args.backend, blend=args.blend,
+                       paint_order=args.paint_order, paint_alpha=args.paint_alpha, workers=args.render_threads)
+    save_image(img, args.output)
+    print(f"{len(scene['cells'])} formes rendues en {img.width}x{img.height}")
+    print("Image enregistrée :", args.output)
+    return 0
+
+
+__all__ = [
+    "CELL_DTYPE",
+    "SCENE_VERSION",
+    "grid_to_scene",
+    "save_scene",
+    "load_scene",
+    "scene_size",
+    "scene_shape",
+    "scene_grid",
+    "render_scene",
+]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
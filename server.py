@@ -0,0 +1,407 @@
+"""Service de rendu local persistant (HTTP sur localhost ou socket Unix).
+
+Le processus garde en mémoire les images décodées et leurs tables de
+sommes cumulées (cache LRU), ainsi que le cache de gabarits de masques :
+une requête ne paie plus que l'analyse de la grille et le rendu.
+
+    python3 server.py --images images --port 8765
+    curl "http://127.0.0.1:8765/render?image=violet.jpeg&shape=circle&count=100" -o sortie.png
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/render?shape=star&count=256" -o sortie.png
+    curl "http://127.0.0.1:8765/metrics"
+
+Points d'entrée :
+
+- ``GET /render`` (``image``, ``shape``, ``count``, ``grayscale``, ``engine``, ``format`` png|svg) ;
+- ``POST /render`` : même chose avec l'image envoyée dans le corps de la requête ;
+- ``GET /images``, ``GET /metrics``, ``GET /health``.
+
+Les rendus tournent sur un pool de threads ; au-delà de ``workers +
+queue_size`` requêtes en cours, le serveur répond 503 (``Retry-After``).
+"""
+
+import argparse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+try:
+    from PIL import Image
+except Exception as exc:
+    raise RuntimeError(
+        "Pillow (PIL) n'est pas installé. Installez-le avec 'pip install Pillow'."
+    ) from exc
+
+import numpy as np
+
+from batch import IMAGE_EXTENSIONS, collect_images, parse_count
+from image_processor import apply_grayscale, compute_integral_images, compute_mse, image_to_color_grid
+from instrumentation import span
+from mask_cache import default_mask_cache
+from quadtree import image_to_quadtree_grid
+from render import render_image
+from svg_export import grid_to_svg
+
+SHAPE_TYPES = ["rectangle", "triangle", "circle", "diamond", "star"]
+ENGINES = ["grid", "quadtree"]
+
+
+class ServiceError(Exception):
+    """Erreur renvoyée au client avec un code HTTP."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SourceStore:
+    """Cache LRU (entrées et octets) des images décodées et de leurs tables de sommes cumulées."""
+
+    def __init__(self, max_entries=16, max_bytes=1024 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(entry):
+        return entry["src"].nbytes + sum(t.nbytes for t in entry["integral"])
+
+    def get(self, key, load):
+        """Retourne l'entrée ``{"src", "integral"}`` de ``key``, chargée par ``load()`` si absente."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Décodage hors verrou : deux requêtes simultanées peuvent décoder la même image
+        src = load()
+        # Les tables servent aussi au quadtree : la table des carrés est construite d'emblée
+        entry = {"src": src, "integral": compute_integral_images(src, with_variance=True)}
+        size = self._size(entry)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= self._size(old)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+class RenderService:
+    """Exécute les requêtes de rendu sur un pool borné et collecte les métriques."""
+
+    def __init__(self, image_dir="images", workers=4, queue_size=32, cache_entries=16, cache_mb=1024):
+        self.image_dir = image_dir
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sources = SourceStore(cache_entries, cache_mb * 1024 * 1024)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._started = time.time()
+        self._latencies = deque(maxlen=1024)
+        self._completions = deque(maxlen=1024)
+        self.counters = {"requests": 0, "completed": 0, "rejected": 0, "errors": 0}
+
+    # --- Sources ------------------------------------------------------------
+
+    def list_images(self):
+        if not os.path.isdir(self.image_dir):
+            return []
+        return sorted(os.path.basename(p) for p in collect_images(self.image_dir))
+
+    def _load_file(self, image_id):
+        # Seuls les fichiers images du dossier servi sont accessibles
+        name = os.path.basename(image_id)
+        path = os.path.join(self.image_dir, name)
+        if name != image_id or name.lower().rsplit(".", 1)[-1] not in IMAGE_EXTENSIONS or not os.path.isfile(path):
+            raise ServiceError(404, f"Image inconnue: {image_id}")
+        with span("decode"):
+            with Image.open(path) as im:
+                return np.array(im.convert("RGB"), dtype=np.uint8)
+
+    @staticmethod
+    def _decode_upload(data):
+        try:
+            with span("decode"):
+                with Image.open(io.BytesIO(data)) as im:
+                    return np.array(im.convert("RGB"), dtype=np.uint8)
+        except Exception as exc:
+            raise ServiceError(400, f"Image envoyée illisible: {exc}") from exc
+
+    def source(self, image_id=None, upload=None, grayscale=False):
+        """Retourne ``(identifiant, entrée)`` de l'image demandée (fichier du dossier ou envoi)."""
+        if upload is not None:
+            image_id = "upload:" + hashlib.blake2b(upload, digest_size=16).hexdigest()
+            load = lambda: self._decode_upload(upload)
+        elif image_id:
+            if image_id.startswith("upload:"):
+                def load():
+                    # Image envoyée auparavant mais évincée du cache
+                    raise ServiceError(404, "Envoi expiré, renvoyez l'image")
+            else:
+                load = lambda: self._load_file(image_id)
+        else:
+            raise ServiceError(400, "Paramètre 'image' ou corps de requête requis")
+
+        def load_filtered():
+            src = load()
+            return apply_grayscale(src, single_channel=True) if grayscale else src
+
+        return image_id, self.sources.get((image_id, grayscale), load_filtered)
+
+    # --- Rendu --------------------------------------------------------------
+
+    def _render(self, params, upload):
+        start = time.perf_counter()
+        image_id, entry = self.source(params.get("image"), upload, params["grayscale"])
+        src, integral = entry["src"], entry["integral"]
+        h, w = src.shape[:2]
+        count = params["count"]
+        if params["engine"] == "quadtree":
+            grid = image_to_quadtree_grid(None, max_shapes=256 if count is None else count,
+                                          src_img=src, integral=integral)
+        elif count is not None:
+            grid = image_to_color_grid(None, max_rectangles=count, src_img=src, integral=integral)
+        else:
+            grid = image_to_color_grid(None, grid_cols=16, grid_rows=16, src_img=src, integral=integral)
+
+        headers = {"X-Image-Id": image_id, "X-Shapes": str(len(grid))}
+        if params["format"] == "svg":
+            body = grid_to_svg(grid, w, h, params["shape"]).encode("utf-8")
+            content_type = "image/svg+xml"
+        else:
+            img = render_image(grid, w, h, shape=params["shape"], mask_cache=default_mask_cache,
+                               mode="L" if src.ndim == 2 else "RGB")
+            headers["X-MSE"] = f"{compute_mse(src, img):.4f}"
+            with span("encode"):
+                buffer = io.BytesIO()
+                img.save(buffer, format="PNG", compress_level=1)
+            body = buffer.getvalue()
+            content_type = "image/png"
+        headers["X-Render-Ms"] = f"{(time.perf_counter() - start) * 1000:.1f}"
+        return content_type, body, headers
+
+    def submit(self, params, upload=None):
+        """Exécute un rendu ; lève ``ServiceError(503)`` si la file est pleine."""
+        with self._lock:
+            self.counters["requests"] += 1
+            if self._pending >= self.workers + self.queue_size:
+                self.counters["rejected"] += 1
+                raise ServiceError(503, "File de rendu pleine, réessayez plus tard")
+            self._pending += 1
+        start = time.perf_counter()
+        try:
+            result = self._executor.submit(self._render, params, upload).result()
+        except Exception:
+            with self._lock:
+                self.counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+        end = time.perf_counter()
+        with self._lock:
+            self.counters["completed"] += 1
+            self._latencies.append(end - start)
+            self._completions.append(end)
+        return result
+
+    def metrics(self):
+        """Compteurs, profondeur de file, latences (p50/p95/p99) et débit."""
+        now = time.perf_counter()
+        with self._lock:
+            latencies = sorted(self._latencies)
+            recent = [t for t in self._completions if now - t <= 60.0]
+            data = {
+                "uptime_s": time.time() - self._started,
+                "counters": dict(self.counters),
+                "in_flight": self._pending,
+                "queued": max(0, self._pending - self.workers),
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+            }
+        if latencies:
+            pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+            data["latency_ms"] = {
+                "p50": pick(0.50) * 1000,
+                "p95": pick(0.95) * 1000,
+                "p99": pick(0.99) * 1000,
+                "max": latencies[-1] * 1000,
+            }
+        data["throughput_rps"] = {
+            "last_60s": len(recent) / 60.0,
+            "overall": data["counters"]["completed"] / max(data["uptime_s"], 1e-9),
+        }
+        data["source_cache"] = self.sources.stats()
+        data["mask_cache"] = default_mask_cache.stats()
+        return data
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def parse_render_params(query):
+    """Valide les paramètres de ``/render`` (dictionnaire ``parse_qs``)."""
+    get = lambda name, default=None: query.get(name, [default])[0]
+    shape = get("shape", "rectangle")
+    if shape not in SHAPE_TYPES:
+        raise ServiceError(400, f"Forme inconnue: {shape}")
+    engine = get("engine", "grid")
+    if engine not in ENGINES:
+        raise ServiceError(400, f"Moteur inconnu: {engine}")
+    fmt = get("format", "png")
+    if fmt not in ("png", "svg"):
+        raise ServiceError(400, f"Format inconnu: {fmt}")
+    try:
+        count = parse_count(get("count", "auto"))
+    except ValueError:
+        raise ServiceError(400, "Paramètre 'count' invalide")
+    return {
+        "image": get("image"),
+        "shape": shape,
+        "count": count,
+        "grayscale": get("grayscale", "0").lower() in ("1", "true", "yes", "y"),
+        "engine": engine,
+        "format": fmt,
+    }
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """Traduit les requêtes HTTP en appels au ``RenderService`` du serveur."""
+
+    server_version = "AlgoPaint/1.0"
+    max_upload_bytes = 64 * 1024 * 1024
+
+    def address_string(self):
+        # Les sockets Unix n'ont pas d'adresse client
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if not getattr(self.server, "quiet", False):
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data, headers=None):
+        self._send(status, json.dumps(data).encode("utf-8"), headers=headers)
+
+    def _handle(self, upload=None):
+        url = urlparse(self.path)
+        service = self.server.service
+        try:
+            if url.path == "/render":
+                params = parse_render_params(parse_qs(url.query))
+                content_type, body, headers = service.submit(params, upload)
+                self._send(200, body, content_type, headers)
+            elif upload is not None:
+                raise ServiceError(404, f"Chemin inconnu: {url.path}")
+            elif url.path == "/metrics":
+                self._send_json(200, service.metrics())
+            elif url.path == "/images":
+                self._send_json(200, {"images": service.list_images()})
+            elif url.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            else:
+                raise ServiceError(404, f"Chemin inconnu: {url.path}")
+        except ServiceError as exc:
+            headers = {"Retry-After": "1"} if exc.status == 503 else None
+            self._send_json(exc.status, {"error": str(exc)}, headers)
+        except Exception as exc:
+            self._send_json(500, {"error": f"{type(exc).__name__}: {exc}"})
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > self.max_upload_bytes:
+            self._send_json(413 if length > 0 else 400, {"error": "Corps de requête vide ou trop volumineux"})
+            return
+        self._handle(self.rfile.read(length))
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serveur HTTP multi-threads sur socket Unix."""
+
+    daemon_threads = True
+
+
+def create_server(service, host="127.0.0.1", port=8765, unix_socket=None, quiet=False):
+    """Crée le serveur HTTP (TCP sur ``host:port`` ou socket Unix) lié à ``service``."""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, RenderHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RenderHandler)
+        server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Service de rendu AlgoPaint (processus persistant).")
+    parser.add_argument("--images", default="images", help="Dossier des images accessibles par identifiant")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None, help="Écouter sur ce socket Unix au lieu de TCP")
+    parser.add_argument("--workers", "-w", type=int, default=4, help="Rendus exécutés en parallèle")
+    parser.add_argument("--queue-size", type=int, default=32,
+                        help="Requêtes en attente acceptées avant de répondre 503")
+    parser.add_argument("--cache-entries", type=int, default=16, help="Images décodées gardées en mémoire")
+    parser.add_argument("--cache-mb", type=int, default=1024, help="Mémoire maximale des images gardées (Mo)")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Ne pas journaliser chaque requête")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    service = RenderService(args.images, args.workers, args.queue_size, args.cache_entries, args.cache_mb)
+    server = create_server(service, args.host, args.port, args.unix_socket, args.quiet)
+    where = args.unix_socket or f"http://{args.host}:{args.port}"
+    print(f"Service de rendu à l'écoute : {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nArrêt du service.")
+    finally:
+        server.server_close()
+        service.close()
+        if args.unix_socket is not None and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+    return 0
+
+
+__all__ = ["RenderService", "SourceStore", "ServiceError", "create_server", "parse_render_params"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
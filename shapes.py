@@ -1,13 +1,138 @@
 from abc import ABC, abstractmethod
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List
 from PIL import Image, ImageDraw
 import numpy as np
+import math
+
+from instrumentation import count
+
+
+# Marge (en pixels) ajoutée autour de la boîte englobante d'une forme pour
+# que l'arrondi de PIL ne coupe jamais le bord du masque local.
+_BBOX_MARGIN = 2
+
+# Centre fictif utilisé pour mesurer l'étendue d'une forme autour de son centre
+_PROBE_CENTER = 1 << 20
+
+
+def _primitive_bbox(kind: str, coords: List[float]) -> Tuple[float, float, float, float]:
+    """Retourne la boîte englobante (gauche, haut, droite, bas) d'une primitive."""
+    if kind == "polygon":
+        xs = [p[0] for p in coords]
+        ys = [p[1] for p in coords]
+        return min(xs), min(ys), max(xs), max(ys)
+    return coords[0], coords[1], coords[2], coords[3]
+
+
+def _draw_primitive(draw: ImageDraw.ImageDraw, kind: str, coords: List[Any], dx: float, dy: float,
+                    fill: Any = 255) -> None:
+    """Dessine une primitive décalée de (-dx, -dy) dans un masque local (ou une image avec ``fill``)."""
+    if kind == "polygon":
+        draw.polygon([(x - dx, y - dy) for x, y in coords], fill=fill)
+    elif kind == "ellipse":
+        draw.ellipse([coords[0] - dx, coords[1] - dy, coords[2] - dx, coords[3] - dy], fill=fill)
+    elif kind == "rectangle":
+        draw.rectangle([coords[0] - dx, coords[1] - dy, coords[2] - dx, coords[3] - dy], fill=fill)
+    else:
+        raise ValueError(f"Primitive inconnue: {kind}")
 
 
 class Shape(ABC):
     """Classe abstraite pour une forme dessinable sur une image."""
 
     @abstractmethod
+    def geometry(
+        self,
+        width: int,
+        height: int,
+        center_x: float,
+        center_y: float,
+        cell_w: float,
+        cell_h: float,
+        row: int = 0,
+    ) -> Tuple[str, List[Any]]:
+        """Retourne la primitive de la forme : ("polygon", points), ("ellipse", bbox) ou ("rectangle", bbox)."""
+        pass
+
+    def create_local_mask(
+        self,
+        width: int,
+        height: int,
+        center_x: float,
+        center_y: float,
+        cell_w: float,
+        cell_h: float,
+        row: int = 0,
+    ) -> Tuple[np.ndarray, int, int]:
+        """Crée un masque (0-1) limité à la boîte englobante de la forme.
+
+        Retourne ``(mask, left, top)`` : ``mask`` couvre la fenêtre
+        ``[top:top + mask.shape[0], left:left + mask.shape[1]]`` du canvas.
+        Le masque peut être vide (taille 0) si la forme sort du canvas.
+        """
+        ix = math.floor(center_x)
+        iy = math.floor(center_y)
+        return self.frame_mask(width, height, ix, iy, center_x - ix, center_y - iy, cell_w, cell_h, row)
+
+    def mask_frame(self, cell_w: float, cell_h: float, row: int, phase_x: float, phase_y: float) -> Tuple[int, int]:
+        """Origine locale ``(kx, ky)`` (entière) du repère de rastérisation de la forme.
+
+        La géométrie est calculée au centre ``(kx + phase_x, ky + phase_y)``,
+        où toutes ses coordonnées sont positives, puis translatée d'un nombre
+        entier de pixels : le masque ne dépend que de la taille de cellule,
+        de la ligne et de la phase sous-pixel, pas de la position absolue
+        (l'arrondi flottant de ``centre + r·cos`` varie avec sa grandeur).
+        """
+        kind, coords = self.geometry(
+            math.inf, math.inf, _PROBE_CENTER + phase_x, _PROBE_CENTER + phase_y, cell_w, cell_h, row
+        )
+        bx0, by0, _, _ = _primitive_bbox(kind, coords)
+        return (int(math.ceil(_PROBE_CENTER - bx0)) + _BBOX_MARGIN + 1,
+                int(math.ceil(_PROBE_CENTER - by0)) + _BBOX_MARGIN + 1)
+
+    def frame_mask(
+        self,
+        width: int,
+        height: int,
+        ix: int,
+        iy: int,
+        phase_x: float,
+        phase_y: float,
+        cell_w: float,
+        cell_h: float,
+        row: int = 0,
+    ) -> Tuple[np.ndarray, int, int]:
+        """``create_local_mask`` pour le centre ``(ix + phase_x, iy + phase_y)`` (voir ``mask_frame``).
+
+        Près des bords gauche et haut (origine du repère hors du canvas), la
+        géométrie est calculée directement en coordonnées du canvas.
+        """
+        kx, ky = self.mask_frame(cell_w, cell_h, row, phase_x, phase_y)
+        ox = ix - kx
+        oy = iy - ky
+        if ox >= 0 and oy >= 0:
+            kind, coords = self.geometry(width - ox, height - oy, kx + phase_x, ky + phase_y, cell_w, cell_h, row)
+        else:
+            ox = oy = 0
+            kind, coords = self.geometry(width, height, ix + phase_x, iy + phase_y, cell_w, cell_h, row)
+        bx0, by0, bx1, by1 = _primitive_bbox(kind, coords)
+        if bx1 < bx0 or by1 < by0:
+            return np.zeros((0, 0), dtype=np.float32), 0, 0
+
+        left = min(width, max(0, ox + int(math.floor(bx0)) - _BBOX_MARGIN))
+        top = min(height, max(0, oy + int(math.floor(by0)) - _BBOX_MARGIN))
+        right = max(left, min(width, ox + int(math.ceil(bx1)) + _BBOX_MARGIN))
+        bottom = max(top, min(height, oy + int(math.ceil(by1)) + _BBOX_MARGIN))
+        if right <= left or bottom <= top:
+            return np.zeros((0, 0), dtype=np.float32), left, top
+
+        count("masks_rasterized")
+        shape_img = Image.new("L", (right - left, bottom - top), 0)
+        shape_draw = ImageDraw.Draw(shape_img)
+        _draw_primitive(shape_draw, kind, coords, left - ox, top - oy)
+        mask = np.array(shape_img, dtype=np.float32) / 255.0
+        return mask, left, top
+
     def create_mask(
         self,
         width: int,
@@ -18,8 +143,18 @@ class Shape(ABC):
         cell_h: float,
         row: int = 0,
     ) -> np.ndarray:
-        """Crée un masque numpy (0-1) pour cette forme."""
-        pass
+        """Crée un masque numpy (0-1) de la taille du canvas pour cette forme."""
+        local, left, top = self.create_local_mask(width, height, center_x, center_y, cell_w, cell_h, row)
+        mask = np.zeros((height, width), dtype=np.float32)
+        mask[top:top + local.shape[0], left:left + local.shape[1]] = local
+        return mask
+
+    def template_row(self, row: int) -> int:
+        """Ligne représentative utilisée comme clé du cache de gabarits.
+
+        Les formes dont le masque ne dépend pas de la ligne retournent 0.
+        """
+        return 0
 
     @abstractmethod
     def to_dict(self) -> Dict[str, Any]:
@@ -37,7 +172,7 @@ class RectangleShape(Shape):
     def __init__(self, overlap: float = 1.0):
         self.overlap = overlap
 
-    def create_mask(
+    def geometry(
         self,
         width: int,
         height: int,
@@ -46,11 +181,8 @@ class RectangleShape(Shape):
         cell_w: float,
         cell_h: float,
         row: int = 0,
-    ) -> np.ndarray:
-        """Crée un masque rectangulaire."""
-        shape_img = Image.new("L", (width, height), 0)
-        shape_draw = ImageDraw.Draw(shape_img)
-
+    ) -> Tuple[str, List[Any]]:
+        """Calcule le rectangle (élargi par l'overlap) de la cellule."""
         # Calcul des dimensions avec overlap
         expand_w = cell_w * self.overlap
         expand_h = cell_h * self.overlap
@@ -63,11 +195,7 @@ class RectangleShape(Shape):
         shape_right = min(width, left + cell_w / 2 + expand_w / 2)
         shape_bottom = min(height, top + cell_h / 2 + expand_h / 2)
 
-        shape_draw.rectangle(
-            [shape_left, shape_top, shape_right, shape_bottom], fill=255
-        )
-        mask = np.array(shape_img, dtype=np.float32) / 255.0
-        return mask
+        return "rectangle", [shape_left, shape_top, shape_right, shape_bottom]
 
     def to_dict(self) -> Dict[str, Any]:
         return {"type": "rectangle", "overlap": self.overlap}
@@ -84,7 +212,7 @@ class TriangleShape(Shape):
         self.size_multiplier = size_multiplier
         self.first_row_multiplier = first_row_multiplier
 
-    def create_mask(
+    def geometry(
         self,
         width: int,
         height: int,
@@ -93,11 +221,8 @@ class TriangleShape(Shape):
         cell_w: float,
         cell_h: float,
         row: int = 0,
-    ) -> np.ndarray:
-        """Crée un masque triangulaire."""
-        shape_img = Image.new("L", (width, height), 0)
-        shape_draw = ImageDraw.Draw(shape_img)
-
+    ) -> Tuple[str, List[Any]]:
+        """Calcule les trois sommets du triangle."""
         # Calcul de la taille du triangle
         triangle_size = max(cell_w, cell_h) * self.size_multiplier
         if row == 0:
@@ -111,9 +236,11 @@ class TriangleShape(Shape):
         x3 = center_x + triangle_size / 2
         y3 = center_y + triangle_size / 2
 
-        shape_draw.polygon([(x1, y1), (x2, y2), (x3, y3)], fill=255)
-        mask = np.array(shape_img, dtype=np.float32) / 255.0
-        return mask
+        return "polygon", [(x1, y1), (x2, y2), (x3, y3)]
+
+    def template_row(self, row: int) -> int:
+        """La première ligne utilise un triangle plus grand."""
+        return 0 if row == 0 else 1
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -130,13 +257,52 @@ class TriangleShape(Shape):
         )
 
 
+class StripTriangleShape(Shape):
+    """Triangle de pavage : remplit exactement sa cellule, pointe en haut ou en bas.
+
+    Utilisé par ``tessellation`` : des triangles alternés, juxtaposés en
+    bandes, couvrent l'image sans recouvrement. ``row`` est la variante de la
+    tuile (0 = pointe en haut, 1 = pointe en bas).
+    """
+
+    def geometry(
+        self,
+        width: int,
+        height: int,
+        center_x: float,
+        center_y: float,
+        cell_w: float,
+        cell_h: float,
+        row: int = 0,
+    ) -> Tuple[str, List[Any]]:
+        """Calcule les trois sommets du triangle inscrit dans la cellule."""
+        left = center_x - cell_w / 2
+        right = center_x + cell_w / 2
+        top = center_y - cell_h / 2
+        bottom = center_y + cell_h / 2
+        if row % 2 == 0:
+            return "polygon", [(center_x, top), (left, bottom), (right, bottom)]
+        return "polygon", [(left, top), (right, top), (center_x, bottom)]
+
+    def template_row(self, row: int) -> int:
+        """Le gabarit dépend de l'orientation du triangle."""
+        return row % 2
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "triangle_strip"}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "StripTriangleShape":
+        return cls()
+
+
 class CircleShape(Shape):
     """Forme circulaire."""
 
     def __init__(self, radius_multiplier: float = 1.2):
         self.radius_multiplier = radius_multiplier
 
-    def create_mask(
+    def geometry(
         self,
         width: int,
         height: int,
@@ -145,24 +311,16 @@ class CircleShape(Shape):
         cell_w: float,
         cell_h: float,
         row: int = 0,
-    ) -> np.ndarray:
-        """Crée un masque circulaire."""
-        shape_img = Image.new("L", (width, height), 0)
-        shape_draw = ImageDraw.Draw(shape_img)
-
+    ) -> Tuple[str, List[Any]]:
+        """Calcule la boîte englobante du cercle."""
         # Calcul du rayon du cercle
         radius = max(cell_w, cell_h) * self.radius_multiplier
-        shape_draw.ellipse(
-            [
-                center_x - radius,
-                center_y - radius,
-                center_x + radius,
-                center_y + radius,
-            ],
-            fill=255,
-        )
-        mask = np.array(shape_img, dtype=np.float32) / 255.0
-        return mask
+        return "ellipse", [
+            center_x - radius,
+            center_y - radius,
+            center_x + radius,
+            center_y + radius,
+        ]
 
     def to_dict(self) -> Dict[str, Any]:
         return {"type": "circle", "radius_multiplier": self.radius_multiplier}
@@ -170,14 +328,14 @@ class CircleShape(Shape):
     @classmethod
     def from_dict(cls, d: Dict[str, Any]) -> "CircleShape":
         return cls(radius_multiplier=d.get("radius_multiplier", 1.2))
-    
+
 class DiamondShape(Shape):
     """Forme losange (polygone à 4 points)."""
 
     def __init__(self, size_multiplier: float = 1.8):
         self.size_multiplier = size_multiplier
 
-    def create_mask(
+    def geometry(
         self,
         width: int,
         height: int,
@@ -186,11 +344,8 @@ class DiamondShape(Shape):
         cell_w: float,
         cell_h: float,
         row: int = 0,
-    ) -> np.ndarray:
-        """Crée un masque losange."""
-        shape_img = Image.new("L", (width, height), 0)
-        shape_draw = ImageDraw.Draw(shape_img)
-
+    ) -> Tuple[str, List[Any]]:
+        """Calcule les quatre sommets du losange."""
         # Calcul de la moitié des dimensions du losange
         # Utiliser la plus grande dimension de la cellule comme base pour la taille
         size = max(cell_w, cell_h) * self.size_multiplier
@@ -207,9 +362,7 @@ class DiamondShape(Shape):
         # Point gauche (milieu_x - moitié_w, milieu_y)
         p4 = (center_x - half_w, center_y)
 
-        shape_draw.polygon([p1, p2, p3, p4], fill=255)
-        mask = np.array(shape_img, dtype=np.float32) / 255.0
-        return mask
+        return "polygon", [p1, p2, p3, p4]
 
     def to_dict(self) -> Dict[str, Any]:
         return {"type": "diamond", "size_multiplier": self.size_multiplier}
@@ -217,7 +370,7 @@ class DiamondShape(Shape):
     @classmethod
     def from_dict(cls, d: Dict[str, Any]) -> "DiamondShape":
         return cls(size_multiplier=d.get("size_multiplier", 1.2))
-        
+
 class StarShape(Shape):
     """Forme d'étoile à cinq branches."""
 
@@ -225,7 +378,7 @@ class StarShape(Shape):
         self.size_multiplier = size_multiplier
         self.points = points
 
-    def create_mask(
+    def geometry(
         self,
         width: int,
         height: int,
@@ -234,11 +387,8 @@ class StarShape(Shape):
         cell_w: float,
         cell_h: float,
         row: int = 0,
-    ) -> np.ndarray:
-        """Crée un masque en forme d'étoile."""
-        shape_img = Image.new("L", (width, height), 0)
-        shape_draw = ImageDraw.Draw(shape_img)
-
+    ) -> Tuple[str, List[Any]]:
+        """Calcule les sommets du polygone étoilé."""
         # Le rayon extérieur de l'étoile
         outer_radius = max(cell_w, cell_h) * self.size_multiplier / 2.0
         # Le rayon intérieur (pointes intérieures de l'étoile), généralement environ 40% du rayon extérieur
@@ -246,20 +396,18 @@ class StarShape(Shape):
 
         polygon_points = []
         # Angle de départ pour que l'une des pointes soit en haut (angle 90 degrés ou pi/2)
-        start_angle = np.pi / 2.0 
-        
+        start_angle = np.pi / 2.0
+
         for i in range(self.points * 2):
             # i pair = pointes extérieures, i impair = pointes intérieures
             r = outer_radius if i % 2 == 0 else inner_radius
             angle = start_angle + i * (np.pi / self.points)
-            
+
             x = center_x + r * np.cos(angle)
             y = center_y - r * np.sin(angle) # Soustraire car l'axe Y est inversé dans les images
             polygon_points.append((x, y))
 
-        shape_draw.polygon(polygon_points, fill=255)
-        mask = np.array(shape_img, dtype=np.float32) / 255.0
-        return mask
+        return "polygon", polygon_points
 
     def to_dict(self) -> Dict[str, Any]:
         return {"type": "star", "size_multiplier": self.size_multiplier, "points": self.points}
@@ -270,7 +418,9 @@ class StarShape(Shape):
 
 
 def create_shape(shape_type: str) -> Shape:
-    """Crée une forme à partir de son type."""
+    """Crée une forme à partir de son type (une instance de ``Shape`` est retournée telle quelle)."""
+    if isinstance(shape_type, Shape):
+        return shape_type
     if shape_type == "rectangle":
         return RectangleShape()
     elif shape_type == "triangle":
@@ -281,8 +431,19 @@ def create_shape(shape_type: str) -> Shape:
         return DiamondShape()
     elif shape_type == "star":
         return StarShape()
+    elif shape_type == "triangle_strip":
+        return StripTriangleShape()
     else:
         raise ValueError(f"Type de forme inconnu: {shape_type}")
 
 
-__all__ = ["Shape", "RectangleShape", "TriangleShape", "CircleShape", "DiamondShape", "StarShape", "create_shape"]
+__all__ = [
+    "Shape",
+    "RectangleShape",
+    "TriangleShape",
+    "StripTriangleShape",
+    "CircleShape",
+    "DiamondShape",
+    "StarShape",
+    "create_shape",
+]
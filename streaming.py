@@ -0,0 +1,416 @@
+"""Rendu par bandes horizontales pour les très grandes images (hors mémoire)."""
+
+import math
+import struct
+import tempfile
+import warnings
+import zlib
+
+try:
+    from PIL import Image
+except Exception as exc:
+    raise RuntimeError(
+        "Pillow (PIL) n'est pas installé. Installez-le avec 'pip install Pillow'."
+    ) from exc
+
+import numpy as np
+
+from grid import ColorGrid
+from image_processor import _compute_grid_from_limit, _grid_edges
+from mask_cache import default_mask_cache
+from metrics import compute_error as _error_stats
+from instrumentation import span
+from render import _cell_placements, _composite_band, _count_stamps, _stamp_factory
+from shapes import _BBOX_MARGIN, _primitive_bbox, create_shape
+
+# Octets par pixel et par canal d'une bande de rendu : canvas float32 (4), sortie uint8 (1),
+# copie float32 de np.clip et sa conversion uint8 (4 + 1) dans render._composite_band, tampon
+# int32 de metrics.compute_error (4) ; plus la weight_map float32 et son np.maximum (4 + 4)
+# communs à tous les canaux
+_RENDER_BYTES_PER_CHANNEL = 14
+_RENDER_BYTES_SHARED = 8
+# Octets par pixel d'un masque de forme (float32)
+_MASK_BYTES = 4
+# Octets par pixel et par canal d'une bande d'analyse : copie int64 et sommes cumulées int64
+_ANALYSIS_BYTES_PER_CHANNEL = 16
+# Hauteur minimale d'une bande ; en dessous, les buffers passent sur disque
+MIN_STRIP_ROWS = 16
+# Modes PNG défiltrés bande par bande (8 bits par canal, non entrelacés) : octets par pixel
+_PNG_STRIP_MODES = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Lecture des chunks IDAT par morceaux de cette taille
+_PNG_READ_BYTES = 1 << 20
+
+
+class StripPNGWriter:
+    """Écrit un PNG 8 bits (RGB, ou niveaux de gris si ``channels=1``) bande par bande,
+    sans garder l'image en mémoire."""
+
+    def __init__(self, path, width, height, compress_level=6, channels=3):
+        if channels not in (1, 3):
+            raise ValueError("channels doit valoir 1 ou 3")
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows_written = 0
+        self._file = open(path, "wb")
+        self._compressor = zlib.compressobj(compress_level)
+        self._prev = np.zeros((width * channels,), dtype=np.uint8)
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        # Type de couleur PNG : 0 = niveaux de gris, 2 = RGB
+        color_type = 0 if channels == 1 else 2
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+    def write_rows(self, rows):
+        """Ajoute des lignes (tableau uint8 ``(n, width, channels)``) à l'image."""
+        row_bytes = self.width * self.channels
+        flat = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), row_bytes)
+        # Filtre PNG "Up" (type 2) : différence avec la ligne précédente modulo 256
+        prev = np.vstack([self._prev[None, :], flat[:-1]])
+        filtered = np.empty((len(flat), row_bytes + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        np.subtract(flat, prev, out=filtered[:, 1:])
+        self._prev = flat[-1].copy()
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rows_written += len(flat)
+
+    def close(self):
+        """Termine le flux compressé et ferme le fichier."""
+        if self._file.closed:
+            return
+        if self.rows_written != self.height:
+            self._file.close()
+            raise ValueError(
+                f"PNG incomplet : {self.rows_written} lignes écrites sur {self.height}"
+            )
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def _allocate(shape, dtype, on_disk, scratch_dir):
+    """Alloue un buffer en RAM ou, si ``on_disk``, dans un fichier temporaire (memmap)."""
+    if not on_disk:
+        return np.zeros(shape, dtype=dtype)
+    handle = tempfile.NamedTemporaryFile(dir=scratch_dir, prefix="algopaint_", suffix=".dat")
+    buffer = np.memmap(handle, dtype=dtype, mode="w+", shape=shape)
+    # Le fichier reste vivant tant que le memmap y fait référence
+    buffer._scratch_file = handle
+    return buffer
+
+
+def strip_rows_for_budget(width, bytes_per_pixel, budget_bytes, height):
+    """Nombre de lignes par bande pour tenir dans ``budget_bytes``."""
+    rows = budget_bytes // max(1, width * bytes_per_pixel)
+    return int(max(1, min(height, rows)))
+
+
+def _png_strip_mode(im, path):
+    """Mode d'un PNG décodable bande par bande, ou None (entrelacé, 16 bits, palette, animé...)."""
+    if im.format != "PNG" or getattr(im, "is_animated", False) or len(im.tile) != 1:
+        return None
+    tile = im.tile[0]
+    if tile[0] != "zip" or tile[3] != im.mode or im.mode not in _PNG_STRIP_MODES:
+        return None
+    with open(path, "rb") as f:
+        ihdr = f.read(29)
+    # Méthode d'entrelacement : dernier octet des données de IHDR, premier chunk du fichier
+    return im.mode if len(ihdr) == 29 and ihdr[28] == 0 else None
+
+
+def _png_idat(f):
+    """Données compressées des chunks IDAT, lues par morceaux."""
+    f.seek(len(_PNG_SIGNATURE))
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("PNG tronqué : chunk IEND manquant")
+        length, kind = struct.unpack(">I4s", header)
+        if kind == b"IEND":
+            return
+        if kind != b"IDAT":
+            f.seek(length + 4, 1)
+            continue
+        while length:
+            data = f.read(min(length, _PNG_READ_BYTES))
+            if not data:
+                raise ValueError("PNG tronqué : chunk IDAT incomplet")
+            length -= len(data)
+            yield data
+        f.seek(4, 1)
+
+
+def _png_filtered_strips(f, strip_bytes):
+    """Décompresse le flux IDAT au fil de l'eau, en blocs de ``strip_bytes`` octets au plus."""
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    for data in _png_idat(f):
+        while True:
+            out = inflater.decompress(data, strip_bytes)
+            pending += out
+            data = inflater.unconsumed_tail
+            while len(pending) >= strip_bytes:
+                yield bytes(pending[:strip_bytes])
+                del pending[:strip_bytes]
+            if not data and len(out) < strip_bytes:
+                break
+    if pending:
+        yield bytes(pending)
+
+
+def _png_strips(path, mode, width, height, strip_rows):
+    """Décode un PNG non entrelacé bande par bande : ``(haut, image PIL de la bande)``.
+
+    Chaque bande de lignes filtrées est défiltrée par le décodeur 'zip' de
+    PIL, précédée de la dernière ligne de la bande précédente (sans filtre),
+    qui sert de ligne de référence aux filtres "Up", "Average" et "Paeth".
+    """
+    row_bytes = width * _PNG_STRIP_MODES[mode] + 1
+    prev = None
+    top = 0
+    with open(path, "rb") as f:
+        for data in _png_filtered_strips(f, row_bytes * strip_rows):
+            rows = min(len(data) // row_bytes, height - top)
+            if rows <= 0:
+                break
+            data = data[:rows * row_bytes]
+            skip = 0 if prev is None else 1
+            if prev is not None:
+                data = b"\x00" + prev + data
+            img = Image.frombytes(mode, (width, rows + skip), zlib.compress(data, 0), "zip", mode)
+            prev = img.crop((0, rows + skip - 1, width, rows + skip)).tobytes()
+            yield top, img.crop((0, skip, width, rows + skip)) if skip else img
+            top += rows
+    if top != height:
+        raise ValueError(f"PNG tronqué : {top} lignes décodées sur {height}")
+
+
+def load_source_strips(path, strip_rows, grayscale=False, on_disk=False, scratch_dir=None, budget_bytes=None):
+    """Décode une image dans un tableau uint8 ``(H, W, C)``, bande par bande.
+
+    ``C`` vaut 3 (RGB), ou 1 avec ``grayscale`` (canal unique). Avec ``on_disk``, le tableau est un ``numpy.memmap`` : seules les bandes
+    en cours de lecture restent en RAM. Les PNG 8 bits non entrelacés sont
+    décompressés et défiltrés bande par bande ; les autres formats (JPEG
+    compris) sont chargés une fois par PIL dans leur format natif avant
+    d'être découpés, avec un avertissement si cette taille, lue dans
+    l'en-tête, dépasse ``budget_bytes``.
+    """
+    with Image.open(path) as im:
+        width, height = im.size
+        src = _allocate((height, width, 1 if grayscale else 3), np.uint8, on_disk, scratch_dir)
+        mode = _png_strip_mode(im, path)
+        if mode is not None:
+            strips = _png_strips(path, mode, width, height, strip_rows)
+        else:
+            decoded = width * height * len(im.getbands())
+            if budget_bytes is not None and decoded > budget_bytes:
+                warnings.warn(
+                    f"{path} : décodage complet de {decoded / 2**20:.0f} Mo au-delà du budget de "
+                    f"{budget_bytes / 2**20:.0f} Mo (seuls les PNG 8 bits non entrelacés sont décodés par bandes)",
+                    RuntimeWarning,
+                    stacklevel=2,
+                )
+            strips = ((top, im.crop((0, top, width, min(height, top + strip_rows))))
+                      for top in range(0, height, strip_rows))
+        for top, region in strips:
+            region = region.convert("L" if grayscale else "RGB")
+            src[top:top + region.height] = np.asarray(region, dtype=np.uint8).reshape(region.height, width, -1)
+    return src
+
+
+def stream_cell_colors(src, x_edges, y_edges, strip_rows):
+    """Couleurs moyennes des cellules calculées bande par bande.
+
+    Donne les mêmes couleurs que ``cell_color_stats`` sans construire les
+    tables de sommes cumulées de l'image entière.
+    """
+    height, width = src.shape[:2]
+    xs = np.minimum(x_edges, width)
+    ys = np.minimum(y_edges, height)
+    rows = len(y_edges) - 1
+    cols = len(x_edges) - 1
+    channels = src.shape[2]
+    sums = np.zeros((rows, cols, channels), dtype=np.int64)
+    # Ligne de grille de chaque ligne de pixels
+    row_of_y = np.searchsorted(ys[1:], np.arange(height), side="right")
+
+    for top in range(0, height, strip_rows):
+        bottom = min(height, top + strip_rows)
+        strip = src[top:bottom].astype(np.int64)
+        cs = np.zeros((bottom - top, width + 1, channels), dtype=np.int64)
+        np.cumsum(strip, axis=1, out=cs[:, 1:])
+        row_sums = cs[:, xs[1:]] - cs[:, xs[:-1]]
+        np.add.at(sums, row_of_y[top:bottom], row_sums)
+
+    counts = ((ys[1:, None] - ys[:-1, None]) * (xs[None, 1:] - xs[None, :-1]))[:, :, None]
+    safe = np.maximum(counts, 1)
+    means = (2 * sums + safe) // (2 * safe)
+    return np.where(counts > 0, means, 0)
+
+
+def _stamp_extents(shape_obj, width, height, placements):
+    """Boîtes ``(gauche, haut, droite, bas)`` contenant le masque de chaque forme, sans le rastériser."""
+    boxes = np.empty((len(placements), 4), dtype=np.int64)
+    for i, (center_x, center_y, cell_w, cell_h, row, _) in enumerate(placements):
+        kind, coords = shape_obj.geometry(width, height, center_x, center_y, cell_w, cell_h, row)
+        bx0, by0, bx1, by1 = _primitive_bbox(kind, coords)
+        boxes[i] = (math.floor(bx0), math.floor(by0), math.ceil(bx1) + 1, math.ceil(by1) + 1)
+    # Même marge que les masques locaux, plus un pixel pour les arrondis de la phase
+    boxes[:, :2] -= _BBOX_MARGIN + 1
+    boxes[:, 2:] += _BBOX_MARGIN + 1
+    np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+    np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+    return boxes
+
+
+def _strip_mask_bytes(boxes, strip_rows, height):
+    """Octets des masques vivants pendant la bande la plus chargée, pour des bandes de ``strip_rows`` lignes."""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) * _MASK_BYTES
+    n_strips = -(-height // strip_rows)
+    live = np.zeros(n_strips + 1, dtype=np.int64)
+    # Une forme est vivante de la première à la dernière bande qu'elle traverse
+    visible = boxes[:, 3] > boxes[:, 1]
+    np.add.at(live, boxes[visible, 1] // strip_rows, areas[visible])
+    np.add.at(live, (boxes[visible, 3] - 1) // strip_rows + 1, -areas[visible])
+    return int(np.cumsum(live).max(initial=0))
+
+
+def _strip_rows_with_masks(width, height, bytes_per_pixel, budget_bytes, boxes):
+    """Hauteur de bande la plus grande dont les buffers et les masques vivants tiennent dans le budget."""
+    high = strip_rows_for_budget(width, bytes_per_pixel, budget_bytes, height)
+    low = 1
+    while low < high:
+        rows = (low + high + 1) // 2
+        if rows * width * bytes_per_pixel + _strip_mask_bytes(boxes, rows, height) <= budget_bytes:
+            low = rows
+        else:
+            high = rows - 1
+    return low
+
+
+def render_streaming(
+    path,
+    output_path,
+    shape="rectangle",
+    grid_cols=16,
+    grid_rows=16,
+    max_rectangles=None,
+    grayscale=False,
+    memory_budget_mb=512,
+    scratch_dir=None,
+    compute_error=True,
+    mask_cache=default_mask_cache,
+):
+    """Analyse et rend une image par bandes, avec une mémoire bornée par un budget.
+
+    La source est copiée dans un ``numpy.memmap`` si elle dépasse la moitié
+    du budget ; les couleurs des cellules sont calculées bande par bande,
+    puis chaque bande est composée, normalisée et écrite directement dans le
+    PNG de sortie. Les masques des formes sont créés bande par bande, pour
+    les seules formes qui la traversent, et libérés dès que la forme est
+    entièrement rendue ; la hauteur de bande est choisie pour que ses
+    buffers et ses masques vivants tiennent dans le budget. Si le budget
+    ne permet même pas ``MIN_STRIP_ROWS`` lignes, les accumulateurs de bande
+    passent eux aussi sur disque.
+
+    Avec ``grayscale``, toute la chaîne (source, analyse, bandes, PNG de
+    sortie et MSE) travaille sur un seul canal.
+
+    Retourne un dictionnaire (nombre de formes, MSE, hauteur de bande, ...).
+    """
+    budget = int(memory_budget_mb * 1024 * 1024)
+    with Image.open(path) as im:
+        width, height = im.size
+    channels = 1 if grayscale else 3
+
+    source_on_disk = width * height * channels > budget // 2
+    analysis_rows = strip_rows_for_budget(width, _ANALYSIS_BYTES_PER_CHANNEL * channels, budget // 2, height)
+    with span("decode"):
+        src = load_source_strips(path, analysis_rows, grayscale, source_on_disk, scratch_dir, budget)
+
+    if max_rectangles is not None:
+        grid_cols, grid_rows = _compute_grid_from_limit(int(max_rectangles), width, height)
+    if grid_cols <= 0 or grid_rows <= 0:
+        raise ValueError("grid_cols et grid_rows doivent être > 0")
+    x_edges, y_edges = _grid_edges(width, height, grid_cols, grid_rows)
+    with span("analysis"):
+        means = stream_cell_colors(src, x_edges, y_edges, analysis_rows)
+    if channels == 1:
+        means = np.repeat(means, 3, axis=2)
+    grid = ColorGrid.from_edges(x_edges, y_edges, means)
+
+    # Étendue verticale des formes : les masques ne sont créés que pour les bandes qu'elles traversent
+    shape_obj = create_shape(shape)
+    placements = _cell_placements(grid, width, height, channels)
+    make_stamp = _stamp_factory(shape_obj, width, height, mask_cache)
+    boxes = _stamp_extents(shape_obj, width, height, placements)
+    tops = boxes[:, 1]
+    bottoms = boxes[:, 3]
+
+    render_budget = max(0, budget - (0 if source_on_disk else width * height * channels))
+    render_bytes = _RENDER_BYTES_PER_CHANNEL * channels + _RENDER_BYTES_SHARED
+    strip_rows = _strip_rows_with_masks(width, height, render_bytes, render_budget, boxes)
+    buffers_on_disk = strip_rows < min(MIN_STRIP_ROWS, height)
+    strip_rows = max(strip_rows, min(MIN_STRIP_ROWS, height))
+
+    canvas = _allocate((strip_rows, width, channels), np.float32, buffers_on_disk, scratch_dir)
+    weight_map = _allocate((strip_rows, width), np.float32, buffers_on_disk, scratch_dir)
+    out = _allocate((strip_rows, width, channels), np.uint8, buffers_on_disk, scratch_dir)
+
+    squared_error = 0
+    live = {}
+    with StripPNGWriter(output_path, width, height, channels=channels) as writer:
+        for top in range(0, height, strip_rows):
+            bottom = min(height, top + strip_rows)
+            n = bottom - top
+            canvas[:n] = 0
+            weight_map[:n] = 0
+            idx = np.nonzero((tops < bottom) & (bottoms > top))[0].tolist()
+            with span("rasterize", top=top):
+                new = {i: make_stamp(placements[i]) for i in idx if i not in live}
+                _count_stamps([s for s in new.values() if s[0].size])
+            live.update(new)
+            stamps = [live[i] for i in idx if live[i][0].size]
+            with span("composite", top=top):
+                _composite_band(canvas, weight_map, out, stamps, top, bottom, origin=top)
+            # Seuls les masques des formes qui continuent sous la bande sont gardés
+            live = {i: live[i] for i in idx if bottoms[i] > bottom}
+            del stamps
+            with span("encode", top=top):
+                writer.write_rows(out[:n])
+            if compute_error:
+                squared_error += _error_stats(src[top:bottom], out[:n])["sse"]
+
+    return {
+        "shapes": len(grid),
+        "mse": squared_error / float(width * height * channels) if compute_error else None,
+        "strip_rows": strip_rows,
+        "source_on_disk": bool(source_on_disk),
+        "buffers_on_disk": bool(buffers_on_disk),
+    }
+
+
+__all__ = [
+    "StripPNGWriter",
+    "load_source_strips",
+    "stream_cell_colors",
+    "render_streaming",
+    "strip_rows_for_budget",
+]
@@ -0,0 +1,167 @@
+"""Export vectoriel (SVG) des mosaïques, sans composition raster.
+
+Chaque cellule devient une seule primitive SVG (``rect``, ``ellipse`` ou
+``polygon``) calculée par ``Shape.geometry`` : le temps et la taille du
+fichier ne dépendent que du nombre de formes, et l'image peut être
+affichée à n'importe quel zoom.
+
+Différence avec ``render_image`` : les zones de chevauchement y sont la
+moyenne des formes qui les couvrent, alors qu'en SVG la dernière forme
+dessinée l'emporte (ordre du peintre). ``rasterize_svg`` redessine un
+fichier exporté avec PIL pour comparer les MSE des deux rendus.
+"""
+
+import json
+import xml.etree.ElementTree as ET
+
+try:
+    from PIL import Image, ImageDraw
+except Exception as exc:
+    raise RuntimeError(
+        "Pillow (PIL) n'est pas installé. Installez-le avec 'pip install Pillow'."
+    ) from exc
+
+from grid import as_color_grid
+from instrumentation import span, count
+from render import _cell_placements
+from shapes import _draw_primitive, create_shape
+
+_SVG_NS = "http://www.w3.org/2000/svg"
+
+# Ligne passée aux formes pour les placements libres (voir optimizer._FREE_ROW)
+_FREE_ROW = 1
+
+
+def _fmt(value):
+    """Nombre compact pour les attributs SVG (2 décimales au plus)."""
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _hex(color):
+    r, g, b = (int(round(float(c))) for c in tuple(color)[:3])
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def _primitive_element(kind, coords, fill, opacity=None):
+    """Élément SVG (texte) d'une primitive ``Shape.geometry``."""
+    extra = "" if opacity is None else f' fill-opacity="{_fmt(opacity)}"'
+    if kind == "rectangle":
+        # Bornes incluses (comme PIL) : le rectangle couvre x1 - x0 + 1 pixels
+        x0, y0, x1, y1 = coords
+        return (f'<rect x="{_fmt(x0)}" y="{_fmt(y0)}" width="{_fmt(x1 - x0 + 1)}" '
+                f'height="{_fmt(y1 - y0 + 1)}" fill="{fill}"{extra}/>')
+    if kind == "ellipse":
+        x0, y0, x1, y1 = coords
+        return (f'<ellipse cx="{_fmt((x0 + x1) / 2)}" cy="{_fmt((y0 + y1) / 2)}" '
+                f'rx="{_fmt((x1 - x0) / 2)}" ry="{_fmt((y1 - y0) / 2)}" fill="{fill}"{extra}/>')
+    if kind == "polygon":
+        points = " ".join(f"{_fmt(x)},{_fmt(y)}" for x, y in coords)
+        return f'<polygon points="{points}" fill="{fill}"{extra}/>'
+    raise ValueError(f"Primitive inconnue: {kind}")
+
+
+def _document(width, height, shape_obj, elements, background=None):
+    shape_cfg = json.dumps(shape_obj.to_dict(), sort_keys=True).replace('"', "&quot;")
+    lines = [
+        f'<svg xmlns="{_SVG_NS}" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" data-shape="{shape_cfg}">'
+    ]
+    if background is not None:
+        lines.append(f'<rect x="0" y="0" width="{width}" height="{height}" fill="{_hex(background)}"/>')
+    lines.extend(elements)
+    lines.append("</svg>")
+    return "\n".join(lines) + "\n"
+
+
+def _write(text, path):
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
+
+
+def grid_to_svg(rects, width, height, shape="rectangle", path=None, background=(0, 0, 0)):
+    """Exporte une grille (``ColorGrid`` ou liste de dictionnaires) en SVG.
+
+    Une primitive par cellule, dans l'ordre de la grille, sur un fond
+    ``background`` (None pour un fond transparent). Retourne le texte SVG
+    et l'écrit dans ``path`` s'il est donné.
+    """
+    grid = as_color_grid(rects)
+    shape_obj = create_shape(shape)
+    with span("svg", shapes=len(grid)):
+        elements = []
+        for center_x, center_y, cell_w, cell_h, row, color in _cell_placements(grid, width, height):
+            kind, coords = shape_obj.geometry(width, height, center_x, center_y, cell_w, cell_h, row)
+            elements.append(_primitive_element(kind, coords, _hex(color)))
+        count("svg_elements", len(elements))
+        return _write(_document(width, height, shape_obj, elements, background), path)
+
+
+def placements_to_svg(result, width, height, path=None):
+    """Exporte le résultat de ``optimizer.optimize_shapes`` en SVG (opacité ``alpha``)."""
+    shape_cfg = dict(result["shape"])
+    shape_obj = create_shape(shape_cfg["type"]).from_dict(shape_cfg)
+    with span("svg", shapes=len(result["shapes"])):
+        elements = []
+        for p in result["shapes"]:
+            kind, coords = shape_obj.geometry(
+                width, height, p["x"], p["y"], p["cell_width"], p["cell_height"], _FREE_ROW
+            )
+            elements.append(_primitive_element(kind, coords, _hex(p["color"]), result["alpha"]))
+        count("svg_elements", len(elements))
+        return _write(_document(width, height, shape_obj, elements, result["background"]), path)
+
+
+def _parse_color(value):
+    value = value.lstrip("#")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def rasterize_svg(source, scale=1.0):
+    """Redessine un SVG produit par ce module avec PIL (ordre du peintre, opacité comprise).
+
+    ``source`` est un chemin ou le texte SVG ; ``scale`` agrandit ou réduit
+    le rendu. Retourne une image PIL RGB.
+    """
+    if source.lstrip().startswith("<"):
+        root = ET.fromstring(source)
+    else:
+        root = ET.parse(source).getroot()
+    width = max(1, int(round(float(root.get("width")) * scale)))
+    height = max(1, int(round(float(root.get("height")) * scale)))
+    img = Image.new("RGB", (width, height), (0, 0, 0))
+    draw = ImageDraw.Draw(img, "RGBA")
+
+    with span("rasterize_svg"):
+        for el in root:
+            tag = el.tag.rsplit("}", 1)[-1]
+            fill = _parse_color(el.get("fill", "#000000"))
+            opacity = el.get("fill-opacity")
+            if opacity is not None:
+                fill = fill + (int(round(float(opacity) * 255)),)
+            if tag == "rect":
+                x, y = float(el.get("x")), float(el.get("y"))
+                w, h = float(el.get("width")), float(el.get("height"))
+                # Largeur SVG en pixels couverts ; PIL attend des bornes incluses,
+                # retranchées après mise à l'échelle pour que les rectangles restent jointifs
+                kind, coords = "rectangle", [x * scale, y * scale, (x + w) * scale - 1, (y + h) * scale - 1]
+            elif tag == "ellipse":
+                cx, cy = float(el.get("cx")), float(el.get("cy"))
+                rx, ry = float(el.get("rx")), float(el.get("ry"))
+                kind, coords = "ellipse", [cx - rx, cy - ry, cx + rx, cy + ry]
+            elif tag == "polygon":
+                points = [tuple(map(float, p.split(","))) for p in el.get("points").split()]
+                kind, coords = "polygon", points
+            else:
+                continue
+            if kind == "polygon":
+                coords = [(x * scale, y * scale) for x, y in coords]
+            elif kind == "ellipse":
+                coords = [v * scale for v in coords]
+            _draw_primitive(draw, kind, coords, 0, 0, fill=fill)
+    return img
+
+
+__all__ = ["grid_to_svg", "placements_to_svg", "rasterize_svg"]
@@ -0,0 +1,200 @@
+"""Balayage de paramètres : matrice forme × nombre de formes pour chaque image.
+
+Chaque image est décodée une seule fois et ses tables de sommes cumulées
+(couleurs moyennes et variances de n'importe quelle grille) sont calculées
+une seule fois ; toutes les grilles en sont dérivées, et les rendus
+partagent le cache de gabarits de masques. Le résultat est une table
+MSE / nombre de formes / temps, avec les réglages Pareto-optimaux.
+
+    python3 sweep.py --input images --count 16 64 256 1024 --output sweep.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from batch import collect_images
+from image_processor import (
+    apply_grayscale,
+    compute_integral_images,
+    compute_mse,
+    image_to_color_grid,
+    load_image_to_array,
+)
+from instrumentation import span
+from mask_cache import default_mask_cache
+from metrics import psnr_from_mse
+from render import render_image, save_image
+
+SHAPE_TYPES = ["rectangle", "triangle", "circle", "diamond", "star"]
+DEFAULT_COUNTS = [16, 64, 256, 1024, 4096]
+
+SWEEP_FIELDS = [
+    "source",
+    "shape",
+    "requested",
+    "shapes",
+    "mse",
+    "psnr",
+    "analysis_s",
+    "render_s",
+    "mse_s",
+    "total_s",
+    "pareto",
+]
+
+# Objectifs à minimiser pour le front de Pareto
+PARETO_OBJECTIVES = ("shapes", "mse", "total_s")
+
+
+def sweep_image(src, shapes=SHAPE_TYPES, counts=DEFAULT_COUNTS, source="", mask_cache=default_mask_cache,
+                render_workers=None, output_dir=None, progress=None):
+    """Rend ``src`` pour toutes les combinaisons forme × nombre et retourne une ligne par rendu.
+
+    Les grilles sont toutes calculées à partir des mêmes tables de sommes
+    cumulées ; une grille est partagée par toutes les formes d'un même
+    nombre (``analysis_s`` est son temps de calcul). Avec ``output_dir``,
+    chaque rendu est aussi enregistré en PNG. Une source ``(H, W)`` à un
+    seul canal est rendue en mode "L".
+    """
+    height, width = src.shape[:2]
+    mode = "L" if src.ndim == 2 else "RGB"
+    with span("sweep_index"):
+        integral = compute_integral_images(src)
+
+    rows = []
+    for count in counts:
+        t0 = time.perf_counter()
+        grid = image_to_color_grid(None, max_rectangles=count, src_img=src, integral=integral)
+        analysis_s = time.perf_counter() - t0
+        for shape in shapes:
+            t1 = time.perf_counter()
+            img_out = render_image(grid, width, height, shape=shape, mask_cache=mask_cache,
+                                   workers=render_workers, mode=mode)
+            t2 = time.perf_counter()
+            mse = compute_mse(src, img_out)
+            t3 = time.perf_counter()
+            row = {
+                "source": source,
+                "shape": shape,
+                "requested": count,
+                "shapes": len(grid),
+                "mse": mse,
+                "psnr": psnr_from_mse(mse),
+                "analysis_s": analysis_s,
+                "render_s": t2 - t1,
+                "mse_s": t3 - t2,
+                "total_s": analysis_s + (t2 - t1),
+            }
+            if output_dir is not None:
+                stem = os.path.splitext(os.path.basename(source))[0] or "image"
+                save_image(img_out, os.path.join(output_dir, f"{stem}_{shape}_{count}.png"))
+            rows.append(row)
+            if progress is not None:
+                progress(row)
+    return rows
+
+
+def pareto_front(rows, objectives=PARETO_OBJECTIVES):
+    """Retourne les lignes non dominées (aucune autre n'est meilleure ou égale sur tous les objectifs)."""
+    front = []
+    for row in rows:
+        values = [row[k] for k in objectives]
+        dominated = False
+        for other in rows:
+            if other is row:
+                continue
+            others = [other[k] for k in objectives]
+            if all(o <= v for o, v in zip(others, values)) and any(o < v for o, v in zip(others, values)):
+                dominated = True
+                break
+        if not dominated:
+            front.append(row)
+    return front
+
+
+def run_sweep(paths, shapes=SHAPE_TYPES, counts=DEFAULT_COUNTS, grayscale=False, render_workers=None,
+              output_dir=None, objectives=PARETO_OBJECTIVES, progress=None):
+    """Balaye chaque image de ``paths`` ; marque ``pareto=True`` les réglages optimaux de chaque image."""
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for path in paths:
+        src = load_image_to_array(path)
+        if grayscale:
+            src = apply_grayscale(src, single_channel=True)
+        rows = sweep_image(src, shapes, counts, source=path, render_workers=render_workers,
+                           output_dir=output_dir, progress=progress)
+        front = pareto_front(rows, objectives)
+        for row in rows:
+            row["pareto"] = any(row is r for r in front)
+        results.extend(rows)
+    return results
+
+
+def write_table(rows, path):
+    """Écrit la table du balayage en CSV ou en JSON (selon l'extension)."""
+    if path.lower().endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=SWEEP_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Balayage forme × nombre de formes (analyse partagée).")
+    parser.add_argument("--input", "-i", required=True,
+                        help="Dossier d'images ou motif glob (ex: 'images/*.jpg')")
+    parser.add_argument("--shape", "-s", nargs="+", default=SHAPE_TYPES, choices=SHAPE_TYPES,
+                        help="Formes à comparer (défaut : toutes)")
+    parser.add_argument("--count", "-n", nargs="+", type=int, default=DEFAULT_COUNTS,
+                        help="Nombres de formes à comparer")
+    parser.add_argument("--grayscale", "-g", action="store_true",
+                        help="Appliquer le filtre Noir et Blanc")
+    parser.add_argument("--render-threads", type=int, default=None,
+                        help="Threads de rendu par image (rendu par bandes parallèles)")
+    parser.add_argument("--save-dir", default=None, help="Enregistrer aussi les rendus dans ce dossier")
+    parser.add_argument("--output", "-o", default=None, help="Table des résultats (.csv ou .json)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = collect_images(args.input)
+    if not paths:
+        print("Aucune image trouvée :", args.input)
+        return 1
+
+    print(f"{'source':<24} {'forme':<10} {'nombre':>7} {'formes':>7} {'MSE':>10} {'PSNR':>7} {'temps':>9}")
+
+    def progress(row):
+        name = os.path.basename(row["source"])[:24]
+        print(f"{name:<24} {row['shape']:<10} {row['requested']:>7} {row['shapes']:>7} "
+              f"{row['mse']:>10.2f} {row['psnr']:>7.2f} {row['total_s'] * 1000:>7.1f}ms")
+
+    rows = run_sweep(paths, args.shape, args.count, args.grayscale, args.render_threads,
+                     args.save_dir, progress=progress)
+
+    print("\n=== Réglages Pareto-optimaux (formes, MSE, temps) ===")
+    for row in rows:
+        if row["pareto"]:
+            print(f"{os.path.basename(row['source'])}: {row['shape']} × {row['requested']} "
+                  f"(MSE {row['mse']:.2f}, {row['total_s'] * 1000:.1f} ms)")
+    if args.output:
+        write_table(rows, args.output)
+        print("Table enregistrée :", args.output)
+    return 0
+
+
+__all__ = ["sweep_image", "run_sweep", "pareto_front", "write_table", "SWEEP_FIELDS"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
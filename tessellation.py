@@ -0,0 +1,233 @@
+"""Pavages sans recouvrement : les formes sont placées pour se juxtaposer.
+
+La grille classique agrandit chaque forme pour masquer les trous
+(triangles 3,5× la cellule, 4,5× sur la ligne 0 ; cercles 1,2× ; losanges
+1,8× ; étoiles 1,6×) : chaque pixel est composé de nombreuses fois, puis
+normalisé par ``weight_map``. Ici, chaque type de forme a son propre
+pavage, sans multiplicateur :
+
+- ``triangle``  : bandes de triangles alternativement pointe en haut et en bas ;
+- ``diamond``   : losanges sur un réseau carré tourné de 45° ;
+- ``circle``    : empilement hexagonal (lignes décalées d'une demi-période),
+  cercles circonscrits aux hexagones : recouvrement minimal sans trou ;
+- ``star``      : même empilement hexagonal que les cercles (voir ``STAR_SCALE``).
+
+Les rectangles de la grille uniforme en sont déjà un pavage ; ils ne sont
+pas concernés.
+
+Les tuiles du bord gardent leur boîte entière et débordent de l'image
+(``ColorGrid.variants``). La couleur de chaque tuile est la moyenne des
+pixels de son masque réel (``footprint_colors``), et non de sa boîte.
+"""
+
+import math
+
+import numpy as np
+
+from grid import ColorGrid
+from image_processor import load_image_to_array
+from instrumentation import span, count
+from mask_cache import default_mask_cache
+from render import _stamp_factory
+from shapes import CircleShape, DiamondShape, StarShape, StripTriangleShape, create_shape
+
+TILINGS = {
+    "triangle": "strips",
+    "diamond": "lattice",
+    "circle": "hex",
+    "star": "hex",
+}
+
+# Diamètre extérieur des étoiles, relatif à celui des cercles de l'empilement hexagonal :
+# les étoiles ne pavent pas le plan ; à 1,5 elles laissent moins de trous que la
+# grille classique (étoiles 1,6×) pour moins de pixels composés
+STAR_SCALE = 1.5
+
+
+def tile_shape(shape_type):
+    """Forme paramétrée pour remplir exactement (ou presque) une tuile de ``shape_type``."""
+    if shape_type == "triangle":
+        return StripTriangleShape()
+    if shape_type == "diamond":
+        return DiamondShape(size_multiplier=1.0)
+    if shape_type == "circle":
+        return CircleShape(radius_multiplier=0.5)
+    if shape_type == "star":
+        return StarShape(size_multiplier=1.0)
+    raise ValueError(f"Type de forme inconnu: {shape_type}")
+
+
+def _even(value):
+    """Entier pair >= 2 le plus proche de ``value``."""
+    return max(2, 2 * int(round(value / 2.0)))
+
+
+def _strip_tiles(width, height, size):
+    # Base ``size`` (paire) et hauteur d'un triangle presque équilatéral ; les
+    # centres sont espacés d'une demi-base et l'orientation alterne le long de
+    # la bande et d'une bande à l'autre.
+    base = size
+    tri_h = max(1, int(round(base * math.sqrt(3) / 2)))
+    half = base // 2
+    n_cols = -(-width // half) + 1
+    n_rows = -(-height // tri_h)
+    cols, rows = np.meshgrid(np.arange(n_cols), np.arange(n_rows))
+    cols, rows = cols.ravel(), rows.ravel()
+    lefts = cols * half - half
+    tops = rows * tri_h
+    return lefts, tops, base, tri_h, rows, cols, ((cols + rows) % 2).astype(np.int8)
+
+
+def _offset_rows(width, height, pitch, row_h):
+    """Centres d'un réseau à lignes décalées d'une demi-période (une ligne sur deux).
+
+    Sur chaque ligne, le premier centre est à gauche de 0 (ou sur 0) et le
+    dernier à droite de ``width`` (ou sur ``width``) ; de même verticalement. Retourne ``(rows, cols, xs, ys)``.
+    """
+    half = pitch // 2
+    n_rows = -(-height // row_h) + 1
+    rows, cols, xs = [], [], []
+    for r in range(n_rows):
+        offset = half if r % 2 else 0
+        line = np.arange(offset - (pitch if offset else 0), width + pitch, pitch)
+        rows.append(np.full(len(line), r))
+        cols.append(np.arange(len(line)))
+        xs.append(line)
+    rows = np.concatenate(rows)
+    return rows, np.concatenate(cols), np.concatenate(xs), rows * row_h
+
+
+def _lattice_tiles(width, height, size):
+    # Réseau carré tourné de 45° : centres espacés de ``size`` sur une ligne,
+    # lignes espacées d'une demi-diagonale et décalées d'une demi-période
+    half = size // 2
+    rows, cols, xs, ys = _offset_rows(width, height, size, half)
+    return xs - half, ys - half, size, size, rows, cols, np.zeros(len(rows), dtype=np.int8)
+
+
+def _hex_tiles(width, height, size, scale=1.0):
+    # Empilement hexagonal de pas horizontal ``size`` (pair) ; le diamètre des
+    # formes couvre le rayon de recouvrement du réseau (centre des triangles
+    # formés par trois centres voisins).
+    half = size // 2
+    row_h = max(1, int(round(size * math.sqrt(3) / 2)))
+    radius = (half * half + row_h * row_h) / (2.0 * row_h)
+    diameter = _even(2 * math.ceil(radius * scale))
+    rows, cols, xs, ys = _offset_rows(width, height, size, row_h)
+    r = diameter // 2
+    return xs - r, ys - r, diameter, diameter, rows, cols, np.zeros(len(rows), dtype=np.int8)
+
+
+def _initial_size(tiling, area):
+    """Pas du pavage donnant des tuiles d'aire ``area`` (pixels)."""
+    if tiling == "strips":
+        return _even(math.sqrt(4 * area / math.sqrt(3)))
+    if tiling == "lattice":
+        return _even(math.sqrt(2 * area))
+    return _even(math.sqrt(2 * area / math.sqrt(3)))
+
+
+def tile_layout(shape_type, width, height, max_shapes=256):
+    """Pavage de ``shape_type`` couvrant l'image avec au plus ``max_shapes`` tuiles.
+
+    Retourne un ``ColorGrid`` (couleurs nulles) dont les cellules sont les
+    boîtes englobantes des tuiles visibles ; le pas est agrandi jusqu'à ce
+    que le nombre de tuiles, bords compris, ne dépasse pas ``max_shapes``.
+    """
+    if shape_type not in TILINGS:
+        raise ValueError(f"Type de forme inconnu: {shape_type}")
+    if max_shapes is None or max_shapes <= 0:
+        raise ValueError("max_shapes doit être > 0")
+    tiling = TILINGS[shape_type]
+    size = _initial_size(tiling, width * height / float(max_shapes))
+
+    while True:
+        if tiling == "strips":
+            tiles = _strip_tiles(width, height, size)
+        elif tiling == "lattice":
+            tiles = _lattice_tiles(width, height, size)
+        else:
+            tiles = _hex_tiles(width, height, size, STAR_SCALE if shape_type == "star" else 1.0)
+        lefts, tops, tile_w, tile_h, rows, cols, variants = tiles
+        visible = (lefts + tile_w > 0) & (tops + tile_h > 0) & (lefts < width) & (tops < height)
+        n = int(np.count_nonzero(visible))
+        if n <= max_shapes or size >= 2 * max(width, height):
+            break
+        size += 2
+
+    count("tiles", n)
+    return ColorGrid(
+        rows[visible],
+        cols[visible],
+        lefts[visible],
+        tops[visible],
+        np.full(n, tile_w),
+        np.full(n, tile_h),
+        np.zeros((n, 3), dtype=np.uint8),
+        regular=False,
+        variants=variants[visible],
+    )
+
+
+def footprint_colors(src, grid, shape, mask_cache=default_mask_cache):
+    """Couleur moyenne des pixels recouverts par le masque réel de chaque tuile.
+
+    Les masques sont ceux du rendu (mêmes gabarits), la moyenne est pondérée
+    par leur anticrénelage. Retourne un tableau ``(n, 3)`` uint8 (les canaux
+    d'une source ``(H, W)`` sont répétés).
+    """
+    height, width = src.shape[:2]
+    arr = src if src.ndim == 3 else src[:, :, None]
+    make_stamp = _stamp_factory(create_shape(shape), width, height, mask_cache)
+    sums = np.zeros((len(grid), arr.shape[2]), dtype=np.float64)
+    weights = np.zeros(len(grid), dtype=np.float64)
+
+    placements = zip(
+        (grid.lefts + grid.widths / 2.0).tolist(),
+        (grid.tops + grid.heights / 2.0).tolist(),
+        grid.widths.tolist(),
+        grid.heights.tolist(),
+        (grid.rows if grid.variants is None else grid.variants).tolist(),
+        [None] * len(grid),
+    )
+    pixels = 0
+    for i, placement in enumerate(placements):
+        mask, mx, my, _ = make_stamp(placement)
+        if not mask.size:
+            continue
+        mh, mw = mask.shape
+        weights[i] = mask.sum(dtype=np.float64)
+        sums[i] = np.tensordot(mask, arr[my:my + mh, mx:mx + mw], axes=([0, 1], [0, 1]))
+        pixels += mask.size
+    count("pixels_analysed", pixels)
+
+    means = np.rint(sums / np.maximum(weights, 1e-12)[:, None])
+    colors = np.clip(means, 0, 255).astype(np.uint8)
+    if colors.shape[1] == 1:
+        colors = np.repeat(colors, 3, axis=1)
+    return colors
+
+
+def image_to_tiled_grid(path, shape="triangle", max_shapes=256, src_img=None, mask_cache=default_mask_cache):
+    """Analyse une image sur le pavage de ``shape`` (voir ``tile_layout``).
+
+    Retourne un ``ColorGrid`` à rendre avec la forme ``tile_shape(shape)`` :
+    ``render_image(grid, w, h, shape=tile_shape(shape))``.
+    """
+    if src_img is None:
+        src_img = load_image_to_array(path)
+    height, width = src_img.shape[:2]
+    with span("analysis", engine="tessellate"):
+        grid = tile_layout(shape, width, height, max_shapes)
+        grid.colors = footprint_colors(src_img, grid, tile_shape(shape), mask_cache)
+    return grid
+
+
+__all__ = [
+    "image_to_tiled_grid",
+    "tile_layout",
+    "tile_shape",
+    "footprint_colors",
+    "TILINGS",
+    "STAR_SCALE",
+]
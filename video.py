@@ -0,0 +1,335 @@
+"""Mode séquence d'images (GIF animé, APNG, dossier de frames) temporellement cohérent.
+
+La grille est fixée une fois pour toute la séquence : la géométrie des
+formes (et donc leurs masques et la carte de poids) ne change pas d'une
+frame à l'autre. Pour chaque frame :
+
+- les moyennes des cellules ne sont recalculées que pour les lignes de la
+  grille dont les pixels ont changé depuis la frame précédente ;
+- seules les cellules dont la couleur varie de plus de ``threshold`` (sur
+  au moins un canal) sont recolorées ;
+- seules les boîtes englobantes de ces formes sont recomposées, à partir
+  de toutes les formes qui les recouvrent (dans l'ordre du rendu complet).
+
+Le décodage et l'encodage tournent sur des threads séparés, reliés par des
+files bornées. Avec ``threshold=0`` chaque frame est identique à
+``render_image(image_to_color_grid(frame))``.
+
+    python3 video.py animation.gif mosaique.gif --shape circle --count 256 --threshold 6
+"""
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+try:
+    from PIL import Image, ImageSequence
+except Exception as exc:
+    raise RuntimeError(
+        "Pillow (PIL) n'est pas installé. Installez-le avec 'pip install Pillow'."
+    ) from exc
+
+import numpy as np
+
+from batch import collect_images
+from grid import ColorGrid
+from image_processor import apply_grayscale, grid_layout
+from instrumentation import span, count
+from mask_cache import default_mask_cache
+from render import _cell_placements, _stamp_factory
+from shapes import create_shape
+
+SHAPE_TYPES = ["rectangle", "triangle", "circle", "diamond", "star"]
+
+# Au-delà de cette fraction de formes modifiées, la frame est recomposée entièrement
+_FULL_RENDER_FRACTION = 0.5
+
+_END = object()
+
+
+class FrameMosaic:
+    """Rendu incrémental d'une suite de frames de même taille sur une grille fixe."""
+
+    def __init__(self, width, height, shape="rectangle", max_rectangles=None, grid_cols=16, grid_rows=16,
+                 threshold=0, mask_cache=default_mask_cache):
+        self.width = width
+        self.height = height
+        self.threshold = threshold
+        self.x_edges, self.y_edges = grid_layout(width, height, grid_cols, grid_rows, max_rectangles)
+        self._xs = np.minimum(self.x_edges, width)
+        self._ys = np.minimum(self.y_edges, height)
+        n_rows = len(self.y_edges) - 1
+        n_cols = len(self.x_edges) - 1
+        self._counts = (self._ys[1:, None] - self._ys[:-1, None]) * (self._xs[None, 1:] - self._xs[None, :-1])
+
+        # Géométrie fixe : masques, boîtes englobantes et carte de poids calculés une fois
+        grid = ColorGrid.from_edges(self.x_edges, self.y_edges, np.zeros((n_rows, n_cols, 3), dtype=np.uint8))
+        right = np.minimum(width, grid.lefts + grid.widths)
+        bottom = np.minimum(height, grid.tops + grid.heights)
+        visible = np.nonzero((right > grid.lefts) & (bottom > grid.tops))[0]
+        make_stamp = _stamp_factory(create_shape(shape), width, height, mask_cache)
+        with span("rasterize"):
+            stamps = [make_stamp(p) for p in _cell_placements(grid, width, height)]
+        keep = [i for i, s in enumerate(stamps) if s[0].size]
+        self._masks = [stamps[i][0] for i in keep]
+        self._cells = visible[keep]
+        self._lefts = np.array([stamps[i][1] for i in keep], dtype=np.int64)
+        self._tops = np.array([stamps[i][2] for i in keep], dtype=np.int64)
+        self._rights = self._lefts + np.array([m.shape[1] for m in self._masks], dtype=np.int64)
+        self._bottoms = self._tops + np.array([m.shape[0] for m in self._masks], dtype=np.int64)
+
+        weight_map = np.zeros((height, width), dtype=np.float32)
+        for mask, x, y in zip(self._masks, self._lefts.tolist(), self._tops.tolist()):
+            weight_map[y:y + mask.shape[0], x:x + mask.shape[1]] += mask
+        self._weight = np.maximum(weight_map, 1e-6)
+
+        self._accum = np.zeros((height, width, 3), dtype=np.float32)
+        self._out = np.zeros((height, width, 3), dtype=np.uint8)
+        self._sums = np.zeros((n_rows, n_cols, 3), dtype=np.int64)
+        self._colors = None
+        self._prev = None
+        self.stats = {"frames": 0, "full_renders": 0, "shapes_updated": 0, "grid_rows_analysed": 0}
+
+    # --- Analyse ------------------------------------------------------------
+
+    def _update_sums(self, frame):
+        """Recalcule les sommes des cellules des lignes de la grille modifiées depuis la frame précédente."""
+        for r in range(len(self._ys) - 1):
+            y0, y1 = int(self._ys[r]), int(self._ys[r + 1])
+            if y1 <= y0:
+                continue
+            band = frame[y0:y1]
+            if self._prev is not None and np.array_equal(band, self._prev[y0:y1]):
+                continue
+            column_sums = np.zeros((self.width + 1, 3), dtype=np.int64)
+            np.cumsum(band.sum(axis=0, dtype=np.int64), axis=0, out=column_sums[1:])
+            self._sums[r] = column_sums[self._xs[1:]] - column_sums[self._xs[:-1]]
+            self.stats["grid_rows_analysed"] += 1
+
+    def cell_colors(self):
+        """Couleurs moyennes exactes (arrondies) des cellules de la dernière frame, ``(lignes, colonnes, 3)``."""
+        counts = self._counts[:, :, None]
+        safe = np.maximum(counts, 1)
+        return np.where(counts > 0, (2 * self._sums + safe) // (2 * safe), 0)
+
+    # --- Composition --------------------------------------------------------
+
+    def _composite(self, colors, region=None):
+        """Recompose ``region`` (gauche, haut, droite, bas) ou toute l'image, formes dans l'ordre."""
+        if region is None:
+            x0, y0, x1, y1 = 0, 0, self.width, self.height
+            idx = range(len(self._masks))
+        else:
+            x0, y0, x1, y1 = region
+            idx = np.nonzero(
+                (self._lefts < x1) & (self._rights > x0) & (self._tops < y1) & (self._bottoms > y0)
+            )[0].tolist()
+        accum = self._accum[y0:y1, x0:x1]
+        accum[:] = 0
+        for i in idx:
+            mask = self._masks[i]
+            mx, my = int(self._lefts[i]), int(self._tops[i])
+            cx0, cy0 = max(x0, mx), max(y0, my)
+            cx1, cy1 = min(x1, mx + mask.shape[1]), min(y1, my + mask.shape[0])
+            part = mask[cy0 - my:cy1 - my, cx0 - mx:cx1 - mx]
+            window = accum[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+            color = colors[i]
+            for c in range(3):
+                window[:, :, c] += part * color[c]
+        weight = self._weight[y0:y1, x0:x1]
+        normalized = np.empty_like(accum)
+        for c in range(3):
+            np.divide(accum[:, :, c], weight, out=normalized[:, :, c])
+        self._out[y0:y1, x0:x1] = np.clip(normalized, 0, 255).astype(np.uint8)
+
+    def update(self, frame):
+        """Intègre une nouvelle frame (tableau RGB uint8) et retourne l'image PIL rendue."""
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError("Toutes les frames doivent avoir la même taille")
+        with span("analysis"):
+            self._update_sums(frame)
+            means = self.cell_colors().reshape(-1, 3)[self._cells].astype(np.float32)
+        self._prev = frame
+
+        with span("composite"):
+            if self._colors is None:
+                changed = np.arange(len(self._masks))
+            else:
+                delta = np.abs(means - self._colors).max(axis=1)
+                changed = np.nonzero(delta > self.threshold)[0]
+            if self._colors is None or len(changed) > _FULL_RENDER_FRACTION * len(self._masks):
+                self._colors = means
+                self._composite(self._colors)
+                self.stats["full_renders"] += 1
+            else:
+                # Seules les cellules au-delà du seuil changent de couleur
+                self._colors[changed] = means[changed]
+                regions = [
+                    (int(self._lefts[i]), int(self._tops[i]), int(self._rights[i]), int(self._bottoms[i]))
+                    for i in changed.tolist()
+                ]
+                for region in _merge_regions(regions):
+                    self._composite(self._colors, region)
+            self.stats["shapes_updated"] += len(changed)
+            count("shapes_updated", len(changed))
+        self.stats["frames"] += 1
+        return Image.fromarray(self._out.copy(), mode="RGB")
+
+
+def _merge_regions(regions):
+    """Fusionne les rectangles (gauche, haut, droite, bas) qui se recouvrent en leur boîte englobante."""
+    merged = []
+    for region in sorted(regions):
+        x0, y0, x1, y1 = region
+        i = 0
+        while i < len(merged):
+            a0, b0, a1, b1 = merged[i]
+            if a0 < x1 and x0 < a1 and b0 < y1 and y0 < b1:
+                # Le rectangle fusionné peut en recouvrir d'autres : on recommence avec lui
+                x0, y0, x1, y1 = min(a0, x0), min(b0, y0), max(a1, x1), max(b1, y1)
+                merged.pop(i)
+                i = 0
+            else:
+                i += 1
+        merged.append((x0, y0, x1, y1))
+    return merged
+
+
+def iter_frames(source):
+    """Génère ``(frame RGB uint8, durée en ms)`` depuis une image animée, un dossier ou un motif glob."""
+    if os.path.isfile(source):
+        with Image.open(source) as im:
+            for frame in ImageSequence.Iterator(im):
+                duration = frame.info.get("duration", im.info.get("duration", 100))
+                yield np.array(frame.convert("RGB"), dtype=np.uint8), duration
+        return
+    for path in collect_images(source):
+        with Image.open(path) as im:
+            yield np.array(im.convert("RGB"), dtype=np.uint8), 100
+
+
+def _decode_worker(source, grayscale, frames):
+    try:
+        for frame, duration in iter_frames(source):
+            frames.put((apply_grayscale(frame) if grayscale else frame, duration))
+    except Exception as exc:
+        frames.put(exc)
+    frames.put(_END)
+
+
+def _encode_worker(output, encoded, done):
+    """Enregistre les frames : GIF animé (``.gif``) ou PNG numérotés dans un dossier.
+
+    En cas d'erreur, celle-ci est ajoutée à ``done`` et la file continue
+    d'être vidée jusqu'à ``_END`` : le producteur n'est jamais bloqué.
+    """
+    gif = output.lower().endswith(".gif")
+    palettes = []
+    durations = []
+    index = 0
+    item = None
+    try:
+        if not gif:
+            os.makedirs(output, exist_ok=True)
+        while True:
+            item = encoded.get()
+            if item is _END:
+                break
+            img, duration = item
+            with span("encode"):
+                if gif:
+                    palettes.append(img.quantize(colors=256))
+                    durations.append(duration)
+                else:
+                    img.save(os.path.join(output, f"frame_{index:05d}.png"))
+            index += 1
+        if gif and palettes:
+            with span("encode"):
+                palettes[0].save(output, save_all=True, append_images=palettes[1:], duration=durations, loop=0)
+    except Exception as exc:
+        done.append(exc)
+        while item is not _END:
+            item = encoded.get()
+
+
+def render_sequence(source, output, shape="rectangle", max_rectangles=None, threshold=0, grayscale=False,
+                    queue_size=4, mask_cache=default_mask_cache, progress=None):
+    """Applique la mosaïque à toutes les frames de ``source`` et écrit ``output``.
+
+    ``source`` : GIF/APNG/WebP animé, dossier ou motif glob de frames.
+    ``output`` : fichier ``.gif`` animé, ou dossier de PNG numérotés.
+    Le décodage et l'encodage tournent en arrière-plan (files de
+    ``queue_size`` frames). Retourne les statistiques du rendu incrémental
+    et le temps total.
+    """
+    frames = queue.Queue(maxsize=queue_size)
+    encoded = queue.Queue(maxsize=queue_size)
+    errors = []
+    decoder = threading.Thread(target=_decode_worker, args=(source, grayscale, frames), daemon=True)
+    encoder = threading.Thread(target=_encode_worker, args=(output, encoded, errors), daemon=True)
+    decoder.start()
+    encoder.start()
+
+    start = time.perf_counter()
+    mosaic = None
+    try:
+        while True:
+            item = frames.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if errors:
+                # L'encodeur a échoué : inutile de rendre les frames suivantes
+                break
+            frame, duration = item
+            if mosaic is None:
+                h, w = frame.shape[:2]
+                mosaic = FrameMosaic(w, h, shape, max_rectangles, threshold=threshold, mask_cache=mask_cache)
+            encoded.put((mosaic.update(frame), duration))
+            if progress is not None:
+                progress(mosaic.stats)
+    finally:
+        encoded.put(_END)
+        encoder.join()
+    if errors:
+        raise errors[0]
+    if mosaic is None:
+        raise ValueError(f"Aucune frame trouvée : {source}")
+
+    result = dict(mosaic.stats)
+    result["seconds"] = time.perf_counter() - start
+    result["shapes"] = len(mosaic._masks)
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mosaïque de formes sur une animation ou une suite de frames.")
+    parser.add_argument("input", help="GIF/APNG animé, dossier ou motif glob de frames")
+    parser.add_argument("output", help="Fichier .gif animé ou dossier de PNG")
+    parser.add_argument("--shape", "-s", default="rectangle", choices=SHAPE_TYPES)
+    parser.add_argument("--count", "-n", type=int, default=None, help="Nombre de formes (défaut : grille 16x16)")
+    parser.add_argument("--threshold", "-t", type=float, default=0,
+                        help="Variation de couleur (0-255) en dessous de laquelle une cellule n'est pas redessinée")
+    parser.add_argument("--grayscale", "-g", action="store_true", help="Appliquer le filtre Noir et Blanc")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = render_sequence(args.input, args.output, args.shape, args.count, args.threshold, args.grayscale)
+    fps = result["frames"] / max(result["seconds"], 1e-9)
+    print(f"{result['frames']} frames en {result['seconds']:.2f}s ({fps:.1f} frames/s), "
+          f"{result['shapes_updated']} formes redessinées, {result['full_renders']} rendus complets")
+    print("Résultat enregistré :", args.output)
+    return 0
+
+
+__all__ = ["FrameMosaic", "iter_frames", "render_sequence"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())